@@ -0,0 +1,258 @@
+"""ADS1110 会话的列式存储
+
+固件写出的 ads_YYYYMMDD_HHMMSS_mmm.csv（Timestamp,Voltage(mV),Duration(ms)）
+被转换为一个目录 <会话名>.ads/，各列都保持文件中的采集顺序：
+    time.npy       int64，毫秒：会话开始时刻 + Duration，单调不减，用作时间索引
+    timestamp.npy  int64，毫秒：原始的 RTC 时间戳（与 pd.to_datetime 对 '...Z' 时间的解析一致）
+    voltage.npy    float32，mV
+    duration.npy   int64，ms
+    meta.json      源文件、行数、时间范围
+固件的时间戳是 RTC 秒加上 millis() % 1000，毫秒部分与 RTC 秒不同步，
+每秒都会局部逆序，因此不能用来排序或查找；time 列由单调的 Duration 得到，
+会话开始时刻取 (timestamp - duration) 的中位数，误差在一秒以内。
+读取时用 np.load(mmap_mode='r') 映射文件，按时间查询先在 time 上二分查找，
+只有落在范围内的那部分页会被读入内存。
+
+转换：
+    python ads_store.py convert ../data/*.csv --store ads_store
+查询（某次刺激前后 5 分钟）：
+    store = AdsStore('ads_store')
+    t, v = store.window('2025-05-13T22:56:31.317Z', before=300, after=300)
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+STORE_VERSION = 2
+COLUMNS = ('time', 'timestamp', 'voltage', 'duration')
+
+
+def to_epoch_ms(value):
+    """把 '2025-05-13T22:56:31.317Z'、datetime、datetime64 或毫秒数转换为 int64 毫秒"""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = value.strip().rstrip('Z')
+    elif isinstance(value, datetime):
+        value = value.replace(tzinfo=None)
+    return int(np.datetime64(value, 'ms').astype(np.int64))
+
+
+def parse_timestamps(values):
+    """批量解析时间字符串，返回 int64 毫秒数组"""
+    cleaned = [v.strip().rstrip('Z') for v in values]
+    return np.array(cleaned, dtype='datetime64[ms]').astype(np.int64)
+
+
+def read_ads_csv(path):
+    """读取 ads_*.csv，返回 (timestamp, voltage, duration) 三个数组
+
+    兼容 SD 卡版本固件只有两列（Timestamp, Voltage (mV)）的文件，
+    此时 duration 由时间戳相对第一个样本计算。
+    """
+    stamps = []
+    voltages = []
+    durations = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) < 2 or not parts[0][:1].isdigit():
+                # 表头或空行
+                continue
+            try:
+                voltage = float(parts[1])
+                duration = int(float(parts[2])) if len(parts) > 2 and parts[2].strip() else None
+            except ValueError:
+                continue
+            stamps.append(parts[0])
+            voltages.append(voltage)
+            durations.append(duration)
+
+    timestamp = parse_timestamps(stamps) if stamps else np.zeros(0, dtype=np.int64)
+    voltage = np.array(voltages, dtype=np.float32)
+    if durations and all(d is not None for d in durations):
+        duration = np.array(durations, dtype=np.int64)
+    else:
+        duration = timestamp - timestamp[0] if len(timestamp) else np.zeros(0, dtype=np.int64)
+    return timestamp, voltage, duration
+
+
+def time_axis(timestamp, duration):
+    """由会话开始时刻加 Duration 得到单调的时间轴（int64 毫秒，与文件顺序一一对应）"""
+    if not len(timestamp):
+        return np.zeros(0, dtype=np.int64)
+    start = int(np.median(timestamp - duration))
+    # Duration 本身单调；旧格式由时间戳推算的 duration 可能局部逆序，取累计最大值保证可二分查找
+    return np.maximum.accumulate(start + np.asarray(duration, dtype=np.int64))
+
+
+def session_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def convert(csv_path, store_dir, force=False):
+    """把一个 CSV 会话转换为列式目录，源文件未变化时跳过；返回会话目录"""
+    target = os.path.join(store_dir, session_name(csv_path) + '.ads')
+    stat = os.stat(csv_path)
+    meta_path = os.path.join(target, 'meta.json')
+    if not force and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta.get('version') == STORE_VERSION and meta.get('source_size') == stat.st_size
+                and meta.get('source_mtime') == stat.st_mtime):
+            return target
+
+    timestamp, voltage, duration = read_ads_csv(csv_path)
+    # 样本保持采集顺序；时间戳局部逆序（见模块说明），查找用单调的 time 列
+    time = time_axis(timestamp, duration)
+
+    if not os.path.exists(target):
+        os.makedirs(target)
+    for name, column in zip(COLUMNS, (time, timestamp, voltage, duration)):
+        np.save(os.path.join(target, name + '.npy'), column)
+    meta = {
+        'version': STORE_VERSION,
+        'source': os.path.abspath(csv_path),
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        'rows': int(len(timestamp)),
+        'start': int(time[0]) if len(time) else None,
+        'end': int(time[-1]) if len(time) else None,
+    }
+    # meta.json 最后写入，存在即表示转换完整
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return target
+
+
+class AdsSession:
+    """一个已转换的会话，各列按需内存映射"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)[:-len('.ads')]
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.start = self.meta['start']
+        self.end = self.meta['end']
+        self._columns = {}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    @property
+    def time(self):
+        """单调的时间轴（毫秒），查询与对齐都用它"""
+        return self.column('time')
+
+    @property
+    def timestamp(self):
+        """原始 RTC 时间戳（局部逆序，只作参考）"""
+        return self.column('timestamp')
+
+    @property
+    def voltage(self):
+        return self.column('voltage')
+
+    @property
+    def duration(self):
+        return self.column('duration')
+
+    def slice(self, start_ms, end_ms):
+        """[start_ms, end_ms] 对应的行范围"""
+        stamps = self.time
+        return (int(np.searchsorted(stamps, start_ms, side='left')),
+                int(np.searchsorted(stamps, end_ms, side='right')))
+
+    def range(self, start, end, columns=('time', 'voltage')):
+        """返回时间范围内各列的数组（只读视图）"""
+        lo, hi = self.slice(to_epoch_ms(start), to_epoch_ms(end))
+        return tuple(self.column(name)[lo:hi] for name in columns)
+
+
+class AdsStore:
+    """存储目录中所有会话的集合，按时间范围跨会话查询"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.sessions = []
+        if os.path.isdir(store_dir):
+            for name in sorted(os.listdir(store_dir)):
+                path = os.path.join(store_dir, name)
+                if name.endswith('.ads') and os.path.exists(os.path.join(path, 'meta.json')):
+                    session = AdsSession(path)
+                    if len(session):
+                        self.sessions.append(session)
+        self.sessions.sort(key=lambda s: s.start)
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def find(self, when):
+        """包含时刻 when 的会话，没有时返回 None"""
+        t = to_epoch_ms(when)
+        for session in self.sessions:
+            if session.start <= t <= session.end:
+                return session
+        return None
+
+    def range(self, start, end, columns=('time', 'voltage')):
+        """返回 [start, end] 内所有会话的数据（按时间拼接）"""
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        parts = []
+        for session in self.sessions:
+            if session.end < start_ms or session.start > end_ms:
+                continue
+            lo, hi = session.slice(start_ms, end_ms)
+            if hi > lo:
+                parts.append([session.column(name)[lo:hi] for name in columns])
+        if not parts:
+            return tuple(np.zeros(0, dtype=np.float32 if name == 'voltage' else np.int64) for name in columns)
+        if len(parts) == 1:
+            return tuple(parts[0])
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def window(self, when, before=300.0, after=300.0, columns=('time', 'voltage')):
+        """时刻 when 前 before 秒到后 after 秒的数据"""
+        t = to_epoch_ms(when)
+        return self.range(t - int(before * 1000), t + int(after * 1000), columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert ADS1110 CSV sessions to a memory-mapped columnar store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    conv = commands.add_parser('convert', help="convert CSV files (unchanged files are skipped)")
+    conv.add_argument('csv', nargs='+')
+    conv.add_argument('--store', default='ads_store')
+    conv.add_argument('--force', action='store_true')
+    info = commands.add_parser('info', help="list the sessions in a store")
+    info.add_argument('--store', default='ads_store')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        for path in args.csv:
+            try:
+                target = convert(path, args.store, args.force)
+                print(f"{path} -> {target}")
+            except Exception as e:
+                print(f"转换失败 {path}: {e}")
+    else:
+        for session in AdsStore(args.store):
+            start = np.datetime64(session.start, 'ms')
+            end = np.datetime64(session.end, 'ms')
+            print(f"{session.name}: {len(session)} rows, {start} .. {end}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""M5Core2 ADS1110 实时电压流的 asyncio 客户端
+
+固件（mfs_ads1110_web）在 ws://<设备>:81 上广播
+{"voltage": mV, "timestamp": "HH:MM:SS", "duration": 整秒} 形式的 JSON；
+连接时先发送一帧最近一行 SD 卡记录的状态，其中 timestamp 为完整的 ISO 时间，
+duration 已经是 Duration(ms)。两种帧的时长都换算为毫秒。
+客户端在后台线程中运行事件循环，断线后自动重连；每一帧都用本机的
+单调时钟打上时间戳，写入内存中的 VoltageBuffer，并批量追加到
+ads_stream_YYYYMMDD.csv（列与 SD 卡上的 ads_*.csv 一致，另附本机时间）。
+
+连接设备：
+    python ads_stream.py connect ws://192.168.1.50:81
+没有设备时启动一个发送相同格式数据的本地替身服务器：
+    python ads_stream.py serve --port 8081
+    python ads_stream.py connect ws://localhost:8081
+需要安装 websockets 包。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from event_log import EventLog
+
+STREAM_LOG_HEADER = ['Timestamp', 'Voltage(mV)', 'Duration(ms)', 'Monotonic (s)', 'Device Time']
+
+
+class VoltageBuffer:
+    """预分配的电压样本缓冲区，超出容量后覆盖最旧的样本
+
+    每个样本保存本机单调时钟（秒）、电压（mV）和设备报告的记录时长（秒）。
+    写入端为客户端线程，读取端（界面、分析）通过 snapshot() 取得副本。
+    """
+
+    def __init__(self, capacity=36000):
+        self.capacity = int(capacity)
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self.voltages = np.zeros(self.capacity, dtype=np.float32)
+        self.durations = np.zeros(self.capacity, dtype=np.float32)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, host_time, voltage, duration):
+        with self._lock:
+            i = self.count % self.capacity
+            self.times[i] = host_time
+            self.voltages[i] = voltage
+            self.durations[i] = duration
+            self.count += 1
+
+    def latest(self):
+        """最新的 (本机时间, 电压)，没有数据时返回 None"""
+        with self._lock:
+            if self.count == 0:
+                return None
+            i = (self.count - 1) % self.capacity
+            return self.times[i], self.voltages[i]
+
+    def snapshot(self, since=None):
+        """按时间顺序返回 (times, voltages)；since 为本机单调时钟，只返回其后的样本"""
+        with self._lock:
+            n = len(self)
+            order = (np.arange(self.count - n, self.count)) % self.capacity
+            times = self.times[order]
+            voltages = self.voltages[order]
+        if since is not None:
+            start = np.searchsorted(times, since, side='right')
+            times, voltages = times[start:], voltages[start:]
+        return times, voltages
+
+
+def parse_frame(text):
+    """解析一帧 JSON，返回 (电压, 设备时间字符串, 时长毫秒)；格式不对时返回 None"""
+    try:
+        data = json.loads(text)
+        voltage = float(data['voltage'])
+        device_time = str(data.get('timestamp', ''))
+        duration = float(data.get('duration', 0))
+    except (ValueError, KeyError, TypeError):
+        return None
+    # 带日期的状态帧直接给出毫秒；实时帧只有整秒
+    if 'T' not in device_time:
+        duration *= 1000
+    return voltage, device_time, int(duration)
+
+
+class AdsStreamClient:
+    """连接设备的 WebSocket，自动重连，并把数据写入缓冲区和磁盘
+
+    状态变化通过 add_listener() 注册的回调通知，签名与 AudioEngine 相同：
+    callback(topic, message)，topic 为 'ads'。回调在客户端线程中被调用。
+    """
+
+    def __init__(self, url, buffer=None, logs_dir=None, reconnect_delay=1.0, max_reconnect_delay=30.0):
+        self.url = url
+        if logs_dir and not os.path.exists(logs_dir):
+            os.makedirs(logs_dir)
+        self.buffer = buffer if buffer is not None else VoltageBuffer()
+        self.log = EventLog(logs_dir, "ads_stream", STREAM_LOG_HEADER, time_columns=(0, 0)) if logs_dir else None
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = False
+        self.frames = 0
+        self.bad_frames = 0
+        self.listeners = []
+        self._loop = None
+        self._thread = None
+        self._stopping = None
+        self._stop_requested = False
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def notify(self, message):
+        for callback in list(self.listeners):
+            try:
+                callback('ads', message)
+            except Exception as e:
+                print(f"Error in stream listener: {e}")
+
+    def handle_frame(self, text):
+        """处理收到的一帧"""
+        host_time = time.monotonic()
+        parsed = parse_frame(text)
+        if parsed is None:
+            self.bad_frames += 1
+            return
+        voltage, device_time, duration_ms = parsed
+        self.buffer.append(host_time, voltage, duration_ms / 1000)
+        self.frames += 1
+        if self.log is not None:
+            now = datetime.now()
+            self.log.append([
+                now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+                f"{voltage:.6f}",
+                duration_ms,
+                f"{host_time:.6f}",
+                device_time
+            ])
+
+    async def run(self):
+        """连接并接收数据，直到 stop() 被调用"""
+        try:
+            import websockets
+        except ImportError:
+            self.notify("websockets is not installed (pip install websockets)")
+            return
+
+        self._stopping = asyncio.Event()
+        if self._stop_requested:
+            self._stopping.set()
+        delay = self.reconnect_delay
+        while not self._stopping.is_set():
+            try:
+                async with websockets.connect(self.url, open_timeout=5, ping_interval=10) as ws:
+                    self.connected = True
+                    delay = self.reconnect_delay
+                    self.notify(f"Connected to {self.url}")
+                    receiver = asyncio.ensure_future(self._receive(ws))
+                    stopper = asyncio.ensure_future(self._stopping.wait())
+                    await asyncio.wait([receiver, stopper], return_when=asyncio.FIRST_COMPLETED)
+                    stopper.cancel()
+                    if receiver.done():
+                        receiver.result()
+                        raise ConnectionError("connection closed by the device")
+                    receiver.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.connected:
+                    self.notify(f"Disconnected: {e}")
+                else:
+                    self.notify(f"Connection failed: {e}")
+            self.connected = False
+            if self._stopping.is_set():
+                break
+            # 指数退避重连
+            try:
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.max_reconnect_delay)
+        self.notify("Stream stopped")
+
+    def _request_stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _receive(self, ws):
+        async for message in ws:
+            self.handle_frame(message)
+
+    def start(self):
+        """在后台线程中运行客户端"""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        try:
+            self._loop.run_until_complete(self.run())
+        finally:
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+
+    def stop(self):
+        """断开连接并等待后台线程结束"""
+        if self._thread is None:
+            return
+        self._stop_requested = True
+        try:
+            self._loop.call_soon_threadsafe(self._request_stop)
+        except RuntimeError:
+            # 事件循环已经结束并关闭（例如 websockets 未安装）
+            pass
+        self._thread.join(timeout=5)
+        self._thread = None
+        if self.log is not None:
+            self.log.close()
+
+
+async def serve(host='localhost', port=8081, rate=10.0, base_voltage=50.0):
+    """本地替身服务器：按 rate Hz 向所有客户端广播与固件相同格式的 JSON"""
+    import websockets
+
+    clients = set()
+    started = time.monotonic()
+
+    async def handler(ws, *args):
+        # 与固件相同，连接时先发送一帧状态（ISO 时间戳、毫秒时长）
+        elapsed = time.monotonic() - started
+        now = datetime.now()
+        await ws.send(json.dumps({
+            'voltage': base_voltage,
+            'timestamp': now.strftime("%Y-%m-%dT%H:%M:%S.") + f"{now.microsecond // 1000:03d}Z",
+            'duration': int(elapsed * 1000)
+        }))
+        clients.add(ws)
+        try:
+            await ws.wait_closed()
+        finally:
+            clients.discard(ws)
+
+    async with websockets.serve(handler, host, port):
+        print(f"Serving simulated ADS1110 stream on ws://{host}:{port}")
+        while True:
+            elapsed = time.monotonic() - started
+            # 缓慢漂移加少量噪声，大致模拟菌丝体电位
+            voltage = base_voltage + 5 * math.sin(2 * math.pi * elapsed / 60) + random.gauss(0, 0.3)
+            frame = json.dumps({
+                'voltage': round(voltage, 4),
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'duration': int(elapsed)
+            })
+            for ws in list(clients):
+                try:
+                    await ws.send(frame)
+                except Exception:
+                    clients.discard(ws)
+            await asyncio.sleep(1.0 / rate)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="M5Core2 ADS1110 WebSocket stream client")
+    commands = parser.add_subparsers(dest='command', required=True)
+    connect = commands.add_parser('connect', help="print and log the device stream")
+    connect.add_argument('url', help="e.g. ws://192.168.1.50:81")
+    connect.add_argument('--logs-dir', default="logs")
+    local = commands.add_parser('serve', help="run a local stand-in for the device")
+    local.add_argument('--host', default='localhost')
+    local.add_argument('--port', type=int, default=8081)
+    local.add_argument('--rate', type=float, default=10.0, help="frames per second")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'serve':
+            asyncio.run(serve(args.host, args.port, args.rate))
+        else:
+            client = AdsStreamClient(args.url, logs_dir=args.logs_dir)
+            client.add_listener(lambda topic, message: print(f"[{topic}] {message}"))
+            client.start()
+            try:
+                while True:
+                    time.sleep(1)
+                    latest = client.buffer.latest()
+                    if latest is not None:
+                        print(f"{client.frames} frames, latest {latest[1]:.3f} mV")
+            finally:
+                client.stop()
+    except KeyboardInterrupt:
+        print("\nProgram terminated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""可随机访问的分块无损压缩录音格式（.wavz）
+
+文件结构（小端）：
+    文件头  '<4sHHII'  b'WAVZ'、版本、声道数、采样率、每块帧数
+    数据块  '<III'     帧数、压缩后字节数、原始数据的 CRC32，后接压缩数据
+    索引    每块一条 '<QQ'（块的第一帧、块在文件中的偏移）
+    结尾    '<QQ4s'    索引偏移、总帧数、b'WZIX'
+每块独立压缩：int16 样本按声道做一阶差分（模 2^16，无损），再把低字节和
+高字节分开排列后用 zlib 压缩；压缩率取决于本底噪声，越安静的录音越小。
+读取任意时间段只需要解码与之重叠的几个块。结尾缺失（录音中途崩溃）时，
+读取端顺序扫描块头重建索引，已刷新到磁盘的块都能读出。
+
+    python audio_archive.py compress recordings/*.wav
+    python audio_archive.py extract recordings/ambient_sound_20250513_225631.wavz
+    reader = ArchiveReader('recordings/ambient_sound_20250513_225631.wavz')
+    data = reader.read_seconds(120.0, 130.0)    # (帧, 声道) float32
+"""
+import argparse
+import os
+import struct
+import sys
+import wave
+import zlib
+
+import numpy as np
+
+from wav_writer import StreamingWavWriter, quantize_int16
+
+MAGIC = b'WAVZ'
+INDEX_MAGIC = b'WZIX'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+BLOCK_HEADER = struct.Struct('<III')
+INDEX_ENTRY = struct.Struct('<QQ')
+TRAILER = struct.Struct('<QQ4s')
+EXTENSION = '.wavz'
+
+
+def encode_block(samples, level=6):
+    """(帧, 声道) int16 -> 压缩字节"""
+    u = np.ascontiguousarray(samples, dtype=np.int16).view(np.uint16)
+    delta = np.empty_like(u)
+    delta[:1] = u[:1]
+    np.subtract(u[1:], u[:-1], out=delta[1:])
+    # 低字节在前、高字节在后，差分后的高字节大多为 0x00 / 0xff，更容易压缩
+    shuffled = delta.astype('<u2').view(np.uint8).reshape(-1, 2).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+
+def decode_block(payload, frames, channels):
+    """压缩字节 -> (帧, 声道) int16"""
+    raw = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+    delta = raw.reshape(2, -1).T.copy().view('<u2').reshape(frames, channels)
+    return np.cumsum(delta, axis=0, dtype=np.uint16).view(np.int16)
+
+
+class ArchiveWriter:
+    """按块压缩并追加写入 .wavz 文件"""
+
+    def __init__(self, path, sample_rate, channels=1, block_frames=65536, level=6):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_frames = block_frames
+        self.level = level
+        self.frames = 0
+        self.index = []
+        self._pending = []
+        self._pending_frames = 0
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, channels, sample_rate, block_frames))
+
+    def write(self, samples):
+        """追加 (帧, 声道) 的样本；浮点数据按 [-1, 1] 量化"""
+        samples = np.asarray(samples)
+        if samples.dtype != np.int16:
+            samples = quantize_int16(samples)
+        samples = samples.reshape(len(samples), self.channels)
+        while len(samples):
+            take = min(len(samples), self.block_frames - self._pending_frames)
+            self._pending.append(samples[:take])
+            self._pending_frames += take
+            samples = samples[take:]
+            if self._pending_frames == self.block_frames:
+                self._write_block()
+
+    def flush(self):
+        """把未满的块也写出并刷新到磁盘（块可以短于 block_frames）"""
+        self._write_block()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """写出剩余数据、索引和结尾"""
+        if self._file is None:
+            return
+        try:
+            self._write_block()
+            index_offset = self._file.tell()
+            for entry in self.index:
+                self._file.write(INDEX_ENTRY.pack(*entry))
+            self._file.write(TRAILER.pack(index_offset, self.frames, INDEX_MAGIC))
+        finally:
+            self._file.close()
+            self._file = None
+
+    def _write_block(self):
+        if not self._pending_frames:
+            return
+        block = self._pending[0] if len(self._pending) == 1 else np.concatenate(self._pending)
+        payload = encode_block(block, self.level)
+        crc = zlib.crc32(np.ascontiguousarray(block).tobytes())
+        self.index.append((self.frames, self._file.tell()))
+        self._file.write(BLOCK_HEADER.pack(len(block), len(payload), crc))
+        self._file.write(payload)
+        self.frames += len(block)
+        self._pending = []
+        self._pending_frames = 0
+
+
+class ArchiveReader:
+    """读取 .wavz 文件中任意范围的样本"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        magic, version, self.channels, self.sample_rate, self.block_frames = HEADER.unpack(
+            self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a {EXTENSION} file: {path}")
+        if version > VERSION:
+            raise ValueError(f"Unsupported {EXTENSION} version {version}: {path}")
+        self.complete = True
+        starts, offsets = self._read_index()
+        if starts is None:
+            self.complete = False
+            starts, offsets = self._scan_blocks()
+        self._starts = starts
+        self._offsets = offsets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate
+
+    def _read_index(self):
+        """从结尾读取索引；结尾不完整时返回 (None, None)"""
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        if size < HEADER.size + TRAILER.size:
+            return None, None
+        self._file.seek(size - TRAILER.size)
+        index_offset, frames, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+        if magic != INDEX_MAGIC:
+            return None, None
+        self._file.seek(index_offset)
+        raw = self._file.read(size - TRAILER.size - index_offset)
+        entries = np.frombuffer(raw, dtype='<u8').reshape(-1, 2)
+        self.frames = frames
+        return entries[:, 0].astype(np.int64), entries[:, 1].astype(np.int64)
+
+    def _scan_blocks(self):
+        """顺序读取块头重建索引，忽略末尾写了一半的块"""
+        starts, offsets = [], []
+        frames = 0
+        offset = HEADER.size
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        while offset + BLOCK_HEADER.size <= size:
+            self._file.seek(offset)
+            count, length, _ = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+            if count == 0 or offset + BLOCK_HEADER.size + length > size:
+                break
+            starts.append(frames)
+            offsets.append(offset)
+            frames += count
+            offset += BLOCK_HEADER.size + length
+        self.frames = frames
+        return np.array(starts, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+    def _block(self, i):
+        self._file.seek(self._offsets[i])
+        count, length, crc = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+        samples = decode_block(self._file.read(length), count, self.channels)
+        if zlib.crc32(samples.tobytes()) != crc:
+            raise ValueError(f"Corrupt block {i} in {self.path}")
+        return samples
+
+    def read(self, start=0, stop=None, dtype=np.int16):
+        """返回第 [start, stop) 帧，形状 (帧, 声道)；dtype 为浮点时缩放到 [-1, 1]"""
+        stop = self.frames if stop is None else min(stop, self.frames)
+        start = max(0, start)
+        out = np.empty((max(0, stop - start), self.channels), dtype=np.int16)
+        if len(out):
+            first = int(np.searchsorted(self._starts, start, side='right')) - 1
+            last = int(np.searchsorted(self._starts, stop, side='left'))
+            for i in range(first, last):
+                block = self._block(i)
+                block_start = int(self._starts[i])
+                lo = max(start, block_start)
+                hi = min(stop, block_start + len(block))
+                out[lo - start:hi - start] = block[lo - block_start:hi - block_start]
+        if np.dtype(dtype).kind == 'f':
+            return out.astype(dtype) / np.array(32767, dtype=dtype)
+        return out
+
+    def read_seconds(self, start, stop=None, dtype=np.float32):
+        """按秒读取"""
+        stop_frame = None if stop is None else int(round(stop * self.sample_rate))
+        return self.read(int(round(start * self.sample_rate)), stop_frame, dtype)
+
+    def blocks(self, dtype=np.int16):
+        """按块依次返回全部数据"""
+        for i in range(len(self._starts)):
+            block = self._block(i)
+            if np.dtype(dtype).kind == 'f':
+                block = block.astype(dtype) / np.array(32767, dtype=dtype)
+            yield block
+
+
+class StreamingArchiveWriter(StreamingWavWriter):
+    """与 StreamingWavWriter 相同的后台写入与切分，输出 .wavz 文件
+
+    压缩在写入线程中完成，不占用音频回调；每次定期刷新都会把未满的块写出，
+    崩溃时最多丢失 flush_interval 秒的数据。
+    """
+
+    extension = EXTENSION
+
+    def __init__(self, *args, block_frames=65536, level=6, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.block_frames = block_frames
+        self.level = level
+
+    def _create(self, path):
+        return ArchiveWriter(path, self.sample_rate, self.file_channels, self.block_frames, self.level)
+
+    def _write(self, handle, samples):
+        handle.write(samples)
+
+    def _sync(self, handle):
+        handle.flush()
+
+    def _finish(self, handle):
+        handle.close()
+
+
+def compress_wav(wav_path, archive_path=None, block_frames=65536, level=6, chunk_frames=1 << 20):
+    """把 16-bit PCM WAV 转换为 .wavz，返回输出路径"""
+    if archive_path is None:
+        archive_path = os.path.splitext(wav_path)[0] + EXTENSION
+    with wave.open(wav_path, 'rb') as source:
+        if source.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV is supported: {wav_path}")
+        channels = source.getnchannels()
+        writer = ArchiveWriter(archive_path, source.getframerate(), channels, block_frames, level)
+        try:
+            while True:
+                raw = source.readframes(chunk_frames)
+                if not raw:
+                    break
+                writer.write(np.frombuffer(raw, dtype='<i2').reshape(-1, channels))
+        finally:
+            writer.close()
+    return archive_path
+
+
+def extract_wav(archive_path, wav_path=None):
+    """把 .wavz 还原为 WAV（与原文件逐样本相同），返回输出路径"""
+    if wav_path is None:
+        wav_path = os.path.splitext(archive_path)[0] + '.wav'
+    with ArchiveReader(archive_path) as reader, wave.open(wav_path, 'wb') as target:
+        target.setnchannels(reader.channels)
+        target.setsampwidth(2)
+        target.setframerate(reader.sample_rate)
+        for block in reader.blocks():
+            target.writeframes(block.astype('<i2').tobytes())
+    return wav_path
+
+
+def verify_archive(wav_path, archive_path):
+    """逐块解码 .wavz 并与原 WAV 比较，全部样本一致时返回 True（损坏的块同样返回 False）"""
+    try:
+        with wave.open(wav_path, 'rb') as source, ArchiveReader(archive_path) as reader:
+            channels = source.getnchannels()
+            if not reader.complete or reader.frames != source.getnframes() or reader.channels != channels \
+                    or reader.sample_rate != source.getframerate():
+                return False
+            for block in reader.blocks():
+                expected = np.frombuffer(source.readframes(len(block)), dtype='<i2').reshape(-1, channels)
+                if not np.array_equal(block, expected):
+                    return False
+            return not source.readframes(1)
+    except (OSError, ValueError, zlib.error):
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lossless block-compressed recording archives (.wavz)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    compress = commands.add_parser('compress', help="convert WAV files to .wavz")
+    compress.add_argument('wav', nargs='+')
+    compress.add_argument('--block-frames', type=int, default=65536)
+    compress.add_argument('--level', type=int, default=6, help="zlib level 1-9")
+    compress.add_argument('--remove', action='store_true', help="delete each WAV after a verified conversion")
+    extract = commands.add_parser('extract', help="convert .wavz files back to WAV")
+    extract.add_argument('archive', nargs='+')
+    info = commands.add_parser('info', help="show the contents of .wavz files")
+    info.add_argument('archive', nargs='+')
+    args = parser.parse_args(argv)
+
+    for path in getattr(args, 'wav', None) or args.archive:
+        try:
+            if args.command == 'compress':
+                target = compress_wav(path, block_frames=args.block_frames, level=args.level)
+                ratio = os.path.getsize(target) / os.path.getsize(path)
+                print(f"{path} -> {target} ({ratio:.1%})")
+                if args.remove:
+                    # 解码全部样本与原文件逐块比较，一致后才删除
+                    if verify_archive(path, target):
+                        os.remove(path)
+                    else:
+                        print(f"保留原文件 {path}：校验失败")
+            elif args.command == 'extract':
+                print(f"{path} -> {extract_wav(path)}")
+            else:
+                with ArchiveReader(path) as reader:
+                    state = "" if reader.complete else " (no index, recovered by scanning)"
+                    print(f"{path}: {reader.channels} ch, {reader.sample_rate} Hz, "
+                          f"{reader.duration:.2f}s, {len(reader._starts)} blocks{state}")
+        except Exception as e:
+            print(f"处理失败 {path}: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,92 +1,34 @@
-import sounddevice as sd
-import numpy as np
-import wave
-import time
-from datetime import datetime
-import threading
-import os
-import csv
-import queue
-import keyboard
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg
+import argparse
 import tkinter as tk
-from tkinter import ttk, messagebox
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import sys
-import tempfile
+from tkinter import ttk, messagebox, filedialog
+from audio_engine import AudioEngine, parse_device
+from synth import WAVEFORMS
+from protocol import load_protocol
+from waveform_view import WaveformView
+from spectrogram import SpectrogramView
 
 class AudioRecorder:
-    def __init__(self):
-        # 基本设置
-        self.sample_rate = 44100
-        self.channels = 1
-        self.recording = False
-        self.paused = False
-        self.audio_queue = queue.Queue()
-        self.recorded_data = []
-        self.start_time = None
-        self.pause_time = 0
-        
-        # 音频流相关
-        self.stream = None
-        self.preview_stream = None
-        self.generator_stream = None
-        
-        # 线程相关
-        self.generator_thread = None
-        self.preview_thread = None
+    """Tk 图形界面，录音与声音生成由 AudioEngine 完成"""
+    def __init__(self, engine=None, ads_url=None, control_port=None, device_url=None):
+        # 核心引擎
+        self.engine = engine if engine is not None else AudioEngine()
         self.update_plot_timer = None
-        
-        # 状态标志
-        self.generating = False
-        self.previewing = False
+        # 可选的 ADS1110 电压流，与刺激在同一进程中记录
+        self.ads_client = None
+        if ads_url:
+            # 只有指定 --ads 时才导入 asyncio 客户端
+            from ads_stream import AdsStreamClient
+            self.ads_client = AdsStreamClient(ads_url, logs_dir=self.engine.logs_dir)
+        self.ads_timer = None
+        # 可选的本地控制接口（见 control_server），脚本可以通过它协调刺激与设备记录
+        self.control = None
+        if control_port is not None:
+            from control_server import ControlServer
+            self.control = ControlServer(self.engine, port=control_port, device=device_url,
+                                         ads_client=self.ads_client)
         self.is_closing = False
-        
-        # 声音生成相关
-        self.generator_start_time = None
-        self.preview_start_time = None
-        
-        # 创建必要的目录
-        self.recordings_dir = "recordings"
-        self.logs_dir = "logs"
-        self.use_temp_dir = False
-        
-        # 尝试创建目录，如果失败则使用临时目录
-        try:
-            for directory in [self.recordings_dir, self.logs_dir]:
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-        except (PermissionError, OSError) as e:
-            print(f"无法创建目录: {e}")
-            # 使用临时目录
-            temp_dir = tempfile.gettempdir()
-            self.recordings_dir = os.path.join(temp_dir, "audio_recordings")
-            self.logs_dir = os.path.join(temp_dir, "audio_logs")
-            self.use_temp_dir = True
-            
-            # 创建临时目录
-            for directory in [self.recordings_dir, self.logs_dir]:
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-        
-        # 初始化日志文件
-        self.recording_log_file = os.path.join(self.logs_dir, f"recording_log_{datetime.now().strftime('%Y%m%d')}.csv")
-        self.sound_log_file = os.path.join(self.logs_dir, f"sound_log_{datetime.now().strftime('%Y%m%d')}.csv")
-        
-        # 初始化内存日志
-        self.recording_logs = []
-        self.sound_logs = []
-        
-        # 检查日志文件是否可写
-        self.recording_log_writable = self.check_file_writable(self.recording_log_file)
-        self.sound_log_writable = self.check_file_writable(self.sound_log_file)
-        
-        # 如果日志文件可写，则初始化它们
-        if self.recording_log_writable:
-            self.initialize_recording_log()
-        if self.sound_log_writable:
-            self.initialize_sound_log()
+        # 波形图在窗口显示之后才创建
+        self.canvas = None
         
         # 创建主窗口
         self.root = tk.Tk()
@@ -116,304 +58,111 @@ class AudioRecorder:
         self.init_control_panel()
         
         # 如果使用了临时目录，显示提示
-        if self.use_temp_dir:
+        if self.engine.use_temp_dir:
             messagebox.showinfo("目录信息", 
                                f"由于权限问题，程序将使用临时目录存储文件：\n"
-                               f"录音文件: {self.recordings_dir}\n"
-                               f"日志文件: {self.logs_dir}")
-    
-    def check_file_writable(self, filepath):
-        """检查文件是否可写"""
-        # 如果文件不存在，检查目录是否可写
-        if not os.path.exists(filepath):
-            directory = os.path.dirname(filepath)
-            return os.access(directory, os.W_OK)
-        
-        # 如果文件存在，检查文件是否可写
-        return os.access(filepath, os.W_OK)
-    
-    def initialize_recording_log(self):
-        """初始化录音日志文件"""
-        try:
-            if not os.path.exists(self.recording_log_file):
-                with open(self.recording_log_file, 'w', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow([
-                        'Start Time',
-                        'End Time',
-                        'Filename',
-                        'Duration (s)',
-                        'Sample Rate',
-                        'Status'
-                    ])
-        except (PermissionError, OSError) as e:
-            print(f"无法创建录音日志文件: {e}")
-            self.recording_log_writable = False
-    
-    def initialize_sound_log(self):
-        """初始化声音日志文件"""
-        try:
-            if not os.path.exists(self.sound_log_file):
-                with open(self.sound_log_file, 'w', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow([
-                        'Start Time',
-                        'End Time',
-                        'Type',
-                        'Frequency (Hz)',
-                        'Waveform',
-                        'Duration (s)',
-                        'Volume',
-                        'Status'
-                    ])
-        except (PermissionError, OSError) as e:
-            print(f"无法创建声音日志文件: {e}")
-            self.sound_log_writable = False
-    
-    def initialize_log_files(self):
-        """Initialize CSV log files - 保留此方法以兼容旧代码"""
-        self.initialize_recording_log()
-        self.initialize_sound_log()
-
-    def get_timestamp(self):
-        """Get formatted timestamp"""
-        now = datetime.now()
-        return now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-
-    def log_recording(self, filename, duration, status="Success"):
-        """Log recording information to CSV"""
-        try:
-            end_time = self.get_timestamp()
-            if self.start_time is None:
-                self.start_time = self.get_timestamp()
-            
-            log_entry = [
-                self.start_time,
-                end_time,
-                filename,
-                f"{duration:.2f}",
-                self.sample_rate,
-                status
-            ]
-            
-            # 始终将日志添加到内存中
-            self.recording_logs.append(log_entry)
-            
-            # 如果日志文件可写，则写入文件
-            if self.recording_log_writable:
-                try:
-                    with open(self.recording_log_file, 'a', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(log_entry)
-                except Exception as e:
-                    print(f"写入录音日志文件失败: {e}")
-                    self.recording_log_writable = False
-        except Exception as e:
-            print(f"记录录音信息失败: {e}")
+                               f"录音文件: {self.engine.recordings_dir}\n"
+                               f"日志文件: {self.engine.logs_dir}")
+        
+        # 引擎状态变化统一转到 Tk 主线程处理
+        self.engine.add_listener(self.on_engine_event)
+        if self.ads_client is not None:
+            self.ads_client.add_listener(self.on_engine_event)
+            self.ads_client.start()
+            self.update_ads_display()
+        if self.control is not None:
+            try:
+                self.control.start()
+            except OSError as e:
+                print(f"无法启动控制接口: {e}")
+                self.control = None
     
-    def log_sound(self, sound_type, frequency, waveform, duration, volume, status="Success"):
-        """Log sound generation/preview information to CSV"""
+    def on_engine_event(self, topic, message):
+        """引擎回调（可能来自音频线程），转交主线程更新界面"""
+        if self.is_closing:
+            return
         try:
-            end_time = self.get_timestamp()
-            # 移除对self.start_time的依赖，直接计算开始时间
-            start_time = datetime.fromtimestamp(time.time() - duration).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-            
-            log_entry = [
-                start_time,
-                end_time,
-                sound_type,
-                frequency,
-                waveform,
-                f"{duration:.2f}",
-                f"{volume:.2f}",
-                status
-            ]
-            
-            # 始终将日志添加到内存中
-            self.sound_logs.append(log_entry)
-            
-            # 如果日志文件可写，则写入文件
-            if self.sound_log_writable:
-                try:
-                    with open(self.sound_log_file, 'a', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(log_entry)
-                except Exception as e:
-                    print(f"写入声音日志文件失败: {e}")
-                    self.sound_log_writable = False
-        except Exception as e:
-            print(f"记录声音信息失败: {e}")
+            self.root.after(0, self.apply_engine_event, topic, message)
+        except (RuntimeError, tk.TclError):
+            pass
     
-    def audio_callback(self, indata, frames, time, status):
-        """音频回调函数"""
-        if status:
-            print(f"Status: {status}")
-        if self.recording and not self.paused and not self.is_closing:
-            try:
-                self.audio_queue.put(indata.copy())
-                # 更新实时波形
-                self.recorded_data = np.concatenate([self.recorded_data, indata.flatten()])
-                if len(self.recorded_data) > 1000:
-                    self.recorded_data = self.recorded_data[-1000:]
-            except Exception as e:
-                print(f"Error in audio callback: {e}")
-                self.stop_recording()
+    def apply_engine_event(self, topic, message):
+        """在主线程中根据引擎状态更新界面"""
+        if self.is_closing:
+            return
+        if topic == 'recording':
+            self.status_label.config(text=message)
+            self.record_button.config(text="Stop Recording" if self.engine.recording else "Start Recording")
+            self.pause_button.config(text="Resume Recording" if self.engine.paused else "Pause Recording")
+            # 录音也可能由引擎（如双工协议）发起，此时同样需要刷新波形
+            if self.engine.recording and self.update_plot_timer is None:
+                self.update_plot()
+        elif topic == 'generator':
+            self.generator_status.config(text=message)
+            self.generate_button.config(text="Stop Generation" if self.engine.generating else "Generate Sound")
+            self.preview_button.config(text="Stop Preview" if self.engine.previewing else "Preview")
+            self.protocol_button.config(text="Stop Protocol" if self.engine.protocol_running else "Run Protocol...")
+        elif topic == 'ads':
+            self.ads_status.config(text=message)
+        elif topic == 'info':
+            messagebox.showinfo("保存位置", message)
+        elif topic == 'error':
+            messagebox.showerror("保存失败", message)
     
     def update_plot(self):
         """更新实时波形图"""
-        if self.recording and not self.paused and not self.is_closing:
+        self.update_plot_timer = None
+        engine = self.engine
+        delay = 50
+        if engine.recording and not engine.paused and not self.is_closing and self.canvas is not None:
             try:
-                self.line.set_data(range(len(self.recorded_data)), self.recorded_data)
-                self.ax.relim()
-                self.ax.autoscale_view()
-                self.canvas.draw()
+                # 只重画曲线与频谱图；绘制变慢时两者都会拉长间隔
+                delay = max(self.waveform_view.update(), self.spectrogram_view.update())
             except Exception as e:
                 print(f"Error updating plot: {e}")
                 self.stop_recording()
         
         # 设置下一次更新
-        if self.recording and not self.is_closing:
-            self.update_plot_timer = self.root.after(50, self.update_plot)
+        if engine.recording and not self.is_closing:
+            self.update_plot_timer = self.root.after(delay, self.update_plot)
     
-    def save_recording(self, data, filename):
-        """保存录音文件"""
-        try:
-            filepath = os.path.join(self.recordings_dir, filename)
-            with wave.open(filepath, 'wb') as wf:
-                wf.setnchannels(self.channels)
-                wf.setsampwidth(2)
-                wf.setframerate(self.sample_rate)
-                wf.writeframes((data * 32767).astype(np.int16).tobytes())
-            print(f"录音已保存: {filepath}")
-            return True
-        except Exception as e:
-            print(f"保存录音失败: {e}")
-            # 尝试使用临时目录
-            if not self.use_temp_dir:
-                try:
-                    temp_dir = tempfile.gettempdir()
-                    temp_recordings_dir = os.path.join(temp_dir, "audio_recordings")
-                    if not os.path.exists(temp_recordings_dir):
-                        os.makedirs(temp_recordings_dir)
-                    filepath = os.path.join(temp_recordings_dir, filename)
-                    with wave.open(filepath, 'wb') as wf:
-                        wf.setnchannels(self.channels)
-                        wf.setsampwidth(2)
-                        wf.setframerate(self.sample_rate)
-                        wf.writeframes((data * 32767).astype(np.int16).tobytes())
-                    print(f"录音已保存到临时目录: {filepath}")
-                    messagebox.showinfo("保存位置", f"由于权限问题，录音已保存到临时目录:\n{filepath}")
-                    return True
-                except Exception as e2:
-                    print(f"保存到临时目录也失败: {e2}")
-                    messagebox.showerror("保存失败", f"无法保存录音文件: {e2}")
-                    return False
-            else:
-                messagebox.showerror("保存失败", f"无法保存录音文件: {e}")
-                return False
+    def update_ads_display(self):
+        """显示最新的电压读数"""
+        self.ads_timer = None
+        if self.is_closing:
+            return
+        latest = self.ads_client.buffer.latest()
+        if latest is not None:
+            self.ads_voltage.config(text=f"Voltage: {latest[1]:.3f} mV")
+        self.ads_timer = self.root.after(500, self.update_ads_display)
     
     def toggle_recording(self):
         """切换录制状态"""
-        if not self.recording:
+        if not self.engine.recording:
             self.start_recording()
         else:
             self.stop_recording()
     
     def toggle_pause(self):
         """切换暂停状态"""
-        if self.recording:
-            if self.paused:
-                self.paused = False
-                self.pause_button.config(text="Resume Recording")
-                self.status_label.config(text="Recording resumed")
-            else:
-                self.paused = True
-                self.pause_button.config(text="Pause Recording")
-                self.status_label.config(text="Recording paused")
+        if self.engine.paused:
+            self.engine.resume_recording()
+        else:
+            self.engine.pause_recording()
     
     def start_recording(self):
         """开始录音"""
-        try:
-            if self.stream is not None:
-                self.stream.stop()
-                self.stream.close()
-            
-            self.recording = True
-            self.paused = False
-            self.recorded_data = []
-            self.start_time = self.get_timestamp()
-            
-            # 开始录音流
-            self.stream = sd.InputStream(
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                callback=self.audio_callback
-            )
-            self.stream.start()
-            
+        if self.engine.start_recording():
             # 开始更新图表
             self.update_plot()
-            self.status_label.config(text="Recording started")
-            self.record_button.config(text="Stop Recording")
-            
-        except Exception as e:
-            print(f"Failed to start recording: {e}")
-            self.recording = False
-            self.status_label.config(text="Failed to start recording")
-            self.record_button.config(text="Start Recording")
-            if self.stream:
-                self.stream.stop()
-                self.stream.close()
-                self.stream = None
     
     def stop_recording(self):
         """停止录音"""
-        if self.recording:
-            try:
-                self.recording = False
-                if self.stream:
-                    self.stream.stop()
-                    self.stream.close()
-                    self.stream = None
-                
-                # 停止更新图表
-                if self.update_plot_timer:
-                    self.root.after_cancel(self.update_plot_timer)
-                    self.update_plot_timer = None
-                
-                # 收集所有录音数据
-                recorded_data = []
-                while not self.audio_queue.empty():
-                    try:
-                        recorded_data.append(self.audio_queue.get_nowait())
-                    except queue.Empty:
-                        break
-                
-                if recorded_data:
-                    recorded_data = np.concatenate(recorded_data)
-                    duration = len(recorded_data) / self.sample_rate
-                    
-                    # 生成文件名
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"ambient_sound_{timestamp}.wav"
-                    
-                    # 保存录音
-                    if self.save_recording(recorded_data, filename):
-                        self.log_recording(filename, duration)
-                        self.status_label.config(text=f"Recording saved: {duration:.2f}s")
-                    else:
-                        self.log_recording(filename, duration, "Save failed")
-                        self.status_label.config(text="Failed to save recording")
-                else:
-                    self.status_label.config(text="Recording stopped")
-                
-                self.record_button.config(text="Start Recording")
-                
-            except Exception as e:
-                print(f"Failed to stop recording: {e}")
-                self.log_recording("unknown", 0, f"Error: {str(e)}")
-                self.status_label.config(text="Failed to stop recording")
-                self.record_button.config(text="Start Recording")
+        # 停止更新图表
+        if self.update_plot_timer:
+            self.root.after_cancel(self.update_plot_timer)
+            self.update_plot_timer = None
+        self.engine.stop_recording()
     
     def init_waveform_display(self):
         """初始化波形显示"""
@@ -421,23 +170,55 @@ class AudioRecorder:
         waveform_frame = ttk.LabelFrame(self.left_frame, text="Real-time Waveform", padding="5")
         waveform_frame.pack(expand=True, fill='both')
         
+        self.waveform_frame = waveform_frame
+        
+        # 频谱图面板，显示麦克风当前收到的频谱
+        self.spectrogram_frame = ttk.LabelFrame(self.left_frame, text="Real-time Spectrogram", padding="5")
+        self.spectrogram_frame.pack(expand=True, fill='both', pady=(10, 0))
+        
+        # 创建状态标签
+        self.status_label = tk.Label(waveform_frame, text="Waiting to start recording...", font=('Arial', 14))
+        self.status_label.pack(side='bottom', pady=5)
+        
+        # matplotlib 导入和建图较慢，等窗口显示出来后再进行
+        waveform_frame.bind('<Map>', self.on_waveform_frame_mapped)
+    
+    def on_waveform_frame_mapped(self, event):
+        """波形框架第一次显示后创建图表"""
+        self.waveform_frame.unbind('<Map>')
+        self.root.after(10, self.init_figure)
+    
+    def init_figure(self):
+        """创建实时波形图与频谱图并嵌入窗口"""
+        if self.is_closing or self.canvas is not None:
+            return
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        
         # 初始化实时波形显示
-        self.fig, self.ax = plt.subplots(figsize=(10, 6))
-        self.line, = self.ax.plot([], [], lw=2)
+        self.fig = Figure(figsize=(10, 3.5))
+        self.ax = self.fig.add_subplot()
         self.ax.set_title('Real-time Audio Waveform', fontsize=16)
-        self.ax.set_xlabel('Samples', fontsize=14)
+        self.ax.set_xlabel('Time (s)', fontsize=14)
         self.ax.set_ylabel('Amplitude', fontsize=14)
-        self.ax.set_ylim(-1, 1)
-        self.ax.set_xlim(0, 1000)
         
         # 将图表嵌入到Tkinter窗口中
-        self.canvas = FigureCanvasTkAgg(self.fig, master=waveform_frame)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.waveform_frame)
+        self.waveform_view = WaveformView(self.ax, self.canvas, self.engine.waveform_buffers, self.engine.sample_rate)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(expand=True, fill='both')
         
-        # 创建状态标签
-        self.status_label = tk.Label(waveform_frame, text="Waiting to start recording...", font=('Arial', 14))
-        self.status_label.pack(pady=5)
+        # 频谱图使用单独的画布，两者各自缓存背景
+        self.spectrogram_fig = Figure(figsize=(10, 3.5))
+        self.spectrogram_ax = self.spectrogram_fig.add_subplot()
+        self.spectrogram_ax.set_xlabel('Time (s)', fontsize=14)
+        self.spectrogram_ax.set_ylabel('Frequency (Hz)', fontsize=14)
+        self.spectrogram_canvas = FigureCanvasTkAgg(self.spectrogram_fig, master=self.spectrogram_frame)
+        self.spectrogram_view = SpectrogramView(self.spectrogram_ax, self.spectrogram_canvas,
+                                                self.engine.waveform_buffer, self.engine.sample_rate,
+                                                max_frequency=8000)
+        self.spectrogram_canvas.draw()
+        self.spectrogram_canvas.get_tk_widget().pack(expand=True, fill='both')
         
     def init_control_panel(self):
         """初始化控制面板"""
@@ -470,7 +251,7 @@ class AudioRecorder:
         ttk.Label(waveform_frame, text="Waveform:").pack(side="left")
         self.waveform_var = tk.StringVar(value="sine")
         waveform_combo = ttk.Combobox(waveform_frame, textvariable=self.waveform_var)
-        waveform_combo['values'] = ('sine', 'square', 'triangle', 'sawtooth')
+        waveform_combo['values'] = WAVEFORMS
         waveform_combo.pack(side="right", fill="x", expand=True)
         
         # 持续时间控制
@@ -500,10 +281,31 @@ class AudioRecorder:
         self.save_button = ttk.Button(generator_frame, text="Save", command=self.save_generated_sound)
         self.save_button.pack(fill="x", pady=5)
         
+        # 刺激协议按钮
+        self.protocol_button = ttk.Button(generator_frame, text="Run Protocol...", command=self.toggle_protocol)
+        self.protocol_button.pack(fill="x", pady=5)
+        
+        # 双工模式：协议播放期间在同一个音频流上录音
+        self.duplex_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(generator_frame, text="Record during protocol", variable=self.duplex_var).pack(fill="x", pady=5)
+        
         # 状态标签
         self.generator_status = tk.Label(generator_frame, text="Ready", font=('Arial', 14))
         self.generator_status.pack(pady=5)
         
+        # 预览时修改参数立即生效
+        for var in (self.freq_var, self.waveform_var, self.volume_var):
+            var.trace_add('write', self.on_sound_parameter_changed)
+        
+        # ADS1110 电压流状态
+        if self.ads_client is not None:
+            ads_frame = ttk.LabelFrame(self.right_frame, text="ADS1110 Stream", padding="10")
+            ads_frame.pack(fill="x", pady=(0, 10))
+            self.ads_status = tk.Label(ads_frame, text=f"Connecting to {self.ads_client.url}...", font=('Arial', 12))
+            self.ads_status.pack(pady=5)
+            self.ads_voltage = tk.Label(ads_frame, text="Voltage: -- mV", font=('Arial', 14))
+            self.ads_voltage.pack(pady=5)
+        
         # 设置按钮样式
         style = ttk.Style()
         style.configure('TButton', padding=10, font=('Arial', 16))  # 增加按钮内边距和字体大小
@@ -513,269 +315,82 @@ class AudioRecorder:
         style.configure('TScale', padding=5)  # 增加滑块内边距
         style.configure('TLabelframe.Label', font=('Arial', 16))  # 增加框架标签字体大小
 
-    def generate_waveform(self, frequency, duration, waveform='sine', amplitude=0.5):
-        """生成指定波形的信号"""
-        t = np.linspace(0, duration, int(self.sample_rate * duration), False)
-        
-        if waveform == 'sine':
-            signal = amplitude * np.sin(2 * np.pi * frequency * t)
-        elif waveform == 'square':
-            signal = amplitude * np.sign(np.sin(2 * np.pi * frequency * t))
-        elif waveform == 'triangle':
-            signal = amplitude * (2/np.pi) * np.arcsin(np.sin(2 * np.pi * frequency * t))
-        elif waveform == 'sawtooth':
-            signal = amplitude * (2/np.pi) * np.arctan(np.tan(np.pi * frequency * t))
-        else:
-            signal = amplitude * np.sin(2 * np.pi * frequency * t)
-            
-        return signal.astype(np.float32)
+
+    def read_sound_parameters(self):
+        """读取界面上的声音参数"""
+        frequency = float(self.freq_var.get())
+        duration = float(self.duration_var.get())
+        waveform = self.waveform_var.get()
+        amplitude = self.volume_var.get()
+        return frequency, duration, waveform, amplitude
     
     def toggle_generation(self):
         """切换声音生成状态"""
-        if not self.generating:
+        if not self.engine.generating:
             try:
-                frequency = float(self.freq_var.get())
-                duration = float(self.duration_var.get())
-                waveform = self.waveform_var.get()
-                amplitude = self.volume_var.get()
-                
-                self.generating = True
-                self.generate_button.config(text="Stop Generation")
-                self.generator_status.config(text="Generating...")
-                
-                # 在新线程中生成声音
-                self.generator_thread = threading.Thread(
-                    target=self.generate_sound,
-                    args=(frequency, duration, waveform, amplitude)
-                )
-                self.generator_thread.start()
-                
+                frequency, duration, waveform, amplitude = self.read_sound_parameters()
             except ValueError as e:
                 self.generator_status.config(text="Invalid input parameters")
-                self.generating = False
-                self.generate_button.config(text="Generate Sound")
+                return
+            self.engine.start_generation(frequency, duration, waveform, amplitude)
         else:
             self.stop_generation()
     
     def stop_generation(self):
         """停止声音生成"""
-        self.generating = False
-        self.generate_button.config(text="Generate Sound")
-        self.generator_status.config(text="Generation stopped")
-        
-        # 停止音频流
-        if self.generator_stream:
-            try:
-                self.generator_stream.stop()
-                self.generator_stream.close()
-                self.generator_stream = None
-            except Exception as e:
-                print(f"Error stopping generator stream: {e}")
-        
-        # 等待线程结束
-        if self.generator_thread:
-            try:
-                self.generator_thread.join(timeout=1.0)
-            except Exception as e:
-                print(f"Error joining generator thread: {e}")
-    
-    def generate_sound(self, frequency, duration, waveform, amplitude):
-        """生成并播放声音"""
-        try:
-            # 生成信号
-            signal = self.generate_waveform(frequency, duration, waveform, amplitude)
-            
-            # 创建输出流
-            self.generator_stream = sd.OutputStream(
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                callback=self.generator_callback
-            )
-            
-            # 设置生成数据
-            self.generator_data = signal
-            self.generator_position = 0
-            self.generator_start_time = time.time()  # 记录开始时间
-            
-            # 开始播放
-            self.generator_stream.start()
-            
-            # 等待播放完成或被停止
-            while self.generating and self.generator_position < len(signal):
-                time.sleep(0.1)
-            
-            if self.generating:
-                actual_duration = time.time() - self.generator_start_time  # 计算实际播放时长
-                self.generator_status.config(text="Sound generated")
-                self.generating = False
-                self.generate_button.config(text="Generate Sound")
-                self.log_sound("Generation", frequency, waveform, actual_duration, amplitude)
-            
-        except Exception as e:
-            actual_duration = time.time() - self.generator_start_time if self.generator_start_time else 0
-            self.generator_status.config(text=f"Generation failed: {str(e)}")
-            self.generating = False
-            self.generate_button.config(text="Generate Sound")
-            self.log_sound("Generation", frequency, waveform, actual_duration, amplitude, f"Error: {str(e)}")
-        finally:
-            if self.generator_stream:
-                try:
-                    self.generator_stream.stop()
-                    self.generator_stream.close()
-                    self.generator_stream = None
-                except:
-                    pass
-    
-    def generator_callback(self, outdata, frames, time, status):
-        """生成声音的回调函数"""
-        if status:
-            print(f"Generator status: {status}")
-        
-        if self.generating:
-            try:
-                # 计算当前帧的数据
-                end_position = min(self.generator_position + frames, len(self.generator_data))
-                outdata[:end_position-self.generator_position, 0] = self.generator_data[self.generator_position:end_position]
-                
-                # 更新位置
-                self.generator_position = end_position
-                
-            except Exception as e:
-                print(f"Error in generator callback: {e}")
-                self.stop_generation()
+        self.engine.stop_generation()
     
     def toggle_preview(self):
         """切换预览状态"""
-        if not self.previewing:
+        if not self.engine.previewing:
             try:
-                frequency = float(self.freq_var.get())
-                waveform = self.waveform_var.get()
-                amplitude = self.volume_var.get()
-                
-                self.previewing = True
-                self.preview_button.config(text="Stop Preview")
-                self.generator_status.config(text="Previewing...")
-                
-                # 在新线程中预览声音
-                self.preview_thread = threading.Thread(
-                    target=self.preview_sound,
-                    args=(frequency, waveform, amplitude)
-                )
-                self.preview_thread.start()
-                
+                frequency, _, waveform, amplitude = self.read_sound_parameters()
             except ValueError as e:
                 self.generator_status.config(text="Invalid input parameters")
-                self.previewing = False
-                self.preview_button.config(text="Preview")
+                return
+            self.engine.start_preview(frequency, waveform, amplitude)
         else:
             self.stop_preview()
     
     def stop_preview(self):
         """停止预览"""
-        self.previewing = False
-        self.preview_button.config(text="Preview")
-        self.generator_status.config(text="Preview stopped")
-        if self.preview_stream:
-            try:
-                self.preview_stream.stop()
-                self.preview_stream.close()
-                self.preview_stream = None
-            except Exception as e:
-                print(f"Error stopping preview stream: {e}")
-        if self.preview_thread:
-            try:
-                self.preview_thread.join(timeout=1.0)  # 添加超时
-            except Exception as e:
-                print(f"Error joining preview thread: {e}")
+        self.engine.stop_preview()
     
-    def preview_sound(self, frequency, waveform, amplitude):
-        """预览生成的声音"""
+    def toggle_protocol(self):
+        """选择 JSON 协议文件并运行，或停止正在运行的协议"""
+        if self.engine.protocol_running:
+            self.engine.stop_protocol()
+            return
+        path = filedialog.askopenfilename(title="Stimulation protocol", filetypes=[("JSON", "*.json")])
+        if not path:
+            return
         try:
-            # 生成持续时间为1秒的信号，但会循环播放
-            signal = self.generate_waveform(frequency, 1.0, waveform, amplitude)
-            
-            # 创建输出流
-            self.preview_stream = sd.OutputStream(
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                callback=self.preview_callback
-            )
-            
-            # 设置预览数据
-            self.preview_data = signal
-            self.preview_position = 0
-            self.preview_start_time = time.time()  # 记录开始时间
-            
-            # 开始播放
-            self.preview_stream.start()
-            
-            # 等待被停止
-            while self.previewing:
-                time.sleep(0.1)
-            
-            if self.preview_stream:
-                self.preview_stream.stop()
-                self.preview_stream.close()
-                self.preview_stream = None
-            
-            actual_duration = time.time() - self.preview_start_time  # 计算实际播放时长
-            self.preview_button.config(text="Preview")
-            self.generator_status.config(text="Preview stopped")
-            self.log_sound("Preview", frequency, waveform, actual_duration, amplitude)
-            
-        except Exception as e:
-            actual_duration = time.time() - self.preview_start_time if self.preview_start_time else 0
-            self.generator_status.config(text=f"Preview failed: {str(e)}")
-            self.previewing = False
-            self.preview_button.config(text="Preview")
-            self.log_sound("Preview", frequency, waveform, actual_duration, amplitude, f"Error: {str(e)}")
-        finally:
-            if self.preview_stream:
-                try:
-                    self.preview_stream.stop()
-                    self.preview_stream.close()
-                    self.preview_stream = None
-                except:
-                    pass
+            steps = load_protocol(path)
+        except (OSError, ValueError, TypeError) as e:
+            self.generator_status.config(text=f"Invalid protocol: {str(e)}")
+            return
+        if self.duplex_var.get():
+            self.engine.start_duplex(steps)
+        else:
+            self.engine.start_protocol(steps)
     
-    def preview_callback(self, outdata, frames, time, status):
-        """预览回调函数"""
-        if status:
-            print(f"Preview status: {status}")
-        
-        if self.previewing:
-            try:
-                # 循环播放信号
-                for i in range(frames):
-                    outdata[i, 0] = self.preview_data[self.preview_position]
-                    self.preview_position = (self.preview_position + 1) % len(self.preview_data)
-            except Exception as e:
-                print(f"Error in preview callback: {e}")
-                self.stop_preview()
+    def on_sound_parameter_changed(self, *args):
+        """预览中参数变化时切换波形表"""
+        if not self.engine.previewing:
+            return
+        try:
+            frequency, _, waveform, amplitude = self.read_sound_parameters()
+        except (ValueError, tk.TclError):
+            # 输入尚未完成（例如频率框为空）时忽略
+            return
+        # 音量滑块是连续的，量化后再查表，避免缓存被大量相近的表挤满
+        self.engine.update_preview(frequency, waveform, round(amplitude, 2))
     
     def save_generated_sound(self):
         """保存生成的声音"""
         try:
-            frequency = float(self.freq_var.get())
-            duration = float(self.duration_var.get())
-            waveform = self.waveform_var.get()
-            amplitude = self.volume_var.get()
-            
-            signal = self.generate_waveform(frequency, duration, waveform, amplitude)
-            
-            # 生成文件名
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"generated_{waveform}_{frequency}Hz_{duration}s_{timestamp}.wav"
-            
-            # 保存文件
-            with wave.open(os.path.join(self.recordings_dir, filename), 'w') as wf:
-                wf.setnchannels(self.channels)
-                wf.setsampwidth(2)  # 16-bit
-                wf.setframerate(self.sample_rate)
-                wf.writeframes((signal * 32767).astype(np.int16).tobytes())
-            
-            self.generator_status.config(text=f"Sound saved: {filename}")
-            
+            frequency, duration, waveform, amplitude = self.read_sound_parameters()
+            self.engine.save_generated_sound(frequency, duration, waveform, amplitude)
         except Exception as e:
             self.generator_status.config(text=f"Save failed: {str(e)}")
     
@@ -783,40 +398,22 @@ class AudioRecorder:
         """窗口关闭时的处理"""
         self.is_closing = True  # 设置关闭标志
         
-        # 停止所有正在进行的操作
-        if self.recording:
-            self.stop_recording()
-        if self.previewing:
-            self.stop_preview()
-        if self.generating:
-            self.stop_generation()
-        
-        # 清理资源
-        if self.stream:
-            try:
-                self.stream.stop()
-                self.stream.close()
-            except:
-                pass
-        if self.preview_stream:
-            try:
-                self.preview_stream.stop()
-                self.preview_stream.close()
-            except:
-                pass
-        if self.generator_stream:  # 添加生成流的清理
-            try:
-                self.generator_stream.stop()
-                self.generator_stream.close()
-            except:
-                pass
-        
         # 取消所有定时器
-        if self.update_plot_timer:
-            try:
-                self.root.after_cancel(self.update_plot_timer)
-            except:
-                pass
+        for timer in (self.update_plot_timer, self.ads_timer):
+            if timer:
+                try:
+                    self.root.after_cancel(timer)
+                except:
+                    pass
+        
+        # 先停止控制接口，关闭过程中不再接受外部命令
+        if self.control is not None:
+            self.control.stop()
+
+        # 停止所有正在进行的操作并清理资源
+        self.engine.shutdown()
+        if self.ads_client is not None:
+            self.ads_client.stop()
         
         # 关闭窗口
         self.root.quit()
@@ -832,13 +429,41 @@ class AudioRecorder:
         try:
             self.root.mainloop()
         except KeyboardInterrupt:
-            if self.recording:
+            if self.engine.recording:
                 self.stop_recording()
             self.root.quit()
             print("\nProgram terminated")
 
 def main():
-    recorder = AudioRecorder()
+    parser = argparse.ArgumentParser(description="Audio recording / stimulation tool")
+    parser.add_argument('--ads', metavar='URL', default=None,
+                        help="also record the ADS1110 voltage stream, e.g. ws://192.168.1.50:81")
+    parser.add_argument('--input-device', type=parse_device, action='append',
+                        help="input device; repeat to record several devices at the same time")
+    parser.add_argument('--channels', type=int, action='append',
+                        help="channels per input device (once for all devices, or once per device)")
+    parser.add_argument('--split-channels', action='store_true',
+                        help="write each channel to its own WAV file")
+    parser.add_argument('--format', dest='recording_format', choices=('wav', 'wavz'), default='wav',
+                        help="recording file format (wavz: lossless block-compressed archive)")
+    parser.add_argument('--trigger', type=float, default=None, metavar='DBFS',
+                        help="only keep recording segments whose level exceeds this threshold, e.g. -40")
+    parser.add_argument('--pre-trigger', type=float, default=2.0, help="seconds kept before each trigger")
+    parser.add_argument('--hold', type=float, default=3.0, help="seconds below threshold before a segment ends")
+    parser.add_argument('--control-port', type=int, default=None,
+                        help="serve the local HTTP/WebSocket control API on this port, e.g. 8765")
+    parser.add_argument('--device', metavar='URL', default=None,
+                        help="M5Core2 HTTP address started/stopped with recordings, e.g. http://192.168.1.50")
+    args = parser.parse_args()
+    engine = AudioEngine(
+        channels=args.channels or 1,
+        input_device=args.input_device or None,
+        split_channels=args.split_channels,
+        recording_format=args.recording_format
+    )
+    engine.set_trigger(args.trigger, pre_seconds=args.pre_trigger, hold_seconds=args.hold)
+    recorder = AudioRecorder(engine=engine, ads_url=args.ads, control_port=args.control_port,
+                             device_url=args.device)
     recorder.run()
 
 if __name__ == "__main__":
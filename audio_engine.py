@@ -0,0 +1,1215 @@
+import time
+from time import monotonic
+from datetime import datetime
+import threading
+import os
+import csv
+import queue
+import tempfile
+import argparse
+import functools
+from ring_buffer import RingBuffer
+from wav_writer import StreamingWavWriter, write_wav, write_wav_blocks
+from audio_archive import StreamingArchiveWriter
+from synth import ToneSynth, WavetableCache, WAVEFORMS, fill_looped
+from protocol import ProtocolPlayer, load_protocol
+from trigger import LevelTrigger, SegmentRecorder, level_db
+from features import DEFAULT_BANDS, parse_band
+from event_log import EventLog
+
+
+class RecordingInput:
+    """一个输入设备的录音状态：音频流、待写入队列、实时波形缓冲区与写入器"""
+
+    def __init__(self, device, channels, waveform_buffer):
+        self.device = device
+        self.channels = channels
+        self.queue = queue.Queue()
+        # (帧, 声道) 的环形缓冲区，回调中整块写入
+        self.waveform_buffer = waveform_buffer
+        self.stream = None
+        self.writer = None
+        # 触发录音模式下的电平触发器
+        self.trigger = None
+
+
+class ProtocolRun:
+    """一次协议播放（或双工录音）的状态，由播放线程创建与收尾"""
+
+    def __init__(self, session, player, duplex=False):
+        self.session = session
+        self.player = player
+        # 回调放入的 (事件, ScheduledTone, 样本位置, DAC 时间)
+        self.events = player.events
+        self.duplex = duplex
+        self.stream = None
+        self.writer = None
+        self.onsets = {}
+        self.clock_offset = None
+        self.started = time.time()
+        self.first_event = 0
+        # 协议结束后还要继续运行的样本数（双工模式下为一个往返延迟）
+        self.tail_frames = 0
+
+
+class CommandLoop:
+    """一个后台线程按顺序执行提交的命令，没有命令时阻塞等待"""
+
+    def __init__(self, name="commands"):
+        self.queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """提交命令，立即返回（可以在任何线程中调用，包括音频回调）"""
+        self.queue.put((func, args))
+
+    def close(self, timeout=2.0):
+        """执行完已提交的命令后结束线程"""
+        self.queue.put(None)
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            func, args = item
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Error in {self._thread.name} command: {e}")
+
+
+class AudioEngine:
+    """不依赖 GUI 的录音 / 声音生成 / 预览 / 日志核心
+
+    状态变化通过 add_listener() 注册的回调通知，回调签名为
+    callback(topic, message)，topic 为 'recording'、'generator'、'info' 或 'error'。
+    回调可能在音频或工作线程中被调用。
+    每次播放的第一块送入输出流时另有 topic 'onset'，message 为
+    {'session', 'host_time'（回调时的 time.monotonic()）, 'output_latency'（到 DAC 的秒数）}。
+
+    input_device 可以是设备列表，每个设备各开一个输入流，同时录音；
+    channels 为每个设备的声道数（一个值对所有设备相同，或与设备一一对应的列表）。
+    不同设备的流各自计时，样本之间不保证严格同步。
+    """
+
+    def __init__(self, sample_rate=44100, channels=1, recordings_dir="recordings", logs_dir="logs",
+                 input_device=None, output_device=None, split_channels=False, recording_format='wav'):
+        # 基本设置
+        self.sample_rate = sample_rate
+        devices = list(input_device) if isinstance(input_device, (list, tuple)) else [input_device]
+        counts = list(channels) if isinstance(channels, (list, tuple)) else [channels]
+        if len(counts) == 1:
+            counts = counts * len(devices)
+        if len(counts) != len(devices):
+            raise ValueError("channels must give one count per input device")
+        # 第一个设备同时用于双工模式
+        self.channels = counts[0]
+        self.input_device = devices[0]
+        self.output_device = output_device
+        # 生成的声音为单声道
+        self.output_channels = 1
+        # 多声道录音时每个声道写入单独的 WAV，否则交错写入一个文件
+        self.split_channels = split_channels
+        # 'wav' 为普通 WAV，'wavz' 为分块无损压缩（见 audio_archive）
+        self.recording_format = recording_format
+        # 触发录音设置（见 set_trigger），None 表示连续录音
+        self.trigger_settings = None
+        # 每个录音文件旁写出的特征轨（见 features），None 表示不写
+        self.feature_settings = {'interval': 0.5, 'bands': DEFAULT_BANDS}
+        self.recording = False
+        self.paused = False
+        # 实时波形显示的历史长度（秒）
+        self.waveform_seconds = 5.0
+        self.inputs = [
+            RecordingInput(device, count,
+                           RingBuffer.from_seconds(self.waveform_seconds, self.sample_rate, channels=count))
+            for device, count in zip(devices, counts)
+        ]
+        self.audio_queue = self.inputs[0].queue
+        self.waveform_buffer = self.inputs[0].waveform_buffer
+        self.waveform_buffers = [source.waveform_buffer for source in self.inputs]
+        # 长时间录音按时长/大小切分文件
+        self.recording_rotate_seconds = 3600
+        self.recording_rotate_bytes = 1 << 31
+        self.recording_writer = None
+        self.start_time = None
+
+        # 音频流相关
+        self.preview_stream = None
+        self.generator_stream = None
+
+        # 声音生成与预览的输出流都由一个播放线程按命令顺序打开和关闭，
+        # 播放结束由流的 finished_callback 通知，不需要轮询
+        self.playback = CommandLoop("playback")
+        self._sd = None
+
+        # 状态标志
+        self.generating = False
+        self.previewing = False
+        self.protocol_running = False
+        self.is_closing = False
+
+        # 声音生成相关
+        self.generator_start_time = None
+        self.generator_synth = None
+        self.generator_params = None
+        self.preview_start_time = None
+        # 每次开始播放 / 预览编号加一，播放线程据此忽略已经过时的命令
+        self.generator_session = 0
+        self.preview_session = 0
+        self._generator_stream_session = None
+        self._preview_stream_session = None
+        # 等待报告起始时刻的播放编号，由回调在第一块时清除
+        self._onset_session = None
+        # 预览用波形表缓存；预览中切换参数时由回调在块边界换表
+        self.wavetables = WavetableCache(self.sample_rate)
+        self.preview_table = None
+        self.preview_pending = None
+        self.preview_params = None
+        # 刺激协议相关
+        self.protocol_stream = None
+        self.protocol_player = None
+        # 每次开始协议编号加一；当前协议的状态（流、事件队列、写入器）
+        self.protocol_session = 0
+        self._protocol_run = None
+        self.protocol_log = []
+        # 双工模式：录音与刺激共用一个 sd.Stream
+        self.duplex = False
+        self.duplex_stream = None
+        self.duplex_latency_frames = None
+
+        # 状态监听者
+        self.listeners = []
+
+        # 创建必要的目录
+        self.recordings_dir = recordings_dir
+        self.logs_dir = logs_dir
+        self.use_temp_dir = False
+
+        # 尝试创建目录，如果失败则使用临时目录
+        try:
+            for directory in [self.recordings_dir, self.logs_dir]:
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+        except (PermissionError, OSError) as e:
+            print(f"无法创建目录: {e}")
+            # 使用临时目录
+            temp_dir = tempfile.gettempdir()
+            self.recordings_dir = os.path.join(temp_dir, "audio_recordings")
+            self.logs_dir = os.path.join(temp_dir, "audio_logs")
+            self.use_temp_dir = True
+
+            # 创建临时目录
+            for directory in [self.recordings_dir, self.logs_dir]:
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+
+        # 日志由后台线程批量写入，按日期（或大小）轮转，内存中只保留最近的记录
+        self.recording_log = EventLog(self.logs_dir, "recording_log", [
+            'Start Time',
+            'End Time',
+            'Filename',
+            'Duration (s)',
+            'Sample Rate',
+            'Status'
+        ])
+        self.sound_log = EventLog(self.logs_dir, "sound_log", [
+            'Start Time',
+            'End Time',
+            'Type',
+            'Frequency (Hz)',
+            'Waveform',
+            'Duration (s)',
+            'Volume',
+            'Status'
+        ])
+        self.recording_logs = self.recording_log.tail
+        self.sound_logs = self.sound_log.tail
+
+    def add_listener(self, callback):
+        """注册状态回调 callback(topic, message)"""
+        self.listeners.append(callback)
+
+    def notify(self, topic, message):
+        """通知所有监听者"""
+        for callback in list(self.listeners):
+            try:
+                callback(topic, message)
+            except Exception as e:
+                print(f"Error in engine listener: {e}")
+
+    def get_timestamp(self):
+        """Get formatted timestamp"""
+        return self.format_timestamp(datetime.now())
+
+    def format_timestamp(self, dt):
+        """Format datetime as log timestamp"""
+        return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+    def log_recording(self, filename, duration, status="Success", start_time=None, end_time=None):
+        """Log recording information to CSV"""
+        try:
+            end_time = end_time or self.get_timestamp()
+            if self.start_time is None:
+                self.start_time = self.get_timestamp()
+
+            log_entry = [
+                start_time or self.start_time,
+                end_time,
+                filename,
+                f"{duration:.2f}",
+                self.sample_rate,
+                status
+            ]
+
+            self.recording_log.append(log_entry)
+        except Exception as e:
+            print(f"记录录音信息失败: {e}")
+
+    def log_sound(self, sound_type, frequency, waveform, duration, volume, status="Success",
+                  start_time=None, end_time=None):
+        """Log sound generation/preview information to CSV"""
+        try:
+            if end_time is None:
+                end_time = self.get_timestamp()
+            # 移除对self.start_time的依赖，直接计算开始时间
+            if start_time is None:
+                start_time = self.format_timestamp(datetime.fromtimestamp(time.time() - duration))
+
+            log_entry = [
+                start_time,
+                end_time,
+                sound_type,
+                frequency,
+                waveform,
+                f"{duration:.2f}",
+                f"{volume:.2f}",
+                status
+            ]
+
+            self.sound_log.append(log_entry)
+        except Exception as e:
+            print(f"记录声音信息失败: {e}")
+
+    def audio_callback(self, indata, frames, time, status, source=None):
+        """音频回调函数，source 为该流对应的 RecordingInput"""
+        if status:
+            print(f"Status: {status}")
+        if self.recording and not self.paused and not self.is_closing:
+            try:
+                source = source or self.inputs[0]
+                if source.trigger is not None:
+                    # 触发模式只把片段内的数据送去写盘
+                    source.trigger.process(indata, source.queue)
+                else:
+                    source.queue.put(indata.copy())
+                # 更新实时波形（所有声道一次原地写入环形缓冲区，不分配内存）
+                source.waveform_buffer.write(indata)
+            except Exception as e:
+                print(f"Error in audio callback: {e}")
+                self.stop_recording()
+
+    def save_recording(self, data, filename):
+        """保存录音文件"""
+        try:
+            filepath = os.path.join(self.recordings_dir, filename)
+            write_wav(filepath, data, self.sample_rate, self.channels)
+            print(f"录音已保存: {filepath}")
+            return True
+        except Exception as e:
+            print(f"保存录音失败: {e}")
+            # 尝试使用临时目录
+            if not self.use_temp_dir:
+                try:
+                    temp_dir = tempfile.gettempdir()
+                    temp_recordings_dir = os.path.join(temp_dir, "audio_recordings")
+                    if not os.path.exists(temp_recordings_dir):
+                        os.makedirs(temp_recordings_dir)
+                    filepath = os.path.join(temp_recordings_dir, filename)
+                    write_wav(filepath, data, self.sample_rate, self.channels)
+                    print(f"录音已保存到临时目录: {filepath}")
+                    self.notify('info', f"由于权限问题，录音已保存到临时目录:\n{filepath}")
+                    return True
+                except Exception as e2:
+                    print(f"保存到临时目录也失败: {e2}")
+                    self.notify('error', f"无法保存录音文件: {e2}")
+                    return False
+            else:
+                self.notify('error', f"无法保存录音文件: {e}")
+                return False
+
+    def open_recording_writer(self, basename, source=None, own_queue=False):
+        """为一个输入设备创建流式录音写入器，目录不可写时退回临时目录
+
+        own_queue=True 时写入器使用自己的队列（由调用方 write() 送入数据）。
+        """
+        source = source or self.inputs[0]
+        directories = [self.recordings_dir]
+        if not self.use_temp_dir:
+            directories.append(os.path.join(tempfile.gettempdir(), "audio_recordings"))
+        for i, directory in enumerate(directories):
+            try:
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                writer_class = StreamingArchiveWriter if self.recording_format == 'wavz' else StreamingWavWriter
+                writer = writer_class(
+                    directory, basename, self.sample_rate, source.channels,
+                    source=None if own_queue else source.queue,
+                    max_seconds=self.recording_rotate_seconds,
+                    max_bytes=self.recording_rotate_bytes,
+                    split_channels=self.split_channels,
+                    features=self.feature_settings
+                )
+                writer.start()
+                if i > 0:
+                    print(f"录音将保存到临时目录: {directory}")
+                    self.notify('info', f"由于权限问题，录音将保存到临时目录:\n{directory}")
+                return writer
+            except (PermissionError, OSError) as e:
+                print(f"无法创建录音文件: {e}")
+        raise OSError("无法创建录音文件")
+
+    def set_trigger(self, threshold_db=None, mode='rms', pre_seconds=2.0, hold_seconds=3.0):
+        """设置触发录音：电平超过 threshold_db (dBFS) 时开始一个片段，
+        保留之前 pre_seconds 秒，低于阈值 hold_seconds 秒后结束；threshold_db=None 恢复连续录音。
+        下一次 start_recording() 生效。"""
+        if threshold_db is None:
+            self.trigger_settings = None
+        else:
+            self.trigger_settings = {
+                'threshold_db': threshold_db,
+                'mode': mode,
+                'pre_seconds': pre_seconds,
+                'hold_seconds': hold_seconds
+            }
+
+    def open_segment_recorder(self, basename, source):
+        """触发模式的写入器：每个片段写入 <basename>_segNNNN.wav，并记录到 <basename>.segments.csv"""
+        recorder = SegmentRecorder(
+            source.queue, self.sample_rate,
+            open_writer=lambda index: self.open_recording_writer(f"{basename}_seg{index:04d}", source, own_queue=True),
+            on_segment=lambda segment: self.log_segment(basename, segment)
+        )
+        recorder.start()
+        return recorder
+
+    def log_segment(self, basename, segment):
+        """为一个触发片段写录音日志（精确的开始时间）和片段索引"""
+        writer = segment['writer']
+        path = os.path.join(writer.directory, f"{basename}.segments.csv")
+        status = "Success" if writer.error is None else "Save failed"
+        try:
+            new_file = not os.path.exists(path)
+            with open(path, 'a', newline='') as f:
+                csv_writer = csv.writer(f)
+                if new_file:
+                    csv_writer.writerow(['Segment', 'File', 'Start Frame', 'Start Offset (s)', 'Start Time',
+                                         'Frames', 'Duration (s)', 'Trigger Level (dBFS)'])
+                offset = 0
+                for part in writer.files:
+                    # 切分出的每个文件单独记录，起始位置依次累加
+                    if part.get('channel'):
+                        continue
+                    start_frame = segment['start_frame'] + offset
+                    started = segment['started'] + offset / self.sample_rate
+                    duration = part['frames'] / self.sample_rate
+                    start_time = self.format_timestamp(datetime.fromtimestamp(started))
+                    end_time = self.format_timestamp(datetime.fromtimestamp(started + duration))
+                    csv_writer.writerow([
+                        segment['index'], part['filename'], start_frame,
+                        f"{start_frame / self.sample_rate:.6f}", start_time,
+                        part['frames'], f"{duration:.6f}", f"{level_db(segment['level']):.1f}"
+                    ])
+                    for channel_part in writer.files:
+                        if channel_part['opened'] == part['opened']:
+                            self.log_recording(channel_part['filename'], duration, status,
+                                               start_time=start_time, end_time=end_time)
+                    offset += part['frames']
+        except Exception as e:
+            print(f"写入片段索引失败: {e}")
+
+    def pause_recording(self):
+        """暂停录音（双工模式下不支持，否则刺激位置无法对应到 WAV 样本）"""
+        if self.recording and not self.paused and not self.duplex:
+            self.paused = True
+            self.notify('recording', "Recording paused")
+
+    def resume_recording(self):
+        """继续录音"""
+        if self.recording and self.paused:
+            self.paused = False
+            self.notify('recording', "Recording resumed")
+
+    def start_recording(self):
+        """开始录音（每个输入设备一个流和一个写入器），成功返回 True"""
+        if self.duplex:
+            # 双工流已经在录音（或正在打开），再打开输入流会占用同一个设备
+            self.notify('recording', "Already recording in the duplex protocol stream")
+            return False
+        try:
+            self.close_input_streams()
+
+            self.recording = True
+            self.paused = False
+            self.start_time = self.get_timestamp()
+
+            # 丢弃上次残留的数据，启动后台写入线程
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            for i, source in enumerate(self.inputs):
+                source.waveform_buffer.clear()
+                while not source.queue.empty():
+                    try:
+                        source.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                suffix = f"_dev{i + 1}" if len(self.inputs) > 1 else ""
+                basename = f"ambient_sound_{timestamp}{suffix}"
+                if self.trigger_settings is not None:
+                    source.trigger = LevelTrigger(self.sample_rate, source.channels, **self.trigger_settings)
+                    source.writer = self.open_segment_recorder(basename, source)
+                else:
+                    source.trigger = None
+                    source.writer = self.open_recording_writer(basename, source)
+
+            # 开始录音流（sounddevice 导入时会初始化 PortAudio，推迟到第一次使用）
+            import sounddevice as sd
+            for source in self.inputs:
+                source.stream = sd.InputStream(
+                    device=source.device,
+                    channels=source.channels,
+                    samplerate=self.sample_rate,
+                    callback=functools.partial(self.audio_callback, source=source)
+                )
+            for source in self.inputs:
+                source.stream.start()
+            self.notify('recording', "Recording started")
+            return True
+
+        except Exception as e:
+            print(f"Failed to start recording: {e}")
+            self.recording = False
+            self.close_input_streams()
+            for source in self.inputs:
+                if source.writer:
+                    source.writer.close()
+                    source.writer = None
+            self.notify('recording', "Failed to start recording")
+            return False
+
+    def close_input_streams(self):
+        """停止并关闭所有输入流"""
+        for source in self.inputs:
+            if source.stream is not None:
+                try:
+                    source.stream.stop()
+                    source.stream.close()
+                except Exception as e:
+                    print(f"Error closing input stream: {e}")
+                source.stream = None
+
+    def stop_recording(self):
+        """停止录音，返回写入的总时长（秒）"""
+        if not self.recording:
+            return 0
+        # 双工模式下录音与刺激共用一个流，由播放线程收尾
+        if self.duplex:
+            self.stop_protocol()
+            return 0
+        try:
+            self.recording = False
+            self.close_input_streams()
+
+            # 写完队列中剩余的数据并关闭文件
+            duration = 0
+            for source in self.inputs:
+                if source.trigger is not None:
+                    source.trigger.flush(source.queue)
+                    source.trigger = None
+                writer = source.writer
+                source.writer = None
+                duration = max(duration, self.finish_recording_writer(writer))
+            return duration
+
+        except Exception as e:
+            print(f"Failed to stop recording: {e}")
+            self.log_recording("unknown", 0, f"Error: {str(e)}")
+            self.notify('recording', "Failed to stop recording")
+            return 0
+
+    def finish_recording_writer(self, writer):
+        """关闭写入器并为每个文件写录音日志，返回总时长（秒）"""
+        if writer:
+            writer.close()
+
+        if isinstance(writer, SegmentRecorder):
+            # 触发模式的日志在每个片段结束时已经写入
+            if writer.error is not None:
+                self.notify('recording', "Failed to save recording")
+            elif writer.segments:
+                self.notify('recording', f"Recording saved: {len(writer.segments)} segments, {writer.duration:.2f}s")
+            else:
+                self.notify('recording', "Recording stopped (no trigger)")
+            return writer.duration
+
+        if writer and writer.frames_written:
+            # 每个切分出的文件单独记录一条日志
+            for part in writer.files:
+                start_time = self.format_timestamp(datetime.fromtimestamp(part['opened']))
+                status = "Success" if writer.error is None else "Save failed"
+                self.log_recording(part['filename'], part['frames'] / self.sample_rate,
+                                   status, start_time=start_time)
+            if writer.error is None:
+                self.notify('recording', f"Recording saved: {writer.duration:.2f}s")
+            else:
+                self.notify('recording', "Failed to save recording")
+            return writer.duration
+        self.notify('recording', "Recording stopped")
+        return 0
+
+    def generate_waveform(self, frequency, duration, waveform='sine', amplitude=0.5):
+        """生成指定波形的完整信号（播放与保存改为逐块合成，见 ToneSynth）"""
+        return ToneSynth(frequency, waveform, amplitude, self.sample_rate, duration).render_all()
+
+    def start_generation(self, frequency, duration, waveform='sine', amplitude=0.5):
+        """播放一段声音（由播放线程打开输出流，立即返回）"""
+        if self.generating:
+            return False
+        self.generating = True
+        self.generator_session += 1
+        self.notify('generator', "Generating...")
+        self.playback.submit(self._open_generation, self.generator_session, frequency, duration, waveform, amplitude)
+        return True
+
+    def stop_generation(self):
+        """停止声音生成（输出流在播放线程中中止，不阻塞调用方）"""
+        self.generating = False
+        self.notify('generator', "Generation stopped")
+        self.playback.submit(self._close_generation, self.generator_session, None)
+
+    def _open_generation(self, session, frequency, duration, waveform, amplitude):
+        """播放线程：打开输出流；播放结束时回调抛出 CallbackStop，流的 finished_callback 通知收尾"""
+        if session != self.generator_session or not self.generating:
+            # 打开之前已经被停止
+            return
+        self.generator_params = (frequency, waveform, amplitude)
+        self.generator_start_time = time.time()
+        try:
+            # 合成器在回调中逐块生成信号
+            self.generator_synth = ToneSynth(frequency, waveform, amplitude, self.sample_rate, duration)
+            sd = self.sounddevice()
+            stream = sd.OutputStream(
+                device=self.output_device,
+                channels=self.output_channels,
+                samplerate=self.sample_rate,
+                callback=self.generator_callback,
+                finished_callback=lambda: self.playback.submit(self._close_generation, session, stream)
+            )
+            self.generator_stream = stream
+            self._generator_stream_session = session
+            self._onset_session = session
+            stream.start()
+        except Exception as e:
+            self.generating = False
+            self.close_stream(self.generator_stream)
+            self.generator_stream = None
+            self.notify('generator', f"Generation failed: {str(e)}")
+            self.log_sound("Generation", frequency, waveform, 0, amplitude, f"Error: {str(e)}")
+
+    def _close_generation(self, session, finished):
+        """播放线程：关闭第 session 次播放的输出流；finished 为自然结束的流，None 表示被停止"""
+        stream = self.generator_stream
+        if stream is None or self._generator_stream_session != session \
+                or (finished is not None and finished is not stream):
+            # 已经被停止或替换的流
+            return
+        self.generator_stream = None
+        self.close_stream(stream, abort=finished is None)
+        if finished is not None and self.generating and session == self.generator_session:
+            actual_duration = time.time() - self.generator_start_time  # 计算实际播放时长
+            self.generating = False
+            frequency, waveform, amplitude = self.generator_params
+            self.notify('generator', "Sound generated")
+            self.log_sound("Generation", frequency, waveform, actual_duration, amplitude)
+
+    def generator_callback(self, outdata, frames, time, status):
+        """生成声音的回调函数"""
+        if status:
+            print(f"Generator status: {status}")
+
+        if self.generating:
+            try:
+                # 只合成当前块，播放结束后的部分填充静音
+                written = self.generator_synth.render(outdata[:, 0])
+                outdata[written:] = 0
+            except Exception as e:
+                print(f"Error in generator callback: {e}")
+                self.stop_generation()
+                outdata.fill(0)
+            else:
+                session = self._onset_session
+                if session is not None:
+                    self._onset_session = None
+                    self.report_onset(session, time)
+                if self.generator_synth.finished:
+                    # 本块播放完后结束流，随后调用 finished_callback
+                    raise self._sd.CallbackStop
+        else:
+            outdata.fill(0)
+
+    def report_onset(self, session, time_info):
+        """音频回调中调用：记下第一块的时刻，通知交给播放线程发出"""
+        host_time = monotonic()
+        dac_time = getattr(time_info, 'outputBufferDacTime', 0)
+        current = getattr(time_info, 'currentTime', 0)
+        # 部分后端不提供流时钟，此时只能以回调时刻作为起始
+        output_latency = max(dac_time - current, 0.0) if dac_time and current else 0.0
+        self.playback.submit(self.notify, 'onset', {
+            'session': session,
+            'host_time': host_time,
+            'output_latency': output_latency
+        })
+
+    def start_preview(self, frequency, waveform='sine', amplitude=0.5):
+        """循环预览声音（由播放线程打开输出流，立即返回）"""
+        if self.previewing:
+            return False
+        self.previewing = True
+        self.preview_session += 1
+        self.notify('generator', "Previewing...")
+        self.preview_params = (frequency, waveform, amplitude)
+        self.preview_pending = None
+        self.playback.submit(self._open_preview, self.preview_session)
+        return True
+
+    def update_preview(self, frequency=None, waveform=None, amplitude=None):
+        """预览过程中修改参数，新的波形表在下一个音频块生效且相位连续"""
+        if not self.previewing or self.preview_params is None:
+            return
+        old_frequency, old_waveform, old_amplitude = self.preview_params
+        params = (
+            old_frequency if frequency is None else frequency,
+            old_waveform if waveform is None else waveform,
+            old_amplitude if amplitude is None else amplitude
+        )
+        if params == self.preview_params:
+            return
+        self.preview_params = params
+        self.preview_pending = self.wavetables.get(*params)
+
+    def stop_preview(self):
+        """停止预览（输出流在播放线程中中止，不阻塞调用方）"""
+        self.previewing = False
+        self.notify('generator', "Preview stopped")
+        # 参数随命令一起提交，之后马上开始的新预览不会影响这次的日志
+        self.playback.submit(self._close_preview, self.preview_session, None, self.preview_params)
+
+    def _open_preview(self, session):
+        """播放线程：打开循环预览的输出流"""
+        if session != self.preview_session or not self.previewing:
+            return
+        frequency, waveform, amplitude = self.preview_params
+        self.preview_start_time = time.time()
+        try:
+            # 取得整数个周期的波形表，循环播放时接缝处无跳变
+            self.preview_table = self.wavetables.get(frequency, waveform, amplitude)
+            self.preview_position = 0
+            sd = self.sounddevice()
+            stream = sd.OutputStream(
+                device=self.output_device,
+                channels=self.output_channels,
+                samplerate=self.sample_rate,
+                callback=self.preview_callback,
+                finished_callback=lambda: self.playback.submit(self._close_preview, session, stream)
+            )
+            self.preview_stream = stream
+            self._preview_stream_session = session
+            stream.start()
+        except Exception as e:
+            self.previewing = False
+            self.close_stream(self.preview_stream)
+            self.preview_stream = None
+            self.notify('generator', f"Preview failed: {str(e)}")
+            self.log_sound("Preview", frequency, waveform, 0, amplitude, f"Error: {str(e)}")
+
+    def _close_preview(self, session, finished, params=None):
+        """播放线程：关闭第 session 次预览的流并记录实际播放时长"""
+        stream = self.preview_stream
+        if stream is None or self._preview_stream_session != session \
+                or (finished is not None and finished is not stream):
+            return
+        self.preview_stream = None
+        self.close_stream(stream, abort=finished is None)
+        if finished is not None and self.previewing and session == self.preview_session:
+            # 流意外结束（设备错误等）
+            self.previewing = False
+            self.notify('generator', "Preview stopped")
+        actual_duration = time.time() - self.preview_start_time  # 计算实际播放时长
+        frequency, waveform, amplitude = params or self.preview_params
+        self.log_sound("Preview", frequency, waveform, actual_duration, amplitude)
+
+    def preview_callback(self, outdata, frames, time, status):
+        """预览回调函数"""
+        if status:
+            print(f"Preview status: {status}")
+
+        if self.previewing:
+            try:
+                # 参数改变时在块边界换表，按相位换算读取位置
+                pending = self.preview_pending
+                if pending is not None:
+                    self.preview_pending = None
+                    phase = self.preview_table.phase_at(self.preview_position)
+                    self.preview_table = pending
+                    self.preview_position = pending.position_at(phase)
+
+                # 循环播放波形表（整段切片拷贝）
+                self.preview_position = fill_looped(outdata[:, 0], self.preview_table.samples, self.preview_position)
+            except Exception as e:
+                print(f"Error in preview callback: {e}")
+                self.stop_preview()
+                outdata.fill(0)
+        else:
+            outdata.fill(0)
+
+    def sounddevice(self):
+        """导入 sounddevice（导入时会初始化 PortAudio，推迟到第一次使用）"""
+        if self._sd is None:
+            import sounddevice as sd
+            self._sd = sd
+        return self._sd
+
+    def close_stream(self, stream, abort=False):
+        """停止并关闭一个流；abort 时丢弃尚未播放的缓冲，约一个音频块内停止"""
+        if stream is None:
+            return
+        try:
+            if abort:
+                stream.abort()
+            else:
+                stream.stop()
+            stream.close()
+        except Exception as e:
+            print(f"Error closing stream: {e}")
+
+    def save_generated_sound(self, frequency, duration, waveform='sine', amplitude=0.5):
+        """保存生成的声音，返回文件名"""
+        synth = ToneSynth(frequency, waveform, amplitude, self.sample_rate, duration)
+
+        # 生成文件名
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"generated_{waveform}_{frequency}Hz_{duration}s_{timestamp}.wav"
+
+        # 保存文件
+        write_wav_blocks(os.path.join(self.recordings_dir, filename), synth.blocks(), self.sample_rate, self.output_channels)
+        self.notify('generator', f"Sound saved: {filename}")
+        return filename
+
+    def start_protocol(self, steps):
+        """播放刺激协议（Tone / Gap / Repeat 列表；由播放线程打开输出流，立即返回）"""
+        if self.protocol_running:
+            return False
+        self.protocol_running = True
+        self.duplex = False
+        self.protocol_session += 1
+        self.notify('generator', "Protocol running...")
+        self.playback.submit(self._open_protocol, self.protocol_session, steps)
+        return True
+
+    def start_duplex(self, steps):
+        """用一个双工流同时录音并播放刺激协议
+
+        输入与输出由同一个回调处理，共用一个采样时钟，因此每个刺激的
+        起止都能换算成录音 WAV 中的精确样本位置，写入同名的 .events.csv。
+        """
+        if self.protocol_running or self.recording:
+            return False
+        self.protocol_running = True
+        self.duplex = True
+        self.protocol_session += 1
+        self.notify('generator', "Protocol running (duplex)...")
+        self.playback.submit(self._open_duplex, self.protocol_session, steps)
+        return True
+
+    def _open_protocol(self, session, steps):
+        """播放线程：打开协议的输出流；播放完毕时回调抛出 CallbackStop，流的 finished_callback 通知收尾"""
+        if session != self.protocol_session or not self.protocol_running:
+            self._cancel_protocol(session)
+            return
+        run = self._protocol_run = ProtocolRun(session, ProtocolPlayer(steps, self.sample_rate, queue.SimpleQueue()))
+        self.protocol_player = run.player
+        try:
+            sd = self.sounddevice()
+            stream = sd.OutputStream(
+                device=self.output_device,
+                channels=self.output_channels,
+                samplerate=self.sample_rate,
+                callback=self.protocol_callback,
+                finished_callback=lambda: self.playback.submit(self._close_protocol, session, stream)
+            )
+            run.stream = self.protocol_stream = stream
+            stream.start()
+            self.start_protocol_clock(run)
+        except Exception as e:
+            self._close_protocol(session, None, f"Protocol failed: {str(e)}")
+
+    def _open_duplex(self, session, steps):
+        """播放线程：打开双工流并开始录音"""
+        if session != self.protocol_session or not self.protocol_running:
+            self._cancel_protocol(session)
+            return
+        run = self._protocol_run = ProtocolRun(session, ProtocolPlayer(steps, self.sample_rate, queue.SimpleQueue()),
+                                               duplex=True)
+        run.first_event = len(self.protocol_log)
+        self.protocol_player = run.player
+        self.duplex_latency_frames = None
+        try:
+            # 与普通录音相同的准备工作
+            self.paused = False
+            self.waveform_buffer.clear()
+            self.start_time = self.get_timestamp()
+            while not self.audio_queue.empty():
+                try:
+                    self.audio_queue.get_nowait()
+                except queue.Empty:
+                    break
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            run.writer = self.recording_writer = self.open_recording_writer(f"ambient_sound_{timestamp}")
+
+            sd = self.sounddevice()
+            stream = sd.Stream(
+                device=(self.input_device, self.output_device),
+                channels=(self.channels, self.output_channels),
+                samplerate=self.sample_rate,
+                callback=self.duplex_callback,
+                finished_callback=lambda: self.playback.submit(self._close_protocol, session, stream)
+            )
+            run.stream = self.duplex_stream = stream
+            # 协议结束后多录一个往返延迟，确保最后的输出也被录到
+            latency = stream.latency
+            latency = sum(latency) if isinstance(latency, (tuple, list)) else latency
+            run.tail_frames = int(round(latency * self.sample_rate))
+            self.recording = True
+            stream.start()
+            self.start_protocol_clock(run)
+            self.notify('recording', "Recording started (duplex)")
+        except Exception as e:
+            self._close_protocol(session, None, f"Protocol failed: {str(e)}")
+
+    def start_protocol_clock(self, run):
+        """记下流开始的系统时间，以及流时钟（DAC 时间）与系统时钟之间的偏移"""
+        run.started = time.time()
+        try:
+            run.clock_offset = time.time() - run.stream.time
+        except Exception:
+            run.clock_offset = None
+
+    def _cancel_protocol(self, session):
+        """播放线程：协议在打开流之前已经被停止"""
+        if session == self.protocol_session:
+            self.duplex = False
+            self.notify('generator', "Protocol stopped")
+
+    def _close_protocol(self, session, finished, status=None):
+        """播放线程：关闭第 session 次协议的流并收尾；finished 为自然结束的流，None 表示被停止"""
+        run = self._protocol_run
+        if run is None or run.session != session \
+                or (finished is not None and finished is not run.stream):
+            # 已经被停止或替换的流
+            return
+        self._protocol_run = None
+        if run.duplex:
+            self.recording = False
+        self.close_stream(run.stream, abort=finished is None)
+        if run.duplex:
+            self.duplex_stream = None
+        else:
+            self.protocol_stream = None
+        run.player.stop()
+        self.log_protocol_events(run)
+        self.protocol_player = None
+        if run.duplex:
+            self.recording_writer = None
+            self.finish_recording_writer(run.writer)
+            if run.writer and run.writer.files:
+                self.write_duplex_events(run.writer, self.protocol_log[run.first_event:])
+        # 停止后马上开始的新协议不受影响
+        if session == self.protocol_session:
+            self.protocol_running = False
+            self.duplex = False
+            if status is None:
+                status = "Protocol stopped" if finished is None else "Protocol finished"
+            self.notify('generator', status)
+
+    def write_duplex_events(self, writer, events):
+        """把刺激事件换算到录音文件中的样本位置，写入 <录音名>.events.csv"""
+        latency = self.duplex_latency_frames or 0
+        path = os.path.join(writer.directory, f"{writer.basename}.events.csv")
+        try:
+            with open(path, 'w', newline='') as f:
+                csv_writer = csv.writer(f)
+                csv_writer.writerow(['Event', 'Step', 'Frequency (Hz)', 'File', 'Sample Index', 'Time (s)', 'DAC Time'])
+                # 按声道分文件时以第一个声道的文件为准
+                parts = [part for part in writer.files if not part.get('channel')]
+                for event in events:
+                    # 输出样本 k 在 DAC 发出，约 latency 个样本后出现在输入的第 k 个位置
+                    index = event['frame'] + latency
+                    for part in parts:
+                        if index < part['frames']:
+                            break
+                        index -= part['frames']
+                    else:
+                        # 超出录音末尾时仍按最后一个文件计
+                        index += part['frames']
+                    csv_writer.writerow([
+                        event['event'], event['step'], event['frequency'], part['filename'],
+                        index, f"{index / self.sample_rate:.6f}",
+                        '' if event['dac_time'] is None else f"{event['dac_time']:.6f}"
+                    ])
+        except Exception as e:
+            print(f"写入刺激事件文件失败: {e}")
+
+    def duplex_callback(self, indata, outdata, frames, time, status):
+        """双工回调：同一块内录入麦克风数据并输出刺激"""
+        if status:
+            print(f"Duplex status: {status}")
+
+        if self.recording and not self.is_closing:
+            try:
+                self.audio_queue.put(indata.copy())
+                self.waveform_buffer.write(indata)
+            except Exception as e:
+                print(f"Error in duplex callback: {e}")
+
+        dac_time = getattr(time, 'outputBufferDacTime', 0) or None
+        adc_time = getattr(time, 'inputBufferAdcTime', 0) or None
+        if self.duplex_latency_frames is None and dac_time is not None and adc_time is not None:
+            # 输出到输入的往返延迟（样本数），同一个流内保持不变
+            self.duplex_latency_frames = int(round((dac_time - adc_time) * self.sample_rate))
+
+        run = self._protocol_run
+        if self.protocol_running and run is not None:
+            try:
+                run.player.render(outdata, frames, dac_time)
+            except Exception as e:
+                print(f"Error in duplex callback: {e}")
+                outdata.fill(0)
+            else:
+                self.protocol_block_done(run, frames)
+        else:
+            outdata.fill(0)
+
+    def stop_protocol(self):
+        """停止刺激协议（流在播放线程中中止并收尾，不阻塞调用方）"""
+        self.protocol_running = False
+        self.playback.submit(self._close_protocol, self.protocol_session, None)
+
+    def log_protocol_events(self, run):
+        """播放线程：把回调产生的起止事件换算为系统时间并写入声音日志"""
+        onsets, clock_offset, started = run.onsets, run.clock_offset, run.started
+        while True:
+            try:
+                kind, scheduled, frame, dac_time = run.events.get_nowait()
+            except queue.Empty:
+                return
+            # DAC 时间不可用时按样本数从流开始时刻推算
+            if dac_time is not None and clock_offset is not None:
+                wall_time = dac_time + clock_offset
+            else:
+                wall_time = started + frame / self.sample_rate
+            self.protocol_log.append({
+                'event': kind,
+                'step': scheduled.index,
+                'frequency': scheduled.tone.frequency,
+                'frame': frame,
+                'dac_time': dac_time,
+                'time': wall_time
+            })
+            if kind == 'onset':
+                onsets[scheduled.index] = (frame, wall_time)
+                continue
+            start_frame, start_wall = onsets.pop(scheduled.index, (scheduled.start, wall_time))
+            tone = scheduled.tone
+            self.log_sound(
+                "Protocol", tone.frequency, tone.waveform,
+                (frame - start_frame) / self.sample_rate, tone.amplitude,
+                "Success" if kind == 'offset' else "Stopped",
+                start_time=self.format_timestamp(datetime.fromtimestamp(start_wall)),
+                end_time=self.format_timestamp(datetime.fromtimestamp(wall_time))
+            )
+
+    def protocol_callback(self, outdata, frames, time, status):
+        """刺激协议的输出回调"""
+        if status:
+            print(f"Protocol status: {status}")
+
+        run = self._protocol_run
+        if self.protocol_running and run is not None:
+            try:
+                dac_time = getattr(time, 'outputBufferDacTime', 0) or None
+                run.player.render(outdata, frames, dac_time)
+            except Exception as e:
+                print(f"Error in protocol callback: {e}")
+                outdata.fill(0)
+            else:
+                self.protocol_block_done(run, frames)
+        else:
+            outdata.fill(0)
+
+    def protocol_block_done(self, run, frames):
+        """音频回调中调用：起止事件交给播放线程写日志；协议（及双工的延迟尾巴）结束后停止流"""
+        if not run.events.empty():
+            self.playback.submit(self.log_protocol_events, run)
+        if run.player.finished:
+            run.tail_frames -= frames
+            if run.tail_frames <= 0:
+                # 本块播放完后结束流，随后调用 finished_callback
+                raise self._sd.CallbackStop
+
+    def shutdown(self):
+        """停止所有正在进行的操作并释放音频流"""
+        self.is_closing = True  # 设置关闭标志
+
+        # 停止所有正在进行的操作
+        if self.recording:
+            self.stop_recording()
+        if self.previewing:
+            self.stop_preview()
+        if self.generating:
+            self.stop_generation()
+        if self.protocol_running:
+            self.stop_protocol()
+        # 等待播放线程关闭已提交的流；协议 / 双工收尾时还会写日志，必须完全结束后才能关闭日志
+        self.playback.close(timeout=None)
+
+        # 清理资源
+        self.close_input_streams()
+        for stream in (self.preview_stream, self.generator_stream, self.duplex_stream):
+            if stream:
+                try:
+                    stream.stop()
+                    stream.close()
+                except:
+                    pass
+        self.preview_stream = None
+        self.generator_stream = None
+        self.duplex_stream = None
+
+        # 写入尚未落盘的日志
+        self.recording_log.close()
+        self.sound_log.close()
+
+    def query_logs(self, start=None, end=None):
+        """返回开始时间在 [start, end] 内的录音与声音日志 (recording_rows, sound_rows)"""
+        return self.recording_log.query(start, end), self.sound_log.query(start, end)
+
+
+def parse_device(value):
+    """设备参数既可以是编号也可以是名称"""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(description="Headless audio recording / stimulation engine")
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--channels', type=int, action='append',
+                        help="channels per input device (once for all devices, or once per device)")
+    parser.add_argument('--recordings-dir', default="recordings")
+    parser.add_argument('--logs-dir', default="logs")
+    parser.add_argument('--input-device', type=parse_device, action='append',
+                        help="input device; repeat to record several devices at the same time")
+    parser.add_argument('--split-channels', action='store_true',
+                        help="write each channel to its own WAV file")
+    parser.add_argument('--format', dest='recording_format', choices=('wav', 'wavz'), default='wav',
+                        help="recording file format (wavz: lossless block-compressed archive)")
+    parser.add_argument('--output-device', type=parse_device, default=None)
+    parser.add_argument('--feature-bands', type=parse_band, nargs='*', default=list(DEFAULT_BANDS),
+                        metavar='LOW-HIGH', help="band energies written to the .features.csv track")
+    parser.add_argument('--feature-interval', type=float, default=0.5, help="seconds per feature row")
+    parser.add_argument('--no-features', action='store_true', help="do not write a feature track")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help="record ambient sound")
+    record.add_argument('--duration', type=float, default=None,
+                        help="seconds to record (default: until Ctrl+C)")
+    record.add_argument('--trigger', type=float, default=None, metavar='DBFS',
+                        help="only keep segments whose level exceeds this threshold, e.g. -40")
+    record.add_argument('--trigger-mode', choices=('rms', 'peak'), default='rms')
+    record.add_argument('--pre-trigger', type=float, default=2.0, help="seconds kept before each trigger")
+    record.add_argument('--hold', type=float, default=3.0, help="seconds below threshold before a segment ends")
+
+    protocol = commands.add_parser('protocol', help="run a stimulation protocol from a JSON file")
+    protocol.add_argument('path')
+    protocol.add_argument('--duplex', action='store_true',
+                          help="record on the same stream and log onsets as WAV sample indices")
+
+    for name, help_text in (('generate', "play a tone"), ('preview', "loop a tone"), ('save', "save a tone to WAV")):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument('--frequency', type=float, default=440.0)
+        sub.add_argument('--waveform', default='sine', choices=WAVEFORMS)
+        sub.add_argument('--duration', type=float, default=1.0)
+        sub.add_argument('--volume', type=float, default=0.5)
+    return parser
+
+
+def wait_for(condition, timeout=None):
+    """阻塞等待条件成立或超时"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while condition():
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        time.sleep(0.05)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    engine = AudioEngine(
+        sample_rate=args.sample_rate,
+        channels=args.channels or 1,
+        recordings_dir=args.recordings_dir,
+        logs_dir=args.logs_dir,
+        input_device=args.input_device or None,
+        output_device=args.output_device,
+        split_channels=args.split_channels,
+        recording_format=args.recording_format
+    )
+    engine.feature_settings = None if args.no_features else {
+        'interval': args.feature_interval, 'bands': args.feature_bands}
+    engine.add_listener(lambda topic, message: print(f"[{topic}] {message}"))
+    try:
+        if args.command == 'record':
+            engine.set_trigger(args.trigger, args.trigger_mode, args.pre_trigger, args.hold)
+            if engine.start_recording():
+                wait_for(lambda: engine.recording, args.duration)
+        elif args.command == 'generate':
+            engine.start_generation(args.frequency, args.duration, args.waveform, args.volume)
+            wait_for(lambda: engine.generating)
+        elif args.command == 'preview':
+            engine.start_preview(args.frequency, args.waveform, args.volume)
+            wait_for(lambda: engine.previewing, args.duration)
+        elif args.command == 'save':
+            engine.save_generated_sound(args.frequency, args.duration, args.waveform, args.volume)
+        elif args.command == 'protocol':
+            steps = load_protocol(args.path)
+            if args.duplex:
+                engine.start_duplex(steps)
+            else:
+                engine.start_protocol(steps)
+            wait_for(lambda: engine.protocol_running)
+    except KeyboardInterrupt:
+        print("\nProgram terminated")
+    finally:
+        engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
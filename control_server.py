@@ -0,0 +1,850 @@
+"""录音程序内嵌的本地控制接口（HTTP + WebSocket）
+
+让脚本或其他程序协调刺激与 ADS 记录，例如“设备开始记录，等待 60 s，播放 1200 Hz 10 s”，
+不需要有人点按钮。服务器在后台线程的 asyncio 事件循环中运行，只用标准库；
+打开音频流等可能阻塞的引擎操作交给一个工作线程按顺序执行，不占用事件循环，
+也不在音频回调中做任何网络操作。
+
+HTTP（GET 或 POST 均可，参数放在查询串或 JSON 请求体中）：
+    GET  /status                   引擎状态、各输入声道电平、设备与 ADS 流状态
+    POST /record/start             开始录音；配置了设备时同时请求设备 /start（device=0 跳过）
+    POST /record/stop              停止录音；同样同时请求设备 /stop
+    POST /stimulus?frequency=1200&duration=10&waveform=sine&amplitude=0.5
+                                   播放刺激；等到第一块送入输出流后返回触发到起始的延迟（wait=0 立即返回）
+    POST /stimulus/stop
+    GET  /latency                  最近若干次刺激的延迟统计
+    GET  /device/status            转发设备的 /api；/device/start、/device/stop 转发对应请求
+    GET  /ws                       WebSocket：按 rate 推送状态与电平，转发引擎事件与起始延迟；
+                                   也可以发送 {"command": "stimulus", "frequency": 1200, ...} 形式的命令
+
+触发到起始的延迟从收到请求（请求头读完）算起：dispatch 为到输出回调第一次合成该刺激的时间，
+onset 再加上回调报告的输出延迟（outputBufferDacTime - currentTime），即声音到达 DAC 的时刻。
+
+没有设备时启动一个与固件 /start、/stop、/api 行为相同的本地替身：
+    python control_server.py mock-device --port 8080
+运行控制服务器（--simulate 使用模拟声卡）：
+    python control_server.py serve --device http://localhost:8080 --simulate
+协调一次实验：
+    python control_server.py sequence http://localhost:8765 --wait 60 --frequency 1200 --duration 10
+图形界面中启用：
+    python audio_controller.py --control-port 8765 --device http://192.168.1.50
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from time import monotonic
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from synth import WAVEFORMS
+from trigger import level_db
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY = 1 << 16
+
+
+class RequestError(Exception):
+    """返回给客户端的错误，带 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    """一个已解析的 HTTP 请求；received 为读完请求头时的 time.monotonic()"""
+
+    def __init__(self, method, path, params, headers, received):
+        self.method = method
+        self.path = path
+        self.params = params
+        self.headers = headers
+        self.received = received
+
+
+def flag(value):
+    """查询串中的开关：'0'、'false'、'no'、'off' 为假"""
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
+async def read_request(reader):
+    """读取一个请求，连接关闭时返回 None"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    received = monotonic()
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b''
+    url = urlsplit(target)
+    params = dict(parse_qsl(url.query))
+    if body and 'json' in headers.get('content-type', ''):
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            raise ValueError("JSON body must be an object")
+        params.update(data)
+    return Request(method.upper(), url.path.rstrip('/') or '/', params, headers, received)
+
+
+def http_response(status, body=b'', content_type='application/json', keep_alive=True):
+    """编码一个完整的响应（与固件一样允许跨域访问）"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    head = [
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Access-Control-Allow-Origin: *",
+        "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers: Content-Type",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    return ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+
+def json_response(status, data, keep_alive=True):
+    return http_response(status, json.dumps(data), keep_alive=keep_alive)
+
+
+def websocket_accept(key):
+    """Sec-WebSocket-Accept 握手值"""
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode('latin-1')).digest()).decode('latin-1')
+
+
+def ws_frame(payload, opcode=0x1):
+    """编码一个服务器发出的（不加掩码的）完整帧"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+
+async def read_ws_frame(reader):
+    """读取客户端的一帧，返回 (opcode, payload)；命令都很短，不支持分片"""
+    first, second = await reader.readexactly(2)
+    n = second & 0x7f
+    if n == 126:
+        n, = struct.unpack('!H', await reader.readexactly(2))
+    elif n == 127:
+        n, = struct.unpack('!Q', await reader.readexactly(8))
+    if n > MAX_BODY:
+        raise ValueError("websocket frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(n)
+    if mask:
+        payload = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+    return first & 0x0f, payload
+
+
+class HttpServer:
+    """在后台线程的事件循环中运行的最小 HTTP/1.1 服务器（支持 keep-alive）
+
+    子类实现 handle(request, reader, writer)，返回 False 时关闭连接。
+    port 为 0 时由系统分配，start() 返回后 self.port 为实际端口。
+    """
+
+    name = "http"
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.error = None
+        self._thread = None
+        self._stopping = None
+        self._ready = threading.Event()
+        self._connections = set()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def serve(self):
+        """运行服务器直到 stop() 被调用"""
+        self.loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        server = await asyncio.start_server(self._connection, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            await self.started()
+            try:
+                await self._stopping.wait()
+            finally:
+                await self.stopped()
+                for writer in list(self._connections):
+                    writer.close()
+
+    async def started(self):
+        """事件循环中服务器开始监听后调用"""
+
+    async def stopped(self):
+        """服务器关闭前调用"""
+
+    async def handle(self, request, reader, writer):
+        raise NotImplementedError
+
+    def start(self):
+        """在后台线程中运行，监听成功后返回"""
+        if self._thread is not None:
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        if self.error is not None:
+            self._thread = None
+            raise self.error
+
+    def stop(self):
+        """停止服务器并等待后台线程结束"""
+        if self._thread is None:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+        except (AttributeError, RuntimeError):
+            pass
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            print(f"{self.name} server failed: {e}")
+            self.error = e
+        finally:
+            self._ready.set()
+
+    async def _connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as e:
+                    writer.write(json_response(400, {'ok': False, 'error': str(e)}, keep_alive=False))
+                    break
+                if request is None:
+                    break
+                keep_alive = await self.handle(request, reader, writer)
+                await writer.drain()
+                if not keep_alive or request.headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+
+class DeviceClient:
+    """M5Core2 固件 HTTP 接口（/start、/stop、/api）的异步客户端"""
+
+    def __init__(self, base_url, timeout=2.0):
+        url = urlsplit(base_url if '://' in base_url else 'http://' + base_url)
+        self.url = base_url
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+
+    async def get(self, path):
+        """发送 GET 请求，返回 (状态码, 响应正文)"""
+        async def exchange():
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                writer.write(f"GET {self.prefix}{path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                             f"Connection: close\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+                return await reader.read()
+            finally:
+                writer.close()
+
+        response = await asyncio.wait_for(exchange(), self.timeout)
+        head, _, body = response.partition(b'\r\n\r\n')
+        status = int(head.split(b' ', 2)[1])
+        return status, body.decode('utf-8', 'replace')
+
+    async def command(self, path):
+        status, body = await self.get(path)
+        if status != 200:
+            raise ConnectionError(f"{path} returned {status}: {body}")
+        return body
+
+    async def start(self):
+        return await self.command('/start')
+
+    async def stop(self):
+        return await self.command('/stop')
+
+    async def status(self):
+        return json.loads(await self.command('/api'))
+
+
+class LatencyStats:
+    """保存最近 size 次刺激的触发到起始延迟（秒）"""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, sample):
+        self.samples.append(sample)
+        self.count += 1
+
+    def summary(self):
+        """各项延迟的均值、中位数、95 分位与最大值（毫秒）"""
+        result = {'count': self.count}
+        if not self.samples:
+            return result
+        for key in ('dispatch', 'onset'):
+            values = np.array([sample[key] for sample in self.samples]) * 1000
+            result[f"{key}_ms"] = {
+                'mean': round(float(values.mean()), 3),
+                'median': round(float(np.median(values)), 3),
+                'p95': round(float(np.percentile(values, 95)), 3),
+                'max': round(float(values.max()), 3),
+            }
+        return result
+
+
+def input_levels(engine, seconds=0.1):
+    """每个输入设备各声道最近 seconds 秒的 RMS 电平（dBFS），未录音时为 None"""
+    if not engine.recording or engine.paused:
+        return [None] * len(engine.waveform_buffers)
+    n = max(1, int(seconds * engine.sample_rate))
+    levels = []
+    for ring in engine.waveform_buffers:
+        block = ring.snapshot(n)
+        if not len(block):
+            levels.append(None)
+            continue
+        rms = np.sqrt(np.mean(np.square(block.reshape(len(block), -1), dtype=np.float64), axis=0))
+        levels.append([round(level_db(value), 1) for value in rms])
+    return levels
+
+
+class ControlServer(HttpServer):
+    """AudioEngine 的控制服务器
+
+    device 为固件的 HTTP 地址（如 http://192.168.1.50），ads_client 为可选的 AdsStreamClient。
+    rate 为 WebSocket 状态推送频率（Hz）；每个客户端最多排队 client_queue 条消息，
+    处理不过来的慢客户端丢弃最旧的消息，不会拖慢其他客户端。
+    """
+
+    name = "control"
+
+    def __init__(self, engine, host='127.0.0.1', port=8765, device=None, ads_client=None,
+                 rate=10.0, device_poll=1.0, onset_timeout=2.0, client_queue=64):
+        super().__init__(host, port)
+        self.engine = engine
+        self.device = DeviceClient(device) if device else None
+        self.ads_client = ads_client
+        self.rate = rate
+        self.device_poll = device_poll
+        self.onset_timeout = onset_timeout
+        self.client_queue = client_queue
+        self.device_status = None
+        self.latency = LatencyStats()
+        self.clients = set()
+        # 可能阻塞的引擎操作（打开 / 关闭音频流）按顺序在一个工作线程中执行
+        self.executor = None
+        # 播放编号 -> (收到请求的时刻, Future)，等待输出回调报告起始
+        self._pending = {}
+        self._tasks = []
+        self.commands = {
+            'status': self.status,
+            'latency': self.latency_report,
+            'record/start': self.record_start,
+            'record/stop': self.record_stop,
+            'stimulus': self.stimulus,
+            'stimulus/stop': self.stimulus_stop,
+            'device/start': self.device_start,
+            'device/stop': self.device_stop,
+            'device/status': self.device_refresh,
+        }
+        engine.add_listener(self.on_engine_event)
+        if ads_client is not None:
+            ads_client.add_listener(self.on_engine_event)
+
+    async def started(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="control-engine")
+        self._tasks.append(asyncio.ensure_future(self._push_status()))
+        if self.device is not None:
+            self._tasks.append(asyncio.ensure_future(self._poll_device()))
+        print(f"Control server listening on {self.url}")
+
+    async def stopped(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for _, future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self.executor.shutdown(wait=False)
+
+    # ---- 引擎事件（来自音频 / 工作线程）----
+
+    def on_engine_event(self, topic, message):
+        """引擎与 ADS 流的回调，转交事件循环处理"""
+        loop = self.loop
+        if loop is None or self._thread is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._apply_event, topic, message)
+        except RuntimeError:
+            pass
+
+    def _apply_event(self, topic, message):
+        if topic == 'onset':
+            self._record_onset(message)
+        else:
+            self.broadcast({'type': 'event', 'topic': topic, 'message': message})
+
+    def _record_onset(self, onset):
+        pending = self._pending.pop(onset['session'], None)
+        if pending is None:
+            # 由界面或其他途径发起的播放
+            return
+        received, future = pending
+        dispatch = onset['host_time'] - received
+        sample = {
+            'session': onset['session'],
+            'dispatch': dispatch,
+            'output': onset['output_latency'],
+            'onset': dispatch + onset['output_latency'],
+        }
+        self.latency.add(sample)
+        if not future.done():
+            future.set_result(sample)
+        self.broadcast({'type': 'onset', **self._latency_ms(sample)})
+
+    @staticmethod
+    def _latency_ms(sample):
+        return {
+            'session': sample['session'],
+            'dispatch_ms': round(sample['dispatch'] * 1000, 3),
+            'output_ms': round(sample['output'] * 1000, 3),
+            'onset_ms': round(sample['onset'] * 1000, 3),
+        }
+
+    # ---- 客户端 ----
+
+    def broadcast(self, message):
+        """向所有 WebSocket 客户端发送一条消息（只编码一次）"""
+        if not self.clients:
+            return
+        frame = ws_frame(json.dumps(message))
+        for outbox in list(self.clients):
+            if outbox.full():
+                outbox.get_nowait()
+            outbox.put_nowait(frame)
+
+    async def _push_status(self):
+        while True:
+            await asyncio.sleep(1.0 / self.rate)
+            if self.clients:
+                self.broadcast({'type': 'status', **self.snapshot()})
+
+    async def _poll_device(self):
+        while True:
+            try:
+                self.device_status = await self.device.status()
+            except Exception as e:
+                self.device_status = {'error': str(e) or type(e).__name__}
+            await asyncio.sleep(self.device_poll)
+
+    def snapshot(self):
+        """当前状态（在事件循环线程中读取引擎标志，不加锁）"""
+        engine = self.engine
+        status = {
+            'time': time.time(),
+            'recording': engine.recording,
+            'paused': engine.paused,
+            'generating': engine.generating,
+            'previewing': engine.previewing,
+            'protocol_running': engine.protocol_running,
+            'levels': input_levels(engine),
+            'clients': len(self.clients),
+        }
+        if self.device is not None:
+            status['device'] = self.device_status
+        if self.ads_client is not None:
+            latest = self.ads_client.buffer.latest()
+            status['ads'] = {
+                'connected': self.ads_client.connected,
+                'frames': self.ads_client.frames,
+                'voltage': None if latest is None else round(float(latest[1]), 4),
+            }
+        return status
+
+    async def handle(self, request, reader, writer):
+        if request.method == 'OPTIONS':
+            writer.write(http_response(204))
+            return True
+        if request.path == '/ws':
+            await self._websocket(request, reader, writer)
+            return False
+        command = request.path.lstrip('/')
+        status, result = await self.run_command(command, request.params, request.received)
+        writer.write(json_response(status, result))
+        return True
+
+    async def run_command(self, command, params, received):
+        """执行一条命令，返回 (HTTP 状态码, 结果)"""
+        handler = self.commands.get(command)
+        if handler is None:
+            return 404, {'ok': False, 'error': f"Unknown command: {command}"}
+        try:
+            return 200, {'ok': True, **await handler(params, received)}
+        except RequestError as e:
+            return e.status, {'ok': False, 'error': str(e)}
+        except Exception as e:
+            print(f"Control command {command} failed: {e}")
+            return 500, {'ok': False, 'error': str(e)}
+
+    async def _websocket(self, request, reader, writer):
+        key = request.headers.get('sec-websocket-key')
+        if not key or 'websocket' not in request.headers.get('upgrade', '').lower():
+            writer.write(json_response(400, {'ok': False, 'error': "WebSocket upgrade required"}, keep_alive=False))
+            return
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n"
+        ).encode('latin-1'))
+        outbox = asyncio.Queue(maxsize=self.client_queue)
+        outbox.put_nowait(ws_frame(json.dumps({'type': 'status', **self.snapshot()})))
+        self.clients.add(outbox)
+        sender = asyncio.ensure_future(self._send_frames(writer, outbox))
+        try:
+            while True:
+                opcode, payload = await read_ws_frame(reader)
+                received = monotonic()
+                if opcode == 0x8:
+                    writer.write(ws_frame(payload[:2], 0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(ws_frame(payload, 0xA))
+                elif opcode == 0x1:
+                    # 命令在独立任务中执行，等待刺激起始时不影响接收其他命令
+                    asyncio.ensure_future(self._ws_command(outbox, payload, received))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.clients.discard(outbox)
+            sender.cancel()
+
+    async def _ws_command(self, outbox, payload, received):
+        try:
+            params = json.loads(payload)
+            command = params.pop('command')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            status, result, command = 400, {'ok': False, 'error': "expected {\"command\": ...}"}, None
+        else:
+            status, result = await self.run_command(command, params, received)
+        if outbox.full():
+            outbox.get_nowait()
+        outbox.put_nowait(ws_frame(json.dumps({'type': 'reply', 'command': command, 'status': status, **result})))
+
+    @staticmethod
+    async def _send_frames(writer, outbox):
+        try:
+            while True:
+                writer.write(await outbox.get())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    # ---- 命令 ----
+
+    async def in_worker(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def status(self, params, received):
+        return self.snapshot()
+
+    async def latency_report(self, params, received):
+        recent = [self._latency_ms(sample) for sample in list(self.latency.samples)[-20:]]
+        return {'summary': self.latency.summary(), 'recent': recent}
+
+    async def _with_device(self, params, engine_call, device_call):
+        """同时执行引擎操作与设备请求；设备失败不影响录音，只在结果中报告"""
+        use_device = self.device is not None and flag(params.get('device', '1'))
+        jobs = [self.in_worker(engine_call)]
+        if use_device:
+            jobs.append(device_call())
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        if isinstance(results[0], Exception):
+            raise results[0]
+        result = {'recording': self.engine.recording}
+        if use_device:
+            device = results[1]
+            result['device'] = f"Error: {device}" if isinstance(device, Exception) else device
+        return result
+
+    async def record_start(self, params, received):
+        if self.engine.recording or self.engine.duplex:
+            raise RequestError(409, "Already recording")
+        result = await self._with_device(params, self.engine.start_recording, self.device_start_request)
+        if not result['recording']:
+            raise RequestError(500, "Failed to start recording")
+        return result
+
+    async def record_stop(self, params, received):
+        return await self._with_device(params, self.engine.stop_recording, self.device_stop_request)
+
+    async def stimulus(self, params, received):
+        try:
+            frequency = float(params.get('frequency', 1200.0))
+            duration = float(params.get('duration', 1.0))
+            amplitude = float(params.get('amplitude', 0.5))
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, f"Invalid stimulus parameter: {e}")
+        waveform = params.get('waveform', 'sine')
+        if waveform not in WAVEFORMS:
+            raise RequestError(400, f"Unknown waveform: {waveform}")
+        if frequency <= 0 or duration <= 0 or not 0 <= amplitude <= 1:
+            raise RequestError(400, "frequency and duration must be positive, amplitude within 0-1")
+
+        # start_generation 只提交命令，直接在事件循环中调用以免多一次线程切换
+        if not self.engine.start_generation(frequency, duration, waveform, amplitude):
+            raise RequestError(409, "A sound is already playing")
+        session = self.engine.generator_session
+        future = self.loop.create_future()
+        self._prune_pending(received)
+        self._pending[session] = (received, future)
+        result = {'session': session, 'frequency': frequency, 'duration': duration,
+                  'waveform': waveform, 'amplitude': amplitude}
+        if not flag(params.get('wait', '1')):
+            return result
+        try:
+            sample = await asyncio.wait_for(asyncio.shield(future), self.onset_timeout)
+        except asyncio.TimeoutError:
+            return {**result, 'latency': None, 'error': "No onset reported"}
+        return {**result, 'latency': self._latency_ms(sample)}
+
+    def _prune_pending(self, now):
+        """丢弃早已超时（播放失败或被立即停止）的等待项"""
+        for session, (received, future) in list(self._pending.items()):
+            if now - received > self.onset_timeout * 5:
+                future.cancel()
+                del self._pending[session]
+
+    async def stimulus_stop(self, params, received):
+        if self.engine.generating:
+            self.engine.stop_generation()
+        return {'generating': self.engine.generating}
+
+    def _require_device(self):
+        if self.device is None:
+            raise RequestError(404, "No device configured")
+
+    async def device_start_request(self):
+        return await self.device.start()
+
+    async def device_stop_request(self):
+        return await self.device.stop()
+
+    async def device_start(self, params, received):
+        self._require_device()
+        return {'device': await self.device.start()}
+
+    async def device_stop(self, params, received):
+        self._require_device()
+        return {'device': await self.device.stop()}
+
+    async def device_refresh(self, params, received):
+        self._require_device()
+        try:
+            self.device_status = await self.device.status()
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            raise RequestError(502, f"Device unreachable: {e or type(e).__name__}")
+        return {'device': self.device_status}
+
+
+class MockDevice(HttpServer):
+    """固件 HTTP 接口的本地替身：/start、/stop、/api 的响应与 mfs_ads1110_web 相同
+
+    requests 记录收到的 (路径, time.monotonic())，便于检查协调顺序。
+    """
+
+    name = "mock-device"
+
+    def __init__(self, host='127.0.0.1', port=0, base_voltage=50.0):
+        super().__init__(host, port)
+        self.base_voltage = base_voltage
+        self.recording = False
+        self.requests = []
+        self._started = None
+        self._epoch = monotonic()
+
+    def voltage(self):
+        elapsed = monotonic() - self._epoch
+        # 与 ads_stream.serve 相同的缓慢漂移加噪声
+        return self.base_voltage + 5 * math.sin(2 * math.pi * elapsed / 60) + random.gauss(0, 0.3)
+
+    async def handle(self, request, reader, writer):
+        self.requests.append((request.path, request.received))
+        if request.path == '/start':
+            if not self.recording:
+                self.recording = True
+                self._started = monotonic()
+            writer.write(http_response(200, "Recording started", 'text/plain'))
+        elif request.path == '/stop':
+            self.recording = False
+            writer.write(http_response(200, "Recording stopped", 'text/plain'))
+        elif request.path == '/api':
+            duration = int(monotonic() - self._started) if self.recording else 0
+            writer.write(json_response(200, {
+                'voltage': round(self.voltage(), 4),
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'duration': duration,
+                'recording': self.recording,
+                'sdcard': True,
+            }))
+        else:
+            writer.write(http_response(404, "Not found", 'text/plain'))
+        return True
+
+
+def call(base_url, command, timeout=30.0, **params):
+    """同步调用控制服务器的一条命令（供脚本使用），返回解析后的 JSON"""
+    from urllib.error import HTTPError
+    from urllib.request import Request as UrlRequest, urlopen
+
+    request = UrlRequest(f"{base_url.rstrip('/')}/{command}", data=json.dumps(params).encode('utf-8'),
+                         headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except HTTPError as e:
+        return json.loads(e.read() or b'{}')
+
+
+def run_sequence(base_url, wait, frequency, duration, waveform='sine', amplitude=0.5, repeats=1, after=1.0):
+    """开始录音（及设备记录），等待 wait 秒后播放刺激 repeats 次，最后停止；返回每次的延迟"""
+    latencies = []
+    started = call(base_url, 'record/start')
+    print(f"record/start: {started}")
+    if not started.get('ok'):
+        return latencies
+    try:
+        time.sleep(wait)
+        for _ in range(repeats):
+            result = call(base_url, 'stimulus', frequency=frequency, duration=duration,
+                          waveform=waveform, amplitude=amplitude)
+            print(f"stimulus: {result}")
+            if result.get('latency'):
+                latencies.append(result['latency'])
+            time.sleep(duration + after)
+    finally:
+        print(f"record/stop: {call(base_url, 'record/stop')}")
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local control API for coordinated stimulation and recording")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="run a headless engine with the control server")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--device', metavar='URL', default=None,
+                       help="M5Core2 HTTP address, e.g. http://192.168.1.50")
+    serve.add_argument('--ads', metavar='URL', default=None,
+                       help="also record the ADS1110 voltage stream, e.g. ws://192.168.1.50:81")
+    serve.add_argument('--rate', type=float, default=10.0, help="WebSocket status updates per second")
+    serve.add_argument('--recordings-dir', default="recordings")
+    serve.add_argument('--logs-dir', default="logs")
+    serve.add_argument('--simulate', action='store_true', help="use the simulated sound card")
+
+    mock = commands.add_parser('mock-device', help="run a local stand-in for the device /start, /stop and /api")
+    mock.add_argument('--host', default='127.0.0.1')
+    mock.add_argument('--port', type=int, default=8080)
+
+    sequence = commands.add_parser('sequence', help="start recording, wait, play a stimulus, stop")
+    sequence.add_argument('url', help="control server, e.g. http://localhost:8765")
+    sequence.add_argument('--wait', type=float, default=5.0, help="seconds between start and stimulus")
+    sequence.add_argument('--frequency', type=float, default=1200.0)
+    sequence.add_argument('--duration', type=float, default=10.0)
+    sequence.add_argument('--waveform', default='sine', choices=WAVEFORMS)
+    sequence.add_argument('--volume', type=float, default=0.5)
+    sequence.add_argument('--repeats', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == 'sequence':
+        latencies = run_sequence(args.url, args.wait, args.frequency, args.duration,
+                                 args.waveform, args.volume, args.repeats)
+        for latency in latencies:
+            print(f"trigger -> onset {latency['onset_ms']:.2f} ms "
+                  f"(callback {latency['dispatch_ms']:.2f} ms + output {latency['output_ms']:.2f} ms)")
+        return 0
+
+    try:
+        if args.command == 'mock-device':
+            device = MockDevice(args.host, args.port)
+            device.start()
+            print(f"Serving simulated device endpoints on {device.url}")
+            try:
+                while True:
+                    time.sleep(1)
+            finally:
+                device.stop()
+
+        if args.simulate:
+            import sim_sounddevice
+            sim_sounddevice.install()
+        from audio_engine import AudioEngine
+        from ads_stream import AdsStreamClient
+        engine = AudioEngine(recordings_dir=args.recordings_dir, logs_dir=args.logs_dir)
+        engine.add_listener(lambda topic, message: print(f"[{topic}] {message}"))
+        ads_client = AdsStreamClient(args.ads, logs_dir=engine.logs_dir) if args.ads else None
+        server = ControlServer(engine, args.host, args.port, device=args.device,
+                               ads_client=ads_client, rate=args.rate)
+        try:
+            if ads_client is not None:
+                ads_client.start()
+            server.start()
+            while True:
+                time.sleep(1)
+        finally:
+            server.stop()
+            if ads_client is not None:
+                ads_client.stop()
+            engine.shutdown()
+    except KeyboardInterrupt:
+        print("\nProgram terminated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""把声音日志中的刺激事件与 ADS 电压数据对齐，批量截取刺激前后的片段
+
+所有查找都在单调的时间轴上用 np.searchsorted 完成，一次调用处理全部事件。
+固件的原始 RTC 时间戳局部逆序，不能直接使用；请传入 AdsSession.time 或
+ads_store.time_axis() 的结果（会话开始 + Duration）。这两者由 time_axis 保证单调，
+传 check=False 可以跳过 O(n) 的单调性检查（epochs_from_store 即如此）：
+    events = load_sound_events(glob.glob('logs/sound_log_*.csv'))
+    store = AdsStore('ads_store')
+    epochs = epochs_from_store(store, events, pre=300, post=300)
+    epochs.data        # (事件数, 样本数)，缺失处为 NaN
+    epochs.lags        # 相对刺激的秒数
+"""
+import csv
+
+import numpy as np
+
+from ads_store import parse_timestamps
+
+
+class SoundEvents:
+    """按开始时间排序的刺激事件（列式保存）"""
+
+    def __init__(self, times, frequencies, durations, waveforms, types):
+        order = np.argsort(times, kind='stable')
+        self.times = np.asarray(times, dtype=np.int64)[order]
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)[order]
+        self.durations = np.asarray(durations, dtype=np.float64)[order]
+        self.waveforms = [waveforms[i] for i in order]
+        self.types = [types[i] for i in order]
+
+    def __len__(self):
+        return len(self.times)
+
+    def select(self, mask):
+        """按布尔掩码或索引取出一部分事件"""
+        index = np.flatnonzero(mask) if np.asarray(mask).dtype == bool else np.asarray(mask)
+        return SoundEvents(self.times[index], self.frequencies[index], self.durations[index],
+                           [self.waveforms[i] for i in index], [self.types[i] for i in index])
+
+
+def load_sound_events(paths, types=('Generation', 'Protocol'), status='Success'):
+    """读取 log_sound 写下的 sound_log_*.csv，返回 SoundEvents"""
+    starts, frequencies, durations, waveforms, kinds = [], [], [], [], []
+    for path in paths:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                if types and row.get('Type') not in types:
+                    continue
+                if status and row.get('Status') != status:
+                    continue
+                try:
+                    frequency = float(row['Frequency (Hz)'])
+                    duration = float(row['Duration (s)'])
+                except (KeyError, ValueError):
+                    continue
+                starts.append(row['Start Time'])
+                frequencies.append(frequency)
+                durations.append(duration)
+                waveforms.append(row.get('Waveform') or 'sine')
+                kinds.append(row.get('Type'))
+    times = parse_timestamps(starts) if starts else np.zeros(0, dtype=np.int64)
+    return SoundEvents(times, frequencies, durations, waveforms, kinds)
+
+
+def check_monotonic(timestamp):
+    """二分查找要求时间轴单调不减，否则抛出 ValueError"""
+    if len(timestamp) == 0:
+        raise ValueError("empty time axis")
+    if len(timestamp) > 1 and np.any(timestamp[1:] < timestamp[:-1]):
+        raise ValueError("time axis is not monotonic; use ads_store.time_axis() instead of raw RTC timestamps")
+
+
+def nearest_indices(timestamp, times, check=True):
+    """每个时刻在单调不减的 timestamp 中最接近的样本下标（向量化二分查找）
+
+    check=False 时不再扫描整个时间轴，调用方保证其单调（如 time_axis 的结果）。
+    """
+    timestamp = np.asarray(timestamp)
+    times = np.asarray(times, dtype=timestamp.dtype)
+    if check:
+        check_monotonic(timestamp)
+    elif len(timestamp) == 0:
+        raise ValueError("empty time axis")
+    if len(timestamp) < 2:
+        return np.zeros(times.shape, dtype=np.intp)
+    right = np.clip(np.searchsorted(timestamp, times), 1, len(timestamp) - 1)
+    left = right - 1
+    closer_left = np.abs(times - timestamp[left]) <= np.abs(timestamp[right] - times)
+    return np.where(closer_left, left, right)
+
+
+class Epochs:
+    """截取好的片段
+
+    data 的每一行对应一个事件，列对应 lags（秒）；
+    valid 标记片段是否完全落在数据范围内。
+    """
+
+    def __init__(self, data, lags, events, valid):
+        self.data = data
+        self.lags = lags
+        self.events = events
+        self.valid = valid
+
+    def __len__(self):
+        return len(self.data)
+
+    def baseline(self, start=None, end=0.0):
+        """减去每个片段在 [start, end) 秒内的平均值，返回新的数组"""
+        mask = (self.lags < end) if start is None else (self.lags >= start) & (self.lags < end)
+        return self.data - np.nanmean(self.data[:, mask], axis=1, keepdims=True)
+
+    def mean(self, only_valid=True):
+        """所有（完整）片段的平均响应"""
+        data = self.data[self.valid] if only_valid else self.data
+        return np.nanmean(data, axis=0)
+
+
+def extract_epochs(timestamp, voltage, times, pre, post, rate=None, method='interp', max_gap=None, check=True):
+    """一次截取所有事件前 pre 秒到后 post 秒的片段
+
+    timestamp 为单调不减的 int64 毫秒时间轴（见 nearest_indices），times 为事件时刻（毫秒）。
+    rate 为输出的采样率（Hz），默认取数据的中位采样间隔。
+    method='interp' 在固定时间网格上线性插值，不受采样抖动影响；
+    method='nearest' 直接取最接近的原始样本。
+    网格点离最近样本超过 max_gap 秒（默认 3 个采样间隔）或超出数据范围时为 NaN。
+    check=False 跳过单调性检查（见 nearest_indices）。
+    """
+    timestamp = np.asarray(timestamp)
+    voltage = np.asarray(voltage)
+    times = np.asarray(times, dtype=np.int64)
+    if check:
+        check_monotonic(timestamp)
+    if len(timestamp) < 2:
+        raise ValueError("at least two samples are needed to extract epochs")
+    step_ms = float(np.median(np.diff(timestamp))) if rate is None else 1000.0 / rate
+    if max_gap is None:
+        max_gap = 3 * step_ms / 1000
+    before = int(round(pre * 1000 / step_ms))
+    after = int(round(post * 1000 / step_ms))
+    offsets = np.arange(-before, after + 1) * step_ms
+    grid = times[:, None] + offsets[None, :]
+
+    if method == 'nearest':
+        index = nearest_indices(timestamp, grid.ravel(), check=False)
+        data = voltage[index].astype(np.float64).reshape(grid.shape)
+        gap = np.abs(timestamp[index] - grid.ravel()).reshape(grid.shape)
+    elif method == 'interp':
+        data = np.interp(grid.ravel(), timestamp, voltage).reshape(grid.shape)
+        # 到两侧最近样本的距离，用于识别数据中的断档
+        right = np.clip(np.searchsorted(timestamp, grid.ravel()), 1, len(timestamp) - 1)
+        span = (timestamp[right] - timestamp[right - 1]).reshape(grid.shape)
+        gap = span / 2
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+    outside = (grid < timestamp[0]) | (grid > timestamp[-1]) | (gap > max_gap * 1000)
+    data[outside] = np.nan
+    valid = ~outside.any(axis=1)
+    return data, offsets / 1000, valid
+
+
+def epochs_from_store(store, events, pre=300.0, post=300.0, rate=None, method='interp'):
+    """在 AdsStore 中为每个事件截取片段；每个会话只做一次向量化截取"""
+    rows = None
+    valid = np.zeros(len(events), dtype=bool)
+    lags = None
+    found = np.zeros(len(events), dtype=bool)
+    for session in store:
+        inside = (events.times >= session.start) & (events.times <= session.end) & ~found
+        if not inside.any():
+            continue
+        found |= inside
+        timestamp, voltage = session.time, session.voltage
+        if rate is None:
+            # 所有会话使用同一个网格，片段长度才一致
+            rate = 1000.0 / float(np.median(np.diff(timestamp[:10000])))
+        # 会话的 time 列由 ads_store.time_axis 生成，已保证单调
+        data, lags, ok = extract_epochs(timestamp, voltage, events.times[inside], pre, post, rate, method,
+                                        check=False)
+        if rows is None:
+            rows = np.full((len(events), data.shape[1]), np.nan)
+        rows[inside] = data
+        valid[inside] = ok
+    if rows is None:
+        return Epochs(np.zeros((len(events), 0)), np.zeros(0), events, valid)
+    return Epochs(rows, lags, events, valid)
@@ -0,0 +1,259 @@
+import atexit
+import csv
+import io
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# 索引文件每行：开始时间、结束时间（epoch 毫秒）与该行在 CSV 中的字节偏移
+_INDEX_RECORD = struct.Struct('<qqq')
+
+
+def parse_timestamp(value):
+    """把日志时间（'2025-05-13T22:04:08.265Z'）、datetime 或 epoch 秒转换为 epoch 秒"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    text = value.strip().rstrip('Z')
+    # 日志中的时间是本地时间，末尾的 Z 只是格式的一部分
+    return datetime.strptime(text, "%Y-%m-%dT%H:%M:%S.%f").timestamp()
+
+
+class EventLog:
+    """批量写入、按日期/大小轮转的 CSV 日志
+
+    append() 只把记录放进队列，由后台线程每隔 flush_interval 秒（或积累到
+    batch_size 条、或调用 flush()/close() 时）一次性写入文件。内存中只保留
+    最近 tail_size 条记录。每个 CSV 旁边维护一个 .idx 时间索引，
+    query() 据此只读取时间范围内的行。
+    """
+
+    def __init__(self, directory, prefix, header, time_columns=(0, 1), flush_interval=1.0,
+                 batch_size=256, max_bytes=None, tail_size=1000):
+        self.directory = directory
+        self.prefix = prefix
+        self.header = list(header)
+        self.time_columns = time_columns
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.tail = deque(maxlen=tail_size)
+        self.writable = os.access(directory, os.W_OK)
+        self.path = self._path_for(datetime.now())
+
+        # 关闭之后 append() 直接同步写入；锁保证 close() 前入队的记录都会被写出
+        self._lock = threading.Lock()
+        self._closed = False
+        # 文件大小 -> 上次重建索引时的大小；末行无法解析时不必每次查询都重建
+        self._scanned = {}
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, row):
+        """记录一行（不阻塞调用者）；close() 之后改为同步写入，不会丢失"""
+        row = list(row)
+        self.tail.append(row)
+        with self._lock:
+            if not self.writable:
+                return
+            if not self._closed:
+                self._queue.put(row)
+                return
+            self._write_batch([row])
+
+    def flush(self, timeout=None):
+        """等待队列中已有的记录全部写入文件"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """写入剩余记录并结束后台线程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        atexit.unregister(self.close)
+
+    def files(self):
+        """按时间顺序列出该日志的所有 CSV 文件"""
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(self.prefix + '_') and name.endswith('.csv')]
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def query(self, start=None, end=None):
+        """返回开始时间落在 [start, end] 内的所有记录（按文件顺序）
+
+        start / end 可以是日志时间字符串、datetime 或 epoch 秒。
+        """
+        self.flush()
+        low = parse_timestamp(start)
+        high = parse_timestamp(end)
+        low_ms = -2 ** 63 if low is None else int(low * 1000)
+        high_ms = 2 ** 63 - 1 if high is None else int(high * 1000)
+        rows = []
+        for path in self.files():
+            # 某天的文件只含当天结束的记录，开始时间不会晚于当天结束
+            day = self._file_day(path)
+            if day is not None:
+                day_end = (datetime.strptime(day, "%Y%m%d").timestamp() + 86400) * 1000
+                if day_end + 60000 < low_ms:
+                    continue
+            index = self._load_index(path)
+            offsets = [offset for start_ms, _, offset in index if low_ms <= start_ms <= high_ms]
+            if not offsets:
+                continue
+            with open(path, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    line = f.readline().decode('utf-8')
+                    rows.extend(csv.reader([line]))
+        return rows
+
+    def _path_for(self, now, part=0):
+        name = f"{self.prefix}_{now.strftime('%Y%m%d')}"
+        if part:
+            name += f"_{part:03d}"
+        return os.path.join(self.directory, name + '.csv')
+
+    def _file_day(self, path):
+        stem = os.path.basename(path)[len(self.prefix) + 1:-4]
+        day = stem.split('_')[0]
+        return day if len(day) == 8 and day.isdigit() else None
+
+    def _current_path(self):
+        """根据日期与大小限制选择当前要写入的文件"""
+        now = datetime.now()
+        path = self._path_for(now)
+        if self.max_bytes:
+            part = 0
+            while os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+                part += 1
+                path = self._path_for(now, part)
+        return path
+
+    def _load_index(self, path):
+        """读取索引；缺失或不完整时扫描一遍 CSV 重建"""
+        index_path = path + '.idx'
+        records = []
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % _INDEX_RECORD.size
+            records = list(_INDEX_RECORD.iter_unpack(data[:usable]))
+        covered = records[-1][2] if records else 0
+        size = os.path.getsize(path)
+        if size > covered and self._scanned.get(path) != size \
+                and (not records or self._has_rows_after(path, covered)):
+            records = self._rebuild_index(path)
+            self._scanned[path] = size
+        return records
+
+    def _has_rows_after(self, path, offset):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            f.readline()
+            return bool(f.readline())
+
+    def _rebuild_index(self, path):
+        """扫描 CSV 生成完整的索引"""
+        records = []
+        with open(path, 'rb') as f:
+            f.readline()  # 表头
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                record = self._index_record(next(csv.reader([line.decode('utf-8')]), []), offset)
+                if record is not None:
+                    records.append(record)
+        try:
+            with open(path + '.idx', 'wb') as f:
+                for record in records:
+                    f.write(_INDEX_RECORD.pack(*record))
+        except OSError:
+            pass
+        return records
+
+    def _index_record(self, row, offset):
+        try:
+            start = parse_timestamp(row[self.time_columns[0]])
+            end = parse_timestamp(row[self.time_columns[1]])
+        except (IndexError, ValueError):
+            return None
+        return int(start * 1000), int(end * 1000), offset
+
+    def _write_batch(self, rows):
+        """一次打开文件写入一批记录，并追加对应的索引"""
+        path = self._current_path()
+        self.path = path
+        try:
+            if not os.path.exists(path):
+                lines = [self._encode(self.header)]
+            else:
+                lines = []
+                if not os.path.exists(path + '.idx'):
+                    # 旧版本写下的日志还没有索引
+                    self._rebuild_index(path)
+            with open(path, 'ab') as f:
+                offset = f.tell() + sum(len(line) for line in lines)
+                index = []
+                for row in rows:
+                    line = self._encode(row)
+                    record = self._index_record(row, offset)
+                    if record is not None:
+                        index.append(_INDEX_RECORD.pack(*record))
+                    lines.append(line)
+                    offset += len(line)
+                f.write(b''.join(lines))
+            with open(path + '.idx', 'ab') as f:
+                f.write(b''.join(index))
+        except Exception as e:
+            print(f"写入日志文件失败: {e}")
+            self.writable = False
+
+    def _encode(self, row):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        return buffer.getvalue().encode('utf-8')
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if isinstance(item, list):
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) < self.batch_size:
+                    continue
+            # 到期、批量已满、flush() 或 close() 时写入
+            if pending and self.writable:
+                self._write_batch(pending)
+            pending = []
+            deadline = None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                break
@@ -0,0 +1,182 @@
+"""与录音一起写出的低速率特征轨
+
+每 interval 秒（默认 0.5 s）计算一行特征：RMS、峰值、dBFS 以及若干频带的能量，
+写入录音文件旁边的 <录音名>.features.csv。查找刺激、噪声或做整体质量检查时
+只需读取这个几百 KB 的文件，而不用重新读取整段 WAV。
+多声道录音每个声道各有一组列（列名后缀 ch1、ch2 ...），所有声道一次计算。
+
+    Time (s), RMS, Peak, dBFS, 150-250 Hz (dB), 1100-1300 Hz (dB)
+
+为已有的录音补算：
+    python features.py recordings/*.wav --bands 150-250 1100-1300
+读取：
+    track = load_features('recordings/ambient_sound_20250513_225631.features.csv')
+    loud = track['Time (s)'][track['dBFS'] > -30]
+"""
+import argparse
+import csv
+import os
+import sys
+import wave
+
+import numpy as np
+
+# 默认频带覆盖常用的 200 Hz 与 1200 Hz 刺激
+DEFAULT_BANDS = ((150.0, 250.0), (1100.0, 1300.0))
+FEATURES_SUFFIX = '.features.csv'
+
+
+def features_path(recording_path):
+    """录音文件对应的特征文件路径"""
+    return os.path.splitext(recording_path)[0] + FEATURES_SUFFIX
+
+
+def parse_band(text):
+    """'150-250' -> (150.0, 250.0)"""
+    low, high = text.split('-')
+    return float(low), float(high)
+
+
+def band_label(band):
+    return f"{band[0]:g}-{band[1]:g} Hz (dB)"
+
+
+class FeatureTrack:
+    """逐块接收 (帧, 声道) 样本，每满一个窗口写出一行特征"""
+
+    def __init__(self, path, sample_rate, channels=1, interval=0.5, bands=DEFAULT_BANDS):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bands = [tuple(band) for band in bands]
+        self.window_frames = max(1, int(round(interval * sample_rate)))
+        self.rows = 0
+        self._buffer = np.zeros((self.window_frames, channels), dtype=np.float32)
+        self._fill = 0
+        self._start = 0
+        self._masks = {}
+
+        names = ['RMS', 'Peak', 'dBFS'] + [band_label(band) for band in self.bands]
+        if channels > 1:
+            names = [f"{name} ch{channel + 1}" for channel in range(channels) for name in names]
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(['Time (s)'] + names)
+
+    def feed(self, block):
+        block = block.reshape(len(block), self.channels)
+        while len(block):
+            take = min(len(block), self.window_frames - self._fill)
+            self._buffer[self._fill:self._fill + take] = block[:take]
+            self._fill += take
+            block = block[take:]
+            if self._fill == self.window_frames:
+                self._emit(self._buffer)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        """写出最后一个不完整的窗口并关闭文件"""
+        if self._file is None:
+            return
+        try:
+            if self._fill:
+                self._emit(self._buffer[:self._fill])
+        finally:
+            self._file.close()
+            self._file = None
+
+    def _band_masks(self, n):
+        """长度为 n 的窗口对应的 (频带数, 频点数) 选择矩阵"""
+        if n not in self._masks:
+            freqs = np.fft.rfftfreq(n, 1.0 / self.sample_rate)
+            self._masks[n] = np.array([(freqs >= low) & (freqs <= high) for low, high in self.bands],
+                                      dtype=np.float64).reshape(len(self.bands), -1)
+        return self._masks[n]
+
+    def _emit(self, window):
+        n = len(window)
+        rms = np.sqrt(np.mean(np.square(window, dtype=np.float64), axis=0))
+        peak = np.abs(window).max(axis=0)
+        dbfs = 20 * np.log10(np.maximum(rms, 1e-10))
+        columns = [rms, peak, dbfs]
+        if self.bands:
+            # 所有声道一次 FFT；按 Parseval 换算成频带内的均方值
+            taper = np.hanning(n) if n > 1 else np.ones(1)
+            spectrum = np.fft.rfft(window * taper[:, None].astype(np.float32), axis=0)
+            power = np.square(np.abs(spectrum)) * (2.0 / (n * max(np.sum(taper ** 2), 1e-12)))
+            energy = self._band_masks(n) @ power
+            columns.extend(10 * np.log10(np.maximum(energy, 1e-20)))
+        values = np.stack(columns, axis=1)
+        row = [f"{self._start / self.sample_rate:.3f}"]
+        row.extend(f"{value:.6g}" for value in values.reshape(-1))
+        self._writer.writerow(row)
+        self.rows += 1
+        self._start += n
+        self._fill = 0
+
+
+def load_features(path):
+    """读取特征文件，返回 {列名: numpy 数组}"""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        names = next(reader)
+        rows = [row for row in reader if len(row) == len(names)]
+    data = np.array(rows, dtype=np.float64).reshape(len(rows), len(names))
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+
+def compute_features(recording_path, interval=0.5, bands=DEFAULT_BANDS, chunk_frames=1 << 18):
+    """为已有的 WAV 或 .wavz 录音计算特征文件，返回输出路径"""
+    target = features_path(recording_path)
+    if recording_path.endswith('.wavz'):
+        from audio_archive import ArchiveReader
+        with ArchiveReader(recording_path) as reader:
+            track = FeatureTrack(target, reader.sample_rate, reader.channels, interval, bands)
+            try:
+                for block in reader.blocks(np.float32):
+                    track.feed(block)
+            finally:
+                track.close()
+        return target
+
+    with wave.open(recording_path, 'rb') as source:
+        if source.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV is supported: {recording_path}")
+        channels = source.getnchannels()
+        track = FeatureTrack(target, source.getframerate(), channels, interval, bands)
+        try:
+            while True:
+                raw = source.readframes(chunk_frames)
+                if not raw:
+                    break
+                samples = np.frombuffer(raw, dtype='<i2').reshape(-1, channels)
+                track.feed(samples.astype(np.float32) / 32767)
+        finally:
+            track.close()
+    return target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute feature tracks for existing recordings")
+    parser.add_argument('recordings', nargs='+', help="WAV or .wavz files")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds per feature row")
+    parser.add_argument('--bands', type=parse_band, nargs='*', default=list(DEFAULT_BANDS),
+                        help="frequency bands as LOW-HIGH in Hz")
+    parser.add_argument('--force', action='store_true', help="recompute existing feature files")
+    args = parser.parse_args(argv)
+
+    for path in args.recordings:
+        if not args.force and os.path.exists(features_path(path)):
+            continue
+        try:
+            print(f"{path} -> {compute_features(path, args.interval, args.bands)}")
+        except Exception as e:
+            print(f"计算特征失败 {path}: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
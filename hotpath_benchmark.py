@@ -0,0 +1,415 @@
+"""音频与日志热路径的基准测试
+
+不需要声卡：回调由模拟后端（sim_sounddevice，realtime=False）的流逐块驱动，
+一个接一个地尽快执行。测量以下路径：
+  - generate_waveform      整段合成
+  - audio_callback         录音回调（输入流）
+  - preview_callback       循环预览回调（输出流）
+  - generator_callback     播放回调（输出流）
+  - save_recording         整段写 WAV
+  - log_sound / log_recording   CSV 日志追加，以及后台线程落盘（flush）
+
+每项给出吞吐量（音频为样本/秒，日志为行/秒）、每次调用耗时的分位数，
+以及 tracemalloc 测得的内存：峰值、每次调用的临时分配与保留的字节数、
+有分配的调用次数和结束后仍保留的内存块数。tracemalloc 会拖慢分配，
+所以计时与内存分两轮测量。
+
+    python hotpath_benchmark.py --json hotpath.json
+    python hotpath_benchmark.py --duration 60 --blocksizes 128 512 2048
+与之前的结果比较（吞吐量下降超过 --tolerance 时以非零状态退出）：
+    python hotpath_benchmark.py --json new.json --compare hotpath.json
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+import sim_sounddevice
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class CallProbe:
+    """包装被测函数，记录每次调用的耗时（以及可选的内存变化）
+
+    结果写入预分配的数组；调用 max_calls 次后抛出 CallbackStop 结束模拟流。
+    """
+
+    def __init__(self, func, max_calls, track_memory=False):
+        self.func = func
+        self.track_memory = track_memory
+        self.times = np.zeros(max_calls)
+        self.transient = np.zeros(max_calls)
+        self.retained = np.zeros(max_calls)
+        self.peak = 0
+        self.calls = 0
+
+    def __call__(self, *args):
+        i = self.calls
+        if i >= len(self.times):
+            raise sim_sounddevice.CallbackStop
+        if self.track_memory:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            return self.func(*args)
+        finally:
+            self.times[i] = time.perf_counter() - start
+            if self.track_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                self.transient[i] = peak - before
+                self.retained[i] = current - before
+                self.peak = max(self.peak, peak)
+            self.calls = i + 1
+
+
+def probe_overhead(calls=1000):
+    """CallProbe 本身在 tracemalloc 下每次调用的 (临时, 保留) 字节数，从测量结果中扣除"""
+    probe = CallProbe(lambda index: None, calls, track_memory=True)
+    for index in range(calls):
+        probe(index)
+    return float(np.median(probe.transient)), float(np.median(probe.retained))
+
+
+def run_stream(kind, probe, blocksize, sample_rate, channels, **kwargs):
+    """用模拟流按 blocksize 逐块调用 probe，直到它（或被测回调）结束流"""
+    stream_class = sim_sounddevice.InputStream if kind == 'input' else sim_sounddevice.OutputStream
+    stream = stream_class(samplerate=sample_rate, blocksize=blocksize, channels=channels,
+                          callback=probe, realtime=False, **kwargs)
+    stream.start()
+    # 回调抛出 CallbackStop 后模拟线程退出，流变为非活动
+    while stream.active:
+        time.sleep(0.001)
+    stream.close()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else float('nan')
+
+
+def summarize_times(probe, units_per_call):
+    """吞吐量与每次调用耗时（微秒）"""
+    times = probe.times[:probe.calls]
+    total = float(times.sum())
+    micros = times * 1e6
+    units = units_per_call * probe.calls
+    return {
+        'calls': probe.calls,
+        'units': units,
+        'seconds': total,
+        'throughput': units / total if total > 0 else float('nan'),
+        'latency_us': {
+            'mean': float(micros.mean()) if len(micros) else float('nan'),
+            'p50': percentile(micros, 50),
+            'p99': percentile(micros, 99),
+            'max': float(micros.max()) if len(micros) else float('nan'),
+        },
+    }
+
+
+def summarize_memory(probe, baseline, before, after, overhead=(0.0, 0.0)):
+    """tracemalloc 结果：峰值、每次调用的临时 / 保留字节数、有分配的调用数、保留的内存块"""
+    transient = np.maximum(probe.transient[:probe.calls] - overhead[0], 0)
+    retained = probe.retained[:probe.calls] - overhead[1]
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return {
+        'peak_kib': max(probe.peak - baseline, 0) / 1024,
+        'transient_bytes_per_call': {
+            'mean': float(transient.mean()) if len(transient) else 0.0,
+            'max': float(transient.max()) if len(transient) else 0.0,
+        },
+        'retained_bytes_per_call': float(retained.mean()) if len(retained) else 0.0,
+        'allocating_calls': int(np.count_nonzero(transient > 0)),
+        'retained_blocks': int(blocks),
+    }
+
+
+class HotPathBenchmark:
+    """在一个无界面的 AudioEngine 上运行各项测量"""
+
+    def __init__(self, args):
+        # 引擎中的 import sounddevice 同样得到模拟后端
+        sim_sounddevice.install()
+        from audio_engine import AudioEngine
+
+        self.args = args
+        self.sample_rate = args.sample_rate
+        self.work_dir = tempfile.mkdtemp(prefix="hotpath_bench_")
+        self.engine = AudioEngine(
+            sample_rate=self.sample_rate,
+            recordings_dir=os.path.join(self.work_dir, "recordings"),
+            logs_dir=os.path.join(self.work_dir, "logs")
+        )
+        # 生成回调用 sounddevice.CallbackStop 结束播放
+        self.engine._sd = sim_sounddevice
+        self.results = []
+
+    def close(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.engine.shutdown()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def measure(self, name, params, unit, units_per_call, max_calls, run):
+        """run(probe) 执行被测路径；先计时一轮，再在 tracemalloc 下测一轮内存"""
+        probe = CallProbe(None, max_calls)
+        run(probe)
+        result = {'name': name, 'params': params, 'unit': unit}
+        result.update(summarize_times(probe, units_per_call))
+
+        probe = CallProbe(None, max_calls, track_memory=True)
+        tracemalloc.start()
+        try:
+            overhead = probe_overhead()
+            before = tracemalloc.take_snapshot()
+            baseline = tracemalloc.get_traced_memory()[0]
+            run(probe)
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        result['memory'] = summarize_memory(probe, baseline, before, after, overhead)
+        self.results.append(result)
+        print(format_result(result))
+        return result
+
+    # ---- 各项测量 ----
+
+    def bench_generate_waveform(self, duration):
+        engine = self.engine
+
+        def run(probe):
+            probe.func = engine.generate_waveform
+            for _ in range(self.args.repeats):
+                probe(1000.0, duration, 'sine', 0.5)
+
+        self.measure('generate_waveform', {'duration': duration}, 'samples',
+                     int(duration * self.sample_rate), self.args.repeats, run)
+
+    def bench_audio_callback(self, blocksize):
+        engine = self.engine
+        source = engine.inputs[0]
+        frames = int(self.args.duration * self.sample_rate)
+        calls = frames // blocksize
+
+        def run(probe):
+            probe.func = functools.partial(engine.audio_callback, source=source)
+            source.trigger = None
+            engine.recording = True
+            engine.paused = False
+            try:
+                run_stream('input', probe, blocksize, self.sample_rate, engine.channels, noise_level=0.01)
+            finally:
+                engine.recording = False
+                # 没有写入线程，测量结束后丢弃排队的数据块
+                while not source.queue.empty():
+                    source.queue.get_nowait()
+
+        self.measure('audio_callback', {'blocksize': blocksize, 'channels': engine.channels}, 'samples',
+                     blocksize * engine.channels, calls, run)
+
+    def bench_preview_callback(self, blocksize):
+        engine = self.engine
+        calls = int(self.args.duration * self.sample_rate) // blocksize
+
+        def run(probe):
+            probe.func = engine.preview_callback
+            engine.preview_params = (1000.0, 'sine', 0.5)
+            engine.preview_table = engine.wavetables.get(*engine.preview_params)
+            engine.preview_pending = None
+            engine.preview_position = 0
+            engine.previewing = True
+            try:
+                run_stream('output', probe, blocksize, self.sample_rate, engine.output_channels)
+            finally:
+                engine.previewing = False
+
+        self.measure('preview_callback', {'blocksize': blocksize}, 'samples', blocksize, calls, run)
+
+    def bench_generator_callback(self, blocksize):
+        from synth import ToneSynth
+
+        engine = self.engine
+        calls = int(self.args.duration * self.sample_rate) // blocksize
+
+        def run(probe):
+            probe.func = engine.generator_callback
+            # 合成器比测量时长稍长，由 CallProbe 结束流
+            engine.generator_synth = ToneSynth(1000.0, 'sine', 0.5, self.sample_rate,
+                                               (calls + 1) * blocksize / self.sample_rate)
+            engine._onset_session = None
+            engine.generating = True
+            try:
+                run_stream('output', probe, blocksize, self.sample_rate, engine.output_channels)
+            finally:
+                engine.generating = False
+
+        self.measure('generator_callback', {'blocksize': blocksize}, 'samples', blocksize, calls, run)
+
+    def bench_save_recording(self, duration):
+        engine = self.engine
+        frames = int(duration * self.sample_rate)
+        data = (0.1 * np.random.default_rng(0).standard_normal((frames, engine.channels))).astype(np.float32)
+
+        def run(probe):
+            def save(index):
+                filename = f"bench_{duration:g}s_{index}.wav"
+                # save_recording 每次都会打印保存路径
+                with contextlib.redirect_stdout(io.StringIO()):
+                    ok = engine.save_recording(data, filename)
+                os.remove(os.path.join(engine.recordings_dir, filename))
+                return ok
+
+            probe.func = save
+            for index in range(self.args.repeats):
+                probe(index)
+
+        self.measure('save_recording', {'duration': duration, 'channels': engine.channels}, 'samples',
+                     frames * engine.channels, self.args.repeats, run)
+
+    def bench_loggers(self, rows):
+        engine = self.engine
+
+        def sound(index):
+            engine.log_sound("Generation", 1000.0, 'sine', 1.0 + index * 1e-3, 0.5)
+
+        def recording(index):
+            engine.log_recording(f"ambient_sound_{index:06d}.wav", 60.0 + index * 1e-3)
+
+        for name, log, func in (('log_sound', engine.sound_log, sound),
+                                ('log_recording', engine.recording_log, recording)):
+            flush_seconds = []
+
+            def run(probe, log=log, func=func, flush_seconds=flush_seconds):
+                probe.func = func
+                for index in range(rows):
+                    probe(index)
+                # 行由后台线程批量写入，落盘时间单独记录
+                start = time.perf_counter()
+                log.flush(timeout=60)
+                flush_seconds.append(time.perf_counter() - start)
+
+            result = self.measure(name, {'rows': rows}, 'rows', 1, rows, run)
+            result['flush_seconds'] = flush_seconds[0]
+
+    def run(self):
+        args = self.args
+        for duration in args.durations:
+            self.bench_generate_waveform(duration)
+        for blocksize in args.blocksizes:
+            self.bench_audio_callback(blocksize)
+            self.bench_preview_callback(blocksize)
+            self.bench_generator_callback(blocksize)
+        for duration in args.save_durations:
+            self.bench_save_recording(duration)
+        self.bench_loggers(args.log_rows)
+        return self.results
+
+
+def format_result(result):
+    """一行摘要"""
+    params = ' '.join(f"{key}={value}" for key, value in result['params'].items())
+    latency = result['latency_us']
+    memory = result['memory']
+    return (f"{result['name']:>20} {params:<26} {result['throughput']:>14,.0f} {result['unit']}/s  "
+            f"p50 {latency['p50']:>10.2f} us  p99 {latency['p99']:>10.2f} us  "
+            f"peak {memory['peak_kib']:>9.1f} KiB  tmp/call {memory['transient_bytes_per_call']['mean']:>10.0f} B  "
+            f"alloc calls {memory['allocating_calls']:>6}/{result['calls']}")
+
+
+def result_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """与之前保存的结果逐项比较，返回吞吐量下降超过 tolerance 的项"""
+    previous = {result_key(result): result for result in baseline['results']}
+    commit = baseline.get('meta', {}).get('commit') or "baseline"
+    print(f"\n=== Compared with {commit} ===")
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result['throughput'] / old['throughput'] if old['throughput'] else float('nan')
+        p50_ratio = result['latency_us']['p50'] / old['latency_us']['p50'] if old['latency_us']['p50'] else float('nan')
+        peak = result['memory']['peak_kib'] - old['memory']['peak_kib']
+        params = ' '.join(f"{key}={value}" for key, value in result['params'].items())
+        marker = ''
+        if ratio < 1 - tolerance:
+            marker = '  <-- slower'
+            regressions.append(result)
+        print(f"{result['name']:>20} {params:<26} throughput x{ratio:5.2f}  p50 x{p50_ratio:5.2f}  "
+              f"peak {peak:+9.1f} KiB{marker}")
+    return regressions
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=HERE, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the audio callbacks, synthesis, WAV saving and CSV logs")
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--blocksizes', type=int, nargs='+', default=[256, 1024])
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of audio per callback case")
+    parser.add_argument('--durations', type=float, nargs='+', default=[1.0, 10.0, 60.0],
+                        help="generate_waveform durations (seconds)")
+    parser.add_argument('--save-durations', type=float, nargs='+', default=[10.0, 60.0],
+                        help="save_recording durations (seconds)")
+    parser.add_argument('--repeats', type=int, default=3, help="calls per generate_waveform / save_recording case")
+    parser.add_argument('--log-rows', type=int, default=10000, help="rows per CSV logger case")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', metavar='JSON', help="compare with results saved by an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed throughput drop when comparing (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    print("\n=== Hot path benchmark (simulated sound card) ===")
+    bench = HotPathBenchmark(args)
+    try:
+        results = bench.run()
+    finally:
+        bench.close()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'sample_rate': args.sample_rate,
+        },
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""音频通路延迟与抖动基准测试
+
+对每组 (blocksize, latency) 打开一个双工流，周期性输出单个脉冲并在输入中
+检测它，得到往返延迟；同时记录每次回调的执行时间、相邻回调的间隔以及
+underflow/overflow 次数，最后打印报告（可选 JSON）。
+
+真实设备需要把输出接回输入（回环线，或把麦克风靠近扬声器）：
+    python latency_benchmark.py --device 3 --blocksizes 64 128 256 --latencies low high
+没有声卡时使用模拟后端：
+    python latency_benchmark.py --simulate
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from audio_engine import parse_device
+from ring_buffer import RingBuffer
+
+# 直方图的分箱边界（毫秒）
+EXEC_BINS_MS = [0, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, float('inf')]
+JITTER_BINS_MS = [0, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, float('inf')]
+
+
+class CallbackProbe:
+    """双工回调：输出脉冲、保存输入，并记录每次回调的耗时与到达时间
+
+    所有记录都写入预分配的数组，回调内不分配内存。
+    """
+
+    def __init__(self, sample_rate, blocksize, duration, pulse_interval, history_seconds=1.0):
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self.total_frames = int(duration * sample_rate)
+        self.pulse_interval = int(pulse_interval * sample_rate)
+        max_calls = self.total_frames // blocksize + 2
+        self.input = np.zeros(self.total_frames + blocksize, dtype=np.float32)
+        self.arrivals = np.zeros(max_calls)
+        self.exec_times = np.zeros(max_calls)
+        self.calls = 0
+        self.frame = 0
+        self.xruns = 0
+        self.status_counts = {}
+        self.reported_roundtrip = None
+        # 与录音回调相同的典型负载：写入环形缓冲区
+        self.ring = RingBuffer.from_seconds(history_seconds, sample_rate)
+        self.done = False
+
+    def __call__(self, indata, outdata, frames, time_info, status):
+        if self.done:
+            outdata.fill(0)
+            return
+        arrival = time.perf_counter()
+        if status:
+            self.xruns += 1
+            for flag in str(status).split(', '):
+                self.status_counts[flag] = self.status_counts.get(flag, 0) + 1
+        if self.reported_roundtrip is None:
+            dac = getattr(time_info, 'outputBufferDacTime', 0)
+            adc = getattr(time_info, 'inputBufferAdcTime', 0)
+            if dac and adc:
+                self.reported_roundtrip = dac - adc
+
+        start = self.frame
+        end = min(start + frames, len(self.input))
+        self.input[start:end] = indata[:end - start, 0]
+        self.ring.write(indata[:, 0])
+
+        # 在每个 pulse_interval 的起点输出一个单样本脉冲
+        outdata.fill(0)
+        first = -(-start // self.pulse_interval) * self.pulse_interval
+        for pulse in range(first, start + frames, self.pulse_interval):
+            if pulse < self.total_frames - self.pulse_interval:
+                outdata[pulse - start, 0] = 0.9
+
+        self.frame += frames
+        if self.calls < len(self.arrivals):
+            self.arrivals[self.calls] = arrival
+            self.exec_times[self.calls] = time.perf_counter() - arrival
+            self.calls += 1
+        if self.frame >= self.total_frames:
+            self.done = True
+
+    def round_trips(self, threshold=0.3):
+        """在每个脉冲之后的窗口内找到第一个越过阈值的输入样本"""
+        latencies = []
+        for pulse in range(0, self.total_frames - self.pulse_interval, self.pulse_interval):
+            window = np.abs(self.input[pulse:pulse + self.pulse_interval])
+            hits = np.flatnonzero(window > threshold)
+            if len(hits):
+                latencies.append(hits[0] / self.sample_rate)
+        return np.array(latencies)
+
+
+def histogram(values_ms, edges):
+    """返回 [(标签, 计数)]"""
+    bins = np.array(edges[:-1] + [np.finfo(np.float64).max])
+    counts = np.histogram(values_ms, bins=bins)[0]
+    labels = []
+    for low, high in zip(edges[:-1], edges[1:]):
+        labels.append(f">{low:g}" if high == float('inf') else f"{low:g}-{high:g}")
+    return list(zip(labels, [int(c) for c in counts]))
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else float('nan')
+
+
+def run_case(sd, blocksize, latency, args):
+    """测量一组参数，返回结果字典"""
+    probe = CallbackProbe(args.sample_rate, blocksize, args.duration, args.pulse_interval)
+    kwargs = {}
+    if args.simulate:
+        kwargs['noise_level'] = args.noise
+    stream = sd.Stream(
+        device=args.device,
+        samplerate=args.sample_rate,
+        blocksize=blocksize,
+        latency=latency,
+        channels=1,
+        dtype='float32',
+        callback=probe,
+        **kwargs
+    )
+    with stream:
+        reported = stream.latency
+        deadline = time.monotonic() + args.duration * 2 + 5
+        while not probe.done and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    calls = probe.calls
+    period = blocksize / args.sample_rate
+    exec_ms = probe.exec_times[:calls] * 1000
+    # 跳过第一个间隔（流启动时的预填充）
+    intervals_ms = np.diff(probe.arrivals[:calls])[1:] * 1000
+    jitter_ms = np.abs(intervals_ms - period * 1000)
+    round_trips = probe.round_trips() * 1000
+
+    return {
+        'blocksize': blocksize,
+        'latency': latency,
+        'reported_latency_ms': [v * 1000 for v in reported] if isinstance(reported, (tuple, list)) else reported * 1000,
+        'reported_roundtrip_ms': None if probe.reported_roundtrip is None else probe.reported_roundtrip * 1000,
+        'roundtrip_ms': {
+            'pulses': len(round_trips),
+            'median': percentile(round_trips, 50),
+            'min': float(round_trips.min()) if len(round_trips) else float('nan'),
+            'max': float(round_trips.max()) if len(round_trips) else float('nan'),
+        },
+        'callbacks': calls,
+        'period_ms': period * 1000,
+        'exec_ms': {
+            'p50': percentile(exec_ms, 50),
+            'p99': percentile(exec_ms, 99),
+            'max': float(exec_ms.max()) if calls else float('nan'),
+            'load_p99': percentile(exec_ms, 99) / (period * 1000),
+            'histogram': histogram(exec_ms, EXEC_BINS_MS),
+        },
+        'jitter_ms': {
+            'mean_interval': float(intervals_ms.mean()) if len(intervals_ms) else float('nan'),
+            'std': float(intervals_ms.std()) if len(intervals_ms) else float('nan'),
+            'p99': percentile(jitter_ms, 99),
+            'max': float(jitter_ms.max()) if len(jitter_ms) else float('nan'),
+            'histogram': histogram(jitter_ms, JITTER_BINS_MS),
+        },
+        'xruns': probe.xruns,
+        'status_flags': probe.status_counts,
+    }
+
+
+def print_report(results):
+    """打印汇总表与直方图"""
+    print("\n=== Audio latency / jitter benchmark ===")
+    print(f"{'block':>6} {'latency':>8} {'round trip ms (med/min/max)':>28} "
+          f"{'exec p50/p99 ms':>16} {'load':>6} {'jitter p99 ms':>14} {'xruns':>6}")
+    for r in results:
+        rt = r['roundtrip_ms']
+        ex = r['exec_ms']
+        print(f"{r['blocksize']:>6} {str(r['latency']):>8} "
+              f"{rt['median']:>10.2f} /{rt['min']:>7.2f} /{rt['max']:>7.2f} "
+              f"{ex['p50']:>7.3f} /{ex['p99']:>7.3f} {ex['load_p99']:>6.1%} "
+              f"{r['jitter_ms']['p99']:>14.3f} {r['xruns']:>6}")
+
+    for r in results:
+        print(f"\n-- blocksize {r['blocksize']}, latency {r['latency']} --")
+        for title, key in (("callback execution time (ms)", 'exec_ms'), ("inter-callback jitter (ms)", 'jitter_ms')):
+            hist = r[key]['histogram']
+            peak = max(count for _, count in hist) or 1
+            print(f"  {title}")
+            for label, count in hist:
+                print(f"    {label:>10} | {'#' * int(round(40 * count / peak)):<40} {count}")
+        if r['status_flags']:
+            print(f"  status flags: {r['status_flags']}")
+
+
+def parse_latency(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure audio round-trip latency and callback jitter")
+    parser.add_argument('--simulate', action='store_true', help="use the simulated loopback device")
+    parser.add_argument('--device', type=parse_device, default=None,
+                        help="duplex device (index or name) with output looped to input")
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--blocksizes', type=int, nargs='+', default=[64, 128, 256, 512, 1024])
+    parser.add_argument('--latencies', type=parse_latency, nargs='+', default=['low', 'high'])
+    parser.add_argument('--duration', type=float, default=3.0, help="seconds per case")
+    parser.add_argument('--pulse-interval', type=float, default=0.25, help="seconds between pulses")
+    parser.add_argument('--noise', type=float, default=0.001, help="input noise level of the simulated device")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.simulate:
+        import sim_sounddevice as sd
+    else:
+        import sounddevice as sd
+
+    results = []
+    for latency in args.latencies:
+        for blocksize in args.blocksizes:
+            results.append(run_case(sd, blocksize, latency, args))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'simulated': args.simulate, 'sample_rate': args.sample_rate, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import json
+
+from synth import ToneSynth
+
+
+class Tone:
+    """协议中的一个刺激音"""
+
+    def __init__(self, frequency, duration, waveform='sine', amplitude=0.5):
+        self.frequency = float(frequency)
+        self.duration = float(duration)
+        self.waveform = waveform
+        self.amplitude = float(amplitude)
+
+    def __repr__(self):
+        return f"Tone({self.frequency:g} Hz, {self.duration:g} s, {self.waveform}, {self.amplitude:g})"
+
+
+class Gap:
+    """协议中的静音间隔"""
+
+    def __init__(self, duration):
+        self.duration = float(duration)
+
+    def __repr__(self):
+        return f"Gap({self.duration:g} s)"
+
+
+class Repeat:
+    """把一组步骤重复 count 次"""
+
+    def __init__(self, steps, count):
+        self.steps = list(steps)
+        self.count = int(count)
+
+    def __repr__(self):
+        return f"Repeat({self.steps!r}, {self.count})"
+
+
+def parse_protocol(spec):
+    """从 JSON 风格的列表解析协议
+
+    例: [{"tone": {"frequency": 1200, "duration": 10}}, {"gap": 300},
+         {"repeat": 3, "steps": [{"tone": {"frequency": 200, "duration": 5}}, {"gap": 60}]}]
+    """
+    steps = []
+    for item in spec:
+        if 'tone' in item:
+            steps.append(Tone(**item['tone']))
+        elif 'gap' in item:
+            steps.append(Gap(item['gap']))
+        elif 'repeat' in item:
+            steps.append(Repeat(parse_protocol(item['steps']), item['repeat']))
+        else:
+            raise ValueError(f"Unknown protocol step: {item}")
+    return steps
+
+
+def load_protocol(path):
+    """读取 JSON 协议文件"""
+    with open(path) as f:
+        return parse_protocol(json.load(f))
+
+
+# 预先分配合成器缓冲区时假定的最大回调块大小（帧）；更大的块仍可处理，只是第一次会分配内存
+MAX_BLOCK_FRAMES = 8192
+
+
+class ScheduledTone:
+    """展开后的刺激音，start/end 为相对流开始的样本位置"""
+
+    def __init__(self, index, tone, start, end):
+        self.index = index
+        self.tone = tone
+        self.start = start
+        self.end = end
+
+
+def schedule(steps, sample_rate):
+    """把协议展开为按样本位置排列的刺激列表，返回 (列表, 总样本数)"""
+    scheduled = []
+
+    def walk(items, cursor):
+        for item in items:
+            if isinstance(item, Tone):
+                frames = int(round(item.duration * sample_rate))
+                scheduled.append(ScheduledTone(len(scheduled), item, cursor, cursor + frames))
+                cursor += frames
+            elif isinstance(item, Gap):
+                cursor += int(round(item.duration * sample_rate))
+            elif isinstance(item, Repeat):
+                for _ in range(item.count):
+                    cursor = walk(item.steps, cursor)
+            else:
+                raise TypeError(f"Unknown protocol step: {item!r}")
+        return cursor
+
+    total = walk(steps, 0)
+    return scheduled, total
+
+
+class ProtocolPlayer:
+    """在输出回调中按样本位置渲染协议
+
+    每个刺激的起止时刻按所在块的 outputBufferDacTime 加上块内偏移计算，
+    以 (事件, ScheduledTone, 样本位置, DAC 时间) 的形式放入 events 队列，
+    由非音频线程取出并写日志。
+    """
+
+    def __init__(self, steps, sample_rate, events, max_block=MAX_BLOCK_FRAMES):
+        self.sample_rate = sample_rate
+        self.scheduled, self.total_frames = schedule(steps, sample_rate)
+        self.events = events
+        self.frame = 0
+        self._next = 0
+        self._active = None
+        self._synth = None
+        # 每种刺激音一个合成器，在这里预先建好；回调中到达起始位置时只需从头重置
+        self._synths = {}
+        for scheduled in self.scheduled:
+            tone = scheduled.tone
+            key = (tone.frequency, tone.waveform, tone.amplitude)
+            if key not in self._synths:
+                synth = ToneSynth(tone.frequency, tone.waveform, tone.amplitude, sample_rate)
+                # 缓冲区按最大块大小预先分配，回调中不再扩大
+                synth.prepare(max_block)
+                self._synths[key] = synth
+
+    @property
+    def finished(self):
+        return self.frame >= self.total_frames
+
+    def render(self, outdata, frames, dac_time):
+        """填充一个输出块；dac_time 为该块第一个样本的 DAC 时间（未知时为 None）"""
+        outdata.fill(0)
+        out = outdata[:, 0]
+        block_start = self.frame
+        block_end = block_start + frames
+
+        while True:
+            if self._active is None:
+                if self._next >= len(self.scheduled) or self.scheduled[self._next].start >= block_end:
+                    break
+                self._active = self.scheduled[self._next]
+                self._next += 1
+                tone = self._active.tone
+                self._synth = self._synths[(tone.frequency, tone.waveform, tone.amplitude)]
+                self._synth.reset(self._active.end - self._active.start)
+                self._emit('onset', self._active.start, block_start, dac_time)
+
+            active = self._active
+            start = max(active.start, block_start)
+            end = min(active.end, block_end)
+            if end > start:
+                self._synth.render(out[start - block_start:end - block_start])
+            if active.end > block_end:
+                break
+            self._emit('offset', active.end, block_start, dac_time)
+            self._active = None
+            self._synth = None
+
+        self.frame = block_end
+
+    def stop(self):
+        """中途停止时为正在播放的刺激补一个结束事件"""
+        if self._active is not None:
+            self.events.put(('stopped', self._active, self.frame, None))
+            self._active = None
+
+    def _emit(self, kind, frame, block_start, dac_time):
+        if dac_time is not None:
+            dac_time += (frame - block_start) / self.sample_rate
+        self.events.put((kind, self._active, frame, dac_time))
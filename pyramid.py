@@ -0,0 +1,453 @@
+"""录音与 ADS 会话的多分辨率最小/最大/平均值金字塔
+
+第 k 层的每个单元汇总 base * 2^k 个样本的 (最小值, 最大值, 平均值)。
+金字塔在一次顺序读取中逐层合并生成，保存在源文件旁的 <文件名>.pyramid/：
+    meta.json        源文件信息、采样率、每层单元数
+    level{k}.f32     (单元数, 3, 声道) float32：min / max / mean
+    level{k}.t64     每个单元第一个样本的时间（毫秒，仅 ADS 会话）
+    raw.f32, raw.t64 原始样本（仅 ADS 会话；WAV 的原始样本直接从源文件读取）
+ADS 会话以 Duration(ms) 列为时间轴（与分析笔记本 df['duration'] 一致）；SD 卡版本没有该列，
+由时间戳经 ads_store.time_axis 得到单调的时间轴（固件时间戳在整秒处可能倒退）。
+
+按可见时间范围和像素宽度选择合适的层，从几天缩放到几毫秒都只读取
+约 width 个单元：
+    pyramid = open_pyramid('recordings/ambient_sound_20250513_225631.wav')
+    t, lo, hi, mean = pyramid.view(0, pyramid.duration, width=1200)
+
+    python pyramid.py build recordings/*.wav ../data/*.csv
+"""
+import argparse
+import json
+import os
+import sys
+import wave
+
+import numpy as np
+
+from ads_store import parse_timestamps, time_axis
+
+PYRAMID_VERSION = 2
+PYRAMID_SUFFIX = '.pyramid'
+
+
+def pyramid_path(source_path):
+    return os.path.splitext(source_path)[0] + PYRAMID_SUFFIX
+
+
+class PyramidBuilder:
+    """逐块接收样本，写出各层的汇总"""
+
+    def __init__(self, path, channels=1, base=64, timed=False, keep_raw=False):
+        self.path = path
+        self.channels = channels
+        self.base = base
+        self.timed = timed
+        self.frames = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._levels = []
+        self._pending = np.zeros((0, channels), dtype=np.float32)
+        self._pending_t = np.zeros(0, dtype=np.int64)
+        self._raw = None
+        if keep_raw:
+            self._raw = (open(os.path.join(path, 'raw.f32'), 'wb'), open(os.path.join(path, 'raw.t64'), 'wb'))
+
+    def feed(self, values, times=None):
+        """追加 (帧, 声道) 样本；timed 时 times 为每个样本的毫秒时间"""
+        values = np.asarray(values, dtype=np.float32).reshape(-1, self.channels)
+        if self.timed:
+            times = np.asarray(times, dtype=np.int64)
+        if self._raw is not None:
+            self._raw[0].write(values.tobytes())
+            self._raw[1].write(times.tobytes())
+        self.frames += len(values)
+        if len(self._pending):
+            values = np.concatenate([self._pending, values])
+            if self.timed:
+                times = np.concatenate([self._pending_t, times])
+        full = len(values) // self.base * self.base
+        if full:
+            block = values[:full].reshape(-1, self.base, self.channels)
+            self._push(0, block.min(axis=1), block.max(axis=1), block.sum(axis=1, dtype=np.float64),
+                       np.full(len(block), self.base, dtype=np.int64),
+                       times[:full:self.base] if self.timed else None)
+        self._pending = values[full:].copy()
+        if self.timed:
+            self._pending_t = times[full:].copy()
+
+    def close(self):
+        """汇总最后不完整的单元，逐层向上补齐，返回每层单元数"""
+        if len(self._pending):
+            block = self._pending
+            self._push(0, block.min(axis=0)[None], block.max(axis=0)[None],
+                       block.sum(axis=0, dtype=np.float64)[None], np.array([len(block)]),
+                       self._pending_t[:1] if self.timed else None)
+            self._pending = self._pending[:0]
+        k = 0
+        while k < len(self._levels):
+            level = self._levels[k]
+            # 只剩一个单元的层就是顶层
+            if level['carry'] is not None and level['bins'] > 1:
+                carry = level['carry']
+                level['carry'] = None
+                self._push(k + 1, *carry)
+            k += 1
+        for level in self._levels:
+            level['file'].close()
+            if level['time'] is not None:
+                level['time'].close()
+        if self._raw is not None:
+            for f in self._raw:
+                f.close()
+        return [level['bins'] for level in self._levels]
+
+    def _level(self, k):
+        while len(self._levels) <= k:
+            index = len(self._levels)
+            self._levels.append({
+                'file': open(os.path.join(self.path, f"level{index}.f32"), 'wb'),
+                'time': open(os.path.join(self.path, f"level{index}.t64"), 'wb') if self.timed else None,
+                'bins': 0,
+                'carry': None,
+            })
+        return self._levels[k]
+
+    def _push(self, k, mins, maxs, sums, counts, times):
+        level = self._level(k)
+        means = (sums / counts[:, None]).astype(np.float32)
+        level['file'].write(np.stack([mins, maxs, means], axis=1).astype(np.float32).tobytes())
+        if times is not None:
+            level['time'].write(np.asarray(times, dtype=np.int64).tobytes())
+        level['bins'] += len(mins)
+
+        # 相邻两个单元合并为上一层的一个单元
+        if level['carry'] is not None:
+            cmins, cmaxs, csums, ccounts, ctimes = level['carry']
+            mins = np.concatenate([cmins, mins])
+            maxs = np.concatenate([cmaxs, maxs])
+            sums = np.concatenate([csums, sums])
+            counts = np.concatenate([ccounts, counts])
+            times = np.concatenate([ctimes, times]) if times is not None else None
+            level['carry'] = None
+        pairs = len(mins) // 2 * 2
+        if len(mins) > pairs:
+            level['carry'] = (mins[pairs:], maxs[pairs:], sums[pairs:], counts[pairs:],
+                              times[pairs:] if times is not None else None)
+        if pairs:
+            self._push(k + 1,
+                       np.minimum(mins[0:pairs:2], mins[1:pairs:2]),
+                       np.maximum(maxs[0:pairs:2], maxs[1:pairs:2]),
+                       sums[0:pairs:2] + sums[1:pairs:2],
+                       counts[0:pairs:2] + counts[1:pairs:2],
+                       times[0:pairs:2] if times is not None else None)
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return {'source': os.path.abspath(path), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+
+def _up_to_date(target, source_path):
+    meta_path = os.path.join(target, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    stat = _source_stat(source_path)
+    return (meta.get('version') == PYRAMID_VERSION and meta.get('source_size') == stat['source_size']
+            and meta.get('source_mtime') == stat['source_mtime'])
+
+
+def _write_meta(target, meta):
+    # meta.json 最后写入，存在即表示金字塔完整
+    meta_path = os.path.join(target, 'meta.json')
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def _audio_blocks(path, chunk_frames=1 << 18):
+    """依次返回 (采样率, 声道数) 与浮点样本块；支持 WAV 与 .wavz"""
+    if path.endswith('.wavz'):
+        from audio_archive import ArchiveReader
+        with ArchiveReader(path) as reader:
+            yield reader.sample_rate, reader.channels
+            for block in reader.blocks(np.float32):
+                yield block
+        return
+    with wave.open(path, 'rb') as source:
+        if source.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV is supported: {path}")
+        channels = source.getnchannels()
+        yield source.getframerate(), channels
+        while True:
+            raw = source.readframes(chunk_frames)
+            if not raw:
+                break
+            yield np.frombuffer(raw, dtype='<i2').reshape(-1, channels).astype(np.float32) / 32767
+
+
+def build_audio_pyramid(path, base=64, force=False):
+    """为 WAV / .wavz 录音生成金字塔，源文件未变化时跳过；返回金字塔目录"""
+    target = pyramid_path(path)
+    if not force and _up_to_date(target, path):
+        return target
+    blocks = _audio_blocks(path)
+    sample_rate, channels = next(blocks)
+    builder = PyramidBuilder(target, channels, base)
+    for block in blocks:
+        builder.feed(block)
+    levels = builder.close()
+    meta = {'version': PYRAMID_VERSION, 'kind': 'audio', 'sample_rate': sample_rate, 'channels': channels,
+            'base': base, 'frames': builder.frames, 'levels': levels}
+    meta.update(_source_stat(path))
+    _write_meta(target, meta)
+    return target
+
+
+def _ads_chunks(path, rows=65536):
+    """逐块读取 ads_*.csv，返回 (单调的 Duration 毫秒, 电压, 第一行时间戳)"""
+    first = None
+    origin = None
+    last = None
+    durations, voltages, stamps = [], [], []
+
+    def flush():
+        nonlocal origin, last
+        if not voltages:
+            return None
+        if any(d is None for d in durations):
+            # SD 卡版本没有 Duration 列，用相对第一个样本的时间代替；
+            # 时间戳局部逆序，按 time_axis 取累计最大值
+            timestamp = parse_timestamps(stamps)
+            if origin is None:
+                origin = int(timestamp[0])
+            times = time_axis(timestamp, timestamp - origin) - origin
+        else:
+            times = np.array(durations, dtype=np.int64)
+        # 跨块同样保持单调，金字塔按时间二分查找
+        if last is not None:
+            np.maximum(times, last, out=times)
+        last = int(times[-1])
+        chunk = (times, np.array(voltages, dtype=np.float32))
+        durations.clear()
+        voltages.clear()
+        stamps.clear()
+        return chunk
+
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) < 2 or not parts[0][:1].isdigit():
+                continue
+            try:
+                voltage = float(parts[1])
+                duration = int(float(parts[2])) if len(parts) > 2 and parts[2].strip() else None
+            except ValueError:
+                continue
+            if first is None:
+                first = parts[0]
+            durations.append(duration)
+            voltages.append(voltage)
+            stamps.append(parts[0])
+            if len(voltages) >= rows:
+                yield flush() + (first,)
+    chunk = flush()
+    if chunk is not None:
+        yield chunk + (first,)
+
+
+def build_ads_pyramid(path, base=16, force=False):
+    """为 ADS CSV 会话生成金字塔（同时保存原始样本），返回金字塔目录"""
+    target = pyramid_path(path)
+    if not force and _up_to_date(target, path):
+        return target
+    builder = PyramidBuilder(target, 1, base, timed=True, keep_raw=True)
+    first = None
+    start = end = None
+    for times, voltages, first in _ads_chunks(path):
+        builder.feed(voltages, times)
+        start = int(times[0]) if start is None else start
+        end = int(times[-1])
+    levels = builder.close()
+    meta = {'version': PYRAMID_VERSION, 'kind': 'ads', 'channels': 1, 'base': base, 'frames': builder.frames,
+            'levels': levels, 'origin': first, 'start_ms': start, 'end_ms': end}
+    meta.update(_source_stat(path))
+    _write_meta(target, meta)
+    return target
+
+
+def build_pyramid(path, force=False):
+    """按扩展名选择录音或 ADS 会话"""
+    if path.lower().endswith('.csv'):
+        return build_ads_pyramid(path, force=force)
+    return build_audio_pyramid(path, force=force)
+
+
+class Pyramid:
+    """读取金字塔，按时间范围和像素宽度返回汇总数据
+
+    时间均为相对源文件开头的秒数（ADS 会话为 Duration 列）。
+    """
+
+    def __init__(self, path, source=None):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.source = source or self.meta.get('source')
+        self.kind = self.meta['kind']
+        self.channels = self.meta['channels']
+        self.base = self.meta['base']
+        self.sample_rate = self.meta.get('sample_rate')
+        self.levels = []
+        for k, bins in enumerate(self.meta['levels']):
+            data = np.memmap(os.path.join(path, f"level{k}.f32"), dtype=np.float32, mode='r',
+                             shape=(bins, 3, self.channels)) if bins else np.zeros((0, 3, self.channels), np.float32)
+            times = None
+            if self.kind == 'ads' and bins:
+                times = np.memmap(os.path.join(path, f"level{k}.t64"), dtype=np.int64, mode='r', shape=(bins,))
+            self.levels.append((data, times))
+        self._raw = None
+        self._reader = None
+
+    @property
+    def duration(self):
+        if self.kind == 'ads':
+            return (self.meta['end_ms'] or 0) / 1000.0
+        return self.meta['frames'] / self.sample_rate
+
+    def factor(self, k):
+        """第 k 层每个单元包含的样本数"""
+        return self.base << k
+
+    def _range(self, k, start, end):
+        """第 k 层覆盖 [start, end] 秒的单元下标范围"""
+        data, times = self.levels[k]
+        if times is None:
+            step = self.factor(k) / self.sample_rate
+            lo = max(0, int(start // step))
+            hi = min(len(data), int(end // step) + 1)
+        else:
+            lo = max(0, int(np.searchsorted(times, start * 1000, side='right')) - 1)
+            hi = int(np.searchsorted(times, end * 1000, side='right'))
+        return lo, max(lo, hi)
+
+    def choose_level(self, start, end, width):
+        """单元数不少于 width 的最粗的一层；所有层都不够细时返回 None（读取原始样本）"""
+        for k in range(len(self.levels) - 1, -1, -1):
+            lo, hi = self._range(k, start, end)
+            if hi - lo >= width:
+                return k
+        return None
+
+    def view(self, start, end, width=1000):
+        """返回 (times, mins, maxs, means)，各为 (点数, 声道)，点数约为 width 到 2*width
+
+        缩放到原始样本级别时 mins/maxs/means 都是原始样本。
+        """
+        k = self.choose_level(start, end, width)
+        if k is None:
+            times, values = self.raw(start, end)
+            return times, values, values, values
+        data, times = self.levels[k]
+        lo, hi = self._range(k, start, end)
+        if times is None:
+            t = np.arange(lo, hi) * (self.factor(k) / self.sample_rate)
+        else:
+            t = times[lo:hi] / 1000.0
+        block = np.asarray(data[lo:hi])
+        return t, block[:, 0], block[:, 1], block[:, 2]
+
+    def raw(self, start, end):
+        """[start, end] 秒内的原始样本 (times, values)"""
+        if self.kind == 'ads':
+            if self._raw is None:
+                times = np.memmap(os.path.join(self.path, 'raw.t64'), dtype=np.int64, mode='r')
+                values = np.memmap(os.path.join(self.path, 'raw.f32'), dtype=np.float32, mode='r')
+                self._raw = times, values.reshape(-1, self.channels)
+            times, values = self._raw
+            lo = int(np.searchsorted(times, start * 1000, side='left'))
+            hi = int(np.searchsorted(times, end * 1000, side='right'))
+            return times[lo:hi] / 1000.0, np.asarray(values[lo:hi])
+
+        lo = max(0, int(start * self.sample_rate))
+        hi = min(self.meta['frames'], int(np.ceil(end * self.sample_rate)) + 1)
+        if hi <= lo:
+            return np.zeros(0), np.zeros((0, self.channels), np.float32)
+        if self.source.endswith('.wavz'):
+            if self._reader is None:
+                from audio_archive import ArchiveReader
+                self._reader = ArchiveReader(self.source)
+            values = self._reader.read(lo, hi, np.float32)
+        else:
+            with wave.open(self.source, 'rb') as source:
+                source.setpos(lo)
+                raw = source.readframes(hi - lo)
+            values = np.frombuffer(raw, dtype='<i2').reshape(-1, self.channels).astype(np.float32) / 32767
+        return np.arange(lo, lo + len(values)) / self.sample_rate, values
+
+
+def open_pyramid(source_path, build=True):
+    """打开源文件的金字塔，不存在或过期时先生成"""
+    target = pyramid_path(source_path)
+    if build:
+        build_pyramid(source_path)
+    return Pyramid(target, source_path)
+
+
+class PyramidPlot:
+    """在 matplotlib 坐标区中显示金字塔，缩放或平移后按新的范围重新取数据"""
+
+    def __init__(self, ax, pyramid, channel=0, color='C0'):
+        self.ax = ax
+        self.pyramid = pyramid
+        self.channel = channel
+        self.color = color
+        self._artists = []
+        ax.callbacks.connect('xlim_changed', lambda axes: self.refresh())
+        ax.set_xlim(0, max(pyramid.duration, 1e-3))
+
+    def refresh(self):
+        start, end = self.ax.get_xlim()
+        width = max(1, int(self.ax.bbox.width))
+        t, lo, hi, mean = self.pyramid.view(max(0.0, start), end, width)
+        for artist in self._artists:
+            artist.remove()
+        c = self.channel
+        self._artists = [
+            self.ax.fill_between(t, lo[:, c], hi[:, c], color=self.color, alpha=0.3, linewidth=0),
+            self.ax.plot(t, mean[:, c], color=self.color, lw=0.8)[0],
+        ]
+        self.ax.figure.canvas.draw_idle()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build min/max/mean pyramids for recordings and ADS sessions")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build pyramids (unchanged sources are skipped)")
+    build.add_argument('sources', nargs='+', help="WAV, .wavz or ADS CSV files")
+    build.add_argument('--force', action='store_true')
+    show = commands.add_parser('show', help="plot a source with interactive zoom")
+    show.add_argument('source')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        for path in args.sources:
+            try:
+                print(f"{path} -> {build_pyramid(path, args.force)}")
+            except Exception as e:
+                print(f"生成金字塔失败 {path}: {e}")
+        return 0
+
+    import matplotlib.pyplot as plt
+    pyramid = open_pyramid(args.source)
+    fig, ax = plt.subplots(figsize=(12, 4))
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Voltage (mV)' if pyramid.kind == 'ads' else 'Amplitude')
+    PyramidPlot(ax, pyramid).refresh()
+    plt.show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
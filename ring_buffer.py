@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class RingBuffer:
+    """预分配的单写者环形缓冲区
+
+    写入端（音频回调线程）只做原地拷贝，不分配内存，也不加锁；
+    读取端（绘图定时器、电平表等）通过 snapshot() 取得一致的最新数据副本。
+    给定 channels 时按 (帧, 声道) 保存多声道数据，整块一次拷贝。
+    """
+
+    def __init__(self, capacity, dtype=np.float32, channels=None):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        # 每帧的形状：单声道为标量，多声道为 (channels,)
+        self._frame_shape = () if channels is None else (int(channels),)
+        self._buffer = np.zeros((self.capacity,) + self._frame_shape, dtype=self.dtype)
+        # 已经完整写入的样本总数
+        self._head = 0
+        # 正在写入（或刚写完）的块的结束位置，读取端据此判断数据是否被覆盖
+        self._pending = 0
+        # 每次 clear() 加一；读取端据此判断缓冲区是否被清空过
+        self.generation = 0
+
+    @classmethod
+    def from_seconds(cls, seconds, sample_rate, dtype=np.float32, channels=None):
+        """按历史时长（秒）创建缓冲区"""
+        return cls(max(1, int(round(seconds * sample_rate))), dtype, channels)
+
+    def __len__(self):
+        return min(self._head, self.capacity)
+
+    @property
+    def total_written(self):
+        """自创建或清空以来写入的样本总数"""
+        return self._head
+
+    def clear(self):
+        """清空缓冲区（只应在写入端停止时调用）"""
+        # 先改编号再清零：读取端先读 total_written 再读 generation，看到清零后的位置时一定也看到新编号
+        self.generation += 1
+        self._head = 0
+        self._pending = 0
+
+    def write(self, block):
+        """写入一块样本（多声道时为 (帧, 声道)），超出容量的旧数据被覆盖"""
+        n = len(block)
+        if n == 0:
+            return
+        head = self._head
+        cap = self.capacity
+        if n >= cap:
+            # 块比缓冲区还大，只保留最新的 cap 个样本
+            block = block[n - cap:]
+            head += n - cap
+            n = cap
+        self._pending = head + n
+        start = head % cap
+        first = min(n, cap - start)
+        self._buffer[start:start + first] = block[:first]
+        if first < n:
+            self._buffer[:n - first] = block[first:]
+        self._head = head + n
+
+    def snapshot(self, n=None, out=None):
+        """返回最新 n 个样本的一致副本（按时间顺序）
+
+        若读取过程中写入端覆盖了其中最旧的部分，会重试；
+        多次重试仍失败时丢弃被覆盖的前缀，保证返回的数据不混杂新旧样本。
+        """
+        cap = self.capacity
+        for _ in range(3):
+            head = self._head
+            count = min(head, cap) if n is None else min(n, head, cap)
+            data = out[:count] if out is not None else np.empty((count,) + self._frame_shape, dtype=self.dtype)
+            start = (head - count) % cap
+            first = min(count, cap - start)
+            data[:first] = self._buffer[start:start + first]
+            if first < count:
+                data[first:] = self._buffer[:count - first]
+            # 写入端最远可能写到 _pending，其之前 cap 个以外的位置已失效
+            stale = self._pending - cap - (head - count)
+            if stale <= 0:
+                return data
+        return data[stale:] if stale < count else data[:0]
@@ -0,0 +1,257 @@
+"""模拟的 sounddevice 后端
+
+提供与 sounddevice 相同接口的 InputStream / OutputStream / Stream，
+在后台线程中按块调用回调，不需要声卡。输出会经过一条固定延迟的
+"回环"送回输入（模拟把扬声器接到麦克风），延迟等于输入与输出延迟之和，
+与真实设备上 outputBufferDacTime - inputBufferAdcTime 的含义一致。
+
+realtime=True 时按采样率的节奏调用回调，并在回调超时时设置
+underflow/overflow 标志；realtime=False 时回调一个接一个地尽快执行，
+适合测量吞吐量。
+"""
+import threading
+import time as _time
+
+import numpy as np
+
+# 与 PortAudio 'low' / 'high' 建议延迟大致相当的单向延迟（秒）
+_LATENCY_PRESETS = {'low': 0.01, 'high': 0.1}
+default_samplerate = 44100
+default_blocksize = 512
+
+
+class CallbackStop(Exception):
+    """在回调中抛出以正常结束流"""
+
+
+class CallbackAbort(Exception):
+    """在回调中抛出以立即中止流"""
+
+
+class CallbackFlags:
+    """回调状态标志"""
+
+    def __init__(self):
+        self.input_underflow = False
+        self.input_overflow = False
+        self.output_underflow = False
+        self.output_overflow = False
+        self.priming_output = False
+
+    def __bool__(self):
+        return (self.input_underflow or self.input_overflow or self.output_underflow
+                or self.output_overflow or self.priming_output)
+
+    def __str__(self):
+        names = [name.replace('_', ' ') for name in
+                 ('input_underflow', 'input_overflow', 'output_underflow', 'output_overflow', 'priming_output')
+                 if getattr(self, name)]
+        return ', '.join(names)
+
+
+class CallbackTimeInfo:
+    """回调的时间信息（与 PortAudio 的 PaStreamCallbackTimeInfo 对应）"""
+
+    def __init__(self, current, input_latency, output_latency):
+        self.currentTime = current
+        self.inputBufferAdcTime = current - input_latency
+        self.outputBufferDacTime = current + output_latency
+
+
+def query_devices(device=None, kind=None):
+    """返回一个虚拟设备的描述"""
+    info = {
+        'name': 'Simulated loopback device',
+        'index': 0,
+        'hostapi': 0,
+        'max_input_channels': 32,
+        'max_output_channels': 32,
+        'default_low_input_latency': _LATENCY_PRESETS['low'],
+        'default_low_output_latency': _LATENCY_PRESETS['low'],
+        'default_high_input_latency': _LATENCY_PRESETS['high'],
+        'default_high_output_latency': _LATENCY_PRESETS['high'],
+        'default_samplerate': float(default_samplerate),
+    }
+    return info if device is not None or kind is not None else [info]
+
+
+def _pair(value):
+    return tuple(value) if isinstance(value, (tuple, list)) else (value, value)
+
+
+def _latency_seconds(value):
+    if value is None:
+        value = 'high'
+    if isinstance(value, str):
+        return _LATENCY_PRESETS[value]
+    return float(value)
+
+
+class _SimulatedStream:
+    """所有模拟流的公共实现"""
+
+    _kind = 'duplex'
+
+    def __init__(self, samplerate=None, blocksize=None, device=None, channels=None, dtype='float32',
+                 latency=None, callback=None, finished_callback=None, realtime=True,
+                 input_signal=None, noise_level=0.0, **kwargs):
+        self.samplerate = float(samplerate or default_samplerate)
+        self.blocksize = blocksize or 0
+        self.device = device
+        self.dtype = dtype
+        self.callback = callback
+        self.finished_callback = finished_callback
+        self.realtime = realtime
+        self.noise_level = noise_level
+        # input_signal(start_frame, frames) -> ndarray，可用于注入测试信号
+        self.input_signal = input_signal
+
+        in_channels, out_channels = _pair(channels if channels is not None else 1)
+        in_latency, out_latency = _pair(latency)
+        self._block = self.blocksize or default_blocksize
+        # 输入延迟不可能小于一个缓冲块
+        self._in_latency = max(_latency_seconds(in_latency), self._block / self.samplerate)
+        self._out_latency = _latency_seconds(out_latency)
+        self.channels = (in_channels, out_channels) if self._kind == 'duplex' else \
+            (in_channels if self._kind == 'input' else out_channels)
+        self._in_channels = in_channels
+        self._out_channels = out_channels
+
+        # 回环延迟线（先进先出，长度为 delay 帧）：第 k 个输出样本成为第 k + delay 个输入样本
+        self._delay = max(self._block, int(round((self._in_latency + self._out_latency) * self.samplerate)))
+        self._line = np.zeros((self._delay, out_channels), dtype=np.float32)
+        self._rng = np.random.default_rng(0)
+
+        self._thread = None
+        self._running = False
+        self._epoch = _time.monotonic()
+        self.frames_processed = 0
+        self.active = False
+        self.stopped = True
+        self.closed = False
+
+    @property
+    def latency(self):
+        if self._kind == 'duplex':
+            return (self._in_latency, self._out_latency)
+        return self._in_latency if self._kind == 'input' else self._out_latency
+
+    @property
+    def time(self):
+        """流时钟（秒）"""
+        return _time.monotonic() - self._epoch
+
+    @property
+    def cpu_load(self):
+        return 0.0
+
+    def start(self):
+        if self.active:
+            return
+        self._running = True
+        self.active = True
+        self.stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, ignore_errors=True):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def abort(self, ignore_errors=True):
+        self.stop()
+
+    def close(self, ignore_errors=True):
+        self.stop()
+        self.closed = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        self.close()
+
+    def _input_block(self, frames):
+        """生成一块输入：回环的输出 + 注入信号 + 噪声"""
+        indata = np.zeros((frames, self._in_channels), dtype=np.float32)
+        shared = min(self._in_channels, self._out_channels)
+        indata[:, :shared] = self._line[:frames, :shared]
+        if self.input_signal is not None:
+            signal = np.asarray(self.input_signal(self.frames_processed, frames), dtype=np.float32)
+            indata += signal.reshape(frames, -1)
+        if self.noise_level:
+            indata += self.noise_level * self._rng.standard_normal(indata.shape, dtype=np.float32)
+        return indata
+
+    def _loop_back(self, outdata, frames):
+        """移出已经送到输入的部分，把本块输出追加到延迟线末尾"""
+        self._line[:-frames] = self._line[frames:]
+        self._line[-frames:] = outdata[:frames]
+
+    def _run(self):
+        frames = self._block
+        period = frames / self.samplerate
+        outdata = np.zeros((frames, self._out_channels), dtype=np.float32)
+        next_deadline = _time.monotonic()
+        status = CallbackFlags()
+        try:
+            while self._running:
+                if self.realtime:
+                    delay = next_deadline - _time.monotonic()
+                    if delay > 0:
+                        _time.sleep(delay)
+                    elif -delay > period:
+                        # 错过了整整一个周期：声卡缓冲区已经欠载/溢出
+                        status.output_underflow = self._kind != 'input'
+                        status.input_overflow = self._kind != 'output'
+                        next_deadline = _time.monotonic()
+                timeinfo = CallbackTimeInfo(self.time, self._in_latency, self._out_latency)
+                call_status, status = status, CallbackFlags()
+
+                try:
+                    if self._kind == 'input':
+                        self.callback(self._input_block(frames), frames, timeinfo, call_status)
+                    elif self._kind == 'output':
+                        self.callback(outdata, frames, timeinfo, call_status)
+                    else:
+                        indata = self._input_block(frames)
+                        self.callback(indata, outdata, frames, timeinfo, call_status)
+                        self._loop_back(outdata, frames)
+                except CallbackStop:
+                    self._running = False
+                except CallbackAbort:
+                    self._running = False
+
+                self.frames_processed += frames
+                next_deadline += period
+                if self.realtime and _time.monotonic() > next_deadline:
+                    # 回调本身耗时超过一个周期
+                    status.output_underflow = self._kind != 'input'
+                    status.input_overflow = self._kind != 'output'
+        finally:
+            self.active = False
+            self.stopped = True
+            if self.finished_callback is not None:
+                self.finished_callback()
+
+
+class Stream(_SimulatedStream):
+    _kind = 'duplex'
+
+
+class InputStream(_SimulatedStream):
+    _kind = 'input'
+
+
+class OutputStream(_SimulatedStream):
+    _kind = 'output'
+
+
+def install():
+    """把本模块注册为 sounddevice，之后 import sounddevice 得到的就是模拟后端"""
+    import sys
+    sys.modules['sounddevice'] = sys.modules[__name__]
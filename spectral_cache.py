@@ -0,0 +1,180 @@
+"""STFT / Welch PSD 结果的磁盘缓存
+
+键为输入数据内容的哈希加上全部参数（窗函数、nperseg、noverlap、采样率、频带），
+数据和参数都不变时直接读取上次的结果。每个条目是一个目录，里面是 .npy 数组，
+读取时内存映射；目录的修改时间记录最近一次使用，总大小超过上限时按最久未用淘汰。
+多个进程可以共用同一个缓存目录：条目先写到临时目录，再原子地改名。
+
+    cache = SpectralCache('.spectral_cache', max_bytes=2 << 30)
+    f, t, Zxx = cache.stft(voltage, fs, nperseg=256, noverlap=128)
+    f, pxx = cache.welch(voltage, fs, nperseg=256, band=(0, 0.2))
+    print(cache.stats())
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+CACHE_VERSION = 1
+
+
+def array_digest(array):
+    """数组内容（含 dtype 与形状）的哈希"""
+    array = np.ascontiguousarray(array)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{array.dtype.str}{array.shape}".encode())
+    h.update(memoryview(array).cast('B'))
+    return h.hexdigest()
+
+
+def _crop(f, band, *arrays):
+    """只保留频带 [low, high] 内的频率行"""
+    if band is None:
+        return (f,) + arrays
+    mask = (f >= band[0]) & (f <= band[1])
+    return (f[mask],) + tuple(a[mask] for a in arrays)
+
+
+class SpectralCache:
+    """按内容寻址、大小受限的 LRU 缓存"""
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def stats(self):
+        """命中统计与当前占用"""
+        entries, size = 0, 0
+        for _, entry_size, _ in self._entries():
+            entries += 1
+            size += entry_size
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def key(self, kind, digest, params):
+        text = json.dumps({'v': CACHE_VERSION, 'kind': kind, 'data': digest, 'params': params}, sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def get_or_compute(self, kind, data, params, compute, names):
+        """返回缓存中的数组（内存映射）；没有时调用 compute() 计算并保存
+
+        compute() 返回与 names 一一对应的数组元组。
+        """
+        key = self.key(kind, array_digest(data), params)
+        path = os.path.join(self.directory, key)
+        arrays = self._load(path, names)
+        if arrays is not None:
+            self.hits += 1
+            return arrays
+        self.misses += 1
+        arrays = compute()
+        self._store(path, names, arrays, {'kind': kind, 'params': params})
+        self._evict(keep=path)
+        return arrays
+
+    def stft(self, voltage, fs, nperseg=256, noverlap=128, window='hann', band=None):
+        """scipy.signal.stft，返回 (f, t, Zxx)"""
+        params = {'fs': float(fs), 'nperseg': nperseg, 'noverlap': noverlap, 'window': window,
+                  'band': list(band) if band is not None else None}
+
+        def compute():
+            from scipy import signal
+            f, t, zxx = signal.stft(voltage, fs=fs, window=window, nperseg=nperseg, noverlap=noverlap)
+            f, zxx = _crop(f, band, zxx)
+            return f, t, zxx
+
+        return self.get_or_compute('stft', voltage, params, compute, ('f', 't', 'zxx'))
+
+    def welch(self, voltage, fs, nperseg=256, noverlap=None, window='hann', band=None):
+        """scipy.signal.welch，返回 (f, Pxx)"""
+        params = {'fs': float(fs), 'nperseg': nperseg, 'noverlap': noverlap, 'window': window,
+                  'band': list(band) if band is not None else None}
+
+        def compute():
+            from scipy import signal
+            f, pxx = signal.welch(voltage, fs=fs, window=window, nperseg=nperseg, noverlap=noverlap)
+            return _crop(f, band, pxx)
+
+        return self.get_or_compute('welch', voltage, params, compute, ('f', 'pxx'))
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _load(self, path, names):
+        try:
+            arrays = tuple(np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in names)
+        except (OSError, ValueError):
+            return None
+        # 记录最近一次使用
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return arrays
+
+    def _store(self, path, names, arrays, meta):
+        try:
+            staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+            for name, array in zip(names, arrays):
+                np.save(os.path.join(staging, name + '.npy'), np.asarray(array))
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                # 另一个进程已经写入了同一个条目
+                shutil.rmtree(staging, ignore_errors=True)
+        except Exception as e:
+            print(f"写入缓存失败: {e}")
+
+    def _entries(self):
+        """[(路径, 字节数, 最近使用时间)]"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((path, size, os.stat(path).st_mtime))
+            except OSError:
+                continue
+        return entries
+
+    def _evict(self, keep=None):
+        """总大小超过上限时删除最久未用的条目"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.evictions += 1
+        # 清理中断留下的临时目录
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.tmp-') and now - os.stat(path).st_mtime > 3600:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,140 @@
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class StreamingSTFT:
+    """增量 STFT：每次只对新到达的样本计算新的帧
+
+    窗函数、缩放系数和频谱图缓冲区都预先分配；频谱图按列组成环形缓冲区，
+    新的帧覆盖最旧的列，不需要重新计算历史。
+    """
+
+    def __init__(self, sample_rate, n_fft=1024, hop=512, columns=430, floor_db=-100.0):
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop = hop
+        self.columns = columns
+        self.floor_db = floor_db
+        self.window = np.hanning(n_fft).astype(np.float32)
+        # 把正弦波的峰值幅度换算为 0 dBFS
+        self.scale = 2.0 / self.window.sum()
+        self.bins = n_fft // 2 + 1
+        self.frequencies = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
+        self.image = np.full((self.bins, columns), floor_db, dtype=np.float32)
+        self.column = 0
+        self.frames = 0
+        # 上一次剩下、还不够组成下一帧的样本
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._ordered = np.empty_like(self.image)
+
+    @property
+    def seconds(self):
+        """频谱图覆盖的时长（秒）"""
+        return self.columns * self.hop / self.sample_rate
+
+    def reset(self):
+        self.image.fill(self.floor_db)
+        self.column = 0
+        self.frames = 0
+        self._carry = np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples):
+        """送入新样本，返回新增的帧数"""
+        buffer = np.concatenate((self._carry, np.asarray(samples, dtype=np.float32)))
+        if len(buffer) < self.n_fft:
+            self._carry = buffer
+            return 0
+        count = (len(buffer) - self.n_fft) // self.hop + 1
+        # 超过一屏的帧反正会被覆盖，只计算最新的 columns 帧
+        skip = max(0, count - self.columns)
+        frames = sliding_window_view(buffer, self.n_fft)[skip * self.hop:count * self.hop:self.hop]
+        spectrum = np.abs(np.fft.rfft(frames * self.window, axis=1))
+        spectrum *= self.scale
+        db = 20 * np.log10(np.maximum(spectrum, 1e-10)).T
+        np.maximum(db, self.floor_db, out=db)
+
+        new = len(frames)
+        first = min(new, self.columns - self.column)
+        self.image[:, self.column:self.column + first] = db[:, :first]
+        if first < new:
+            self.image[:, :new - first] = db[:, first:]
+        self.column = (self.column + new) % self.columns
+        self.frames += count
+        self._carry = buffer[count * self.hop:].copy()
+        return count
+
+    def ordered(self):
+        """按时间顺序排列（最新的在右侧）的频谱图，返回内部复用的数组"""
+        head = self.column
+        tail = self.columns - head
+        self._ordered[:, :tail] = self.image[:, head:]
+        self._ordered[:, tail:] = self.image[:, :head]
+        return self._ordered
+
+
+class SpectrogramView:
+    """从录音环形缓冲区取新样本，增量更新并用 blitting 绘制滚动频谱图
+
+    多声道缓冲区只显示 channel 指定的声道。
+    """
+
+    def __init__(self, ax, canvas, ring, sample_rate, max_frequency=None, n_fft=1024, hop=512,
+                 min_interval=0.02, max_interval=0.5, budget=0.25, channel=0):
+        self.ax = ax
+        self.canvas = canvas
+        self.ring = ring
+        self.channel = channel
+        seconds = ring.capacity / sample_rate
+        self.stft = StreamingSTFT(sample_rate, n_fft, hop, columns=max(1, int(seconds * sample_rate / hop)))
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget
+        self.interval = min_interval
+        self.frame_cost = 0.0
+        self._read = 0
+        self._generation = ring.generation
+        self._background = None
+
+        nyquist = sample_rate / 2
+        self.image = ax.imshow(self.stft.ordered(), origin='lower', aspect='auto', animated=True,
+                               extent=(-self.stft.seconds, 0, 0, nyquist),
+                               vmin=self.stft.floor_db, vmax=0, cmap='magma')
+        ax.set_ylim(0, min(max_frequency or nyquist, nyquist))
+        canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.image)
+
+    def update(self):
+        """处理新样本并绘制一帧，返回建议的下一帧间隔（毫秒）"""
+        head = self.ring.total_written
+        generation = self.ring.generation
+        if generation != self._generation:
+            # 环形缓冲区被清空（开始了新的录音）；新的写入位置可能已经超过 _read，不能靠比较位置判断
+            self.stft.reset()
+            self._generation = generation
+            self._read = 0
+            head = self.ring.total_written
+        new = min(head - self._read, self.ring.capacity)
+        if new <= 0 or self._background is None:
+            return int(self.interval * 1000)
+
+        started = time.perf_counter()
+        self._read = head
+        samples = self.ring.snapshot(new)
+        if samples.ndim > 1:
+            samples = samples[:, self.channel]
+        if self.stft.feed(samples) == 0:
+            return int(self.interval * 1000)
+        self.image.set_data(self.stft.ordered())
+        self.canvas.restore_region(self._background)
+        self.ax.draw_artist(self.image)
+        self.canvas.blit(self.ax.bbox)
+
+        cost = time.perf_counter() - started
+        self.frame_cost = 0.8 * self.frame_cost + 0.2 * cost if self.frame_cost else cost
+        self.interval = min(self.max_interval, max(self.min_interval, self.frame_cost / self.budget))
+        return int(self.interval * 1000)
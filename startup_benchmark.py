@@ -0,0 +1,166 @@
+"""启动时间基准测试
+
+每轮启动一个全新的 Python 进程（冷导入），测量：
+  - import:       导入主模块所需时间
+  - window:       从进程启动到主窗口显示（仅 GUI 模式）
+  - figure:       从进程启动到波形图创建完成（仅 GUI 模式）
+  - first_sample: 从进程启动到第一块录音数据到达回调
+
+用法:
+    python startup_benchmark.py --runs 5
+    python startup_benchmark.py --headless --budget-first-sample 1.5 --json startup.json
+
+任一指标的中位数超过预算时以非零状态退出，便于发现启动性能回退。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def child_main(mode, first_sample_timeout):
+    """子进程：测量各阶段的时间点并以 JSON 输出"""
+    marks = {}
+    work_dir = tempfile.mkdtemp(prefix="startup_bench_")
+    sys.path.insert(0, HERE)
+
+    start = time.time()
+    if mode == 'gui':
+        import audio_controller
+        from audio_engine import AudioEngine
+    else:
+        from audio_engine import AudioEngine
+    marks['import'] = time.time()
+
+    engine = AudioEngine(recordings_dir=os.path.join(work_dir, "recordings"),
+                         logs_dir=os.path.join(work_dir, "logs"))
+    first_sample = threading.Event()
+
+    # 包装回调，记录第一块数据到达的时间
+    original_callback = engine.audio_callback
+
+    def probe(indata, frames, t, status, source=None):
+        if not first_sample.is_set():
+            marks['first_sample'] = time.time()
+            first_sample.set()
+        original_callback(indata, frames, t, status, source=source)
+
+    engine.audio_callback = probe
+
+    if mode == 'gui':
+        recorder = audio_controller.AudioRecorder(engine=engine)
+
+        def on_map(event):
+            if event.widget is recorder.root and 'window' not in marks:
+                marks['window'] = time.time()
+
+        recorder.root.bind('<Map>', on_map, add='+')
+        deadline = time.monotonic() + 30
+        while (recorder.canvas is None or 'window' not in marks) and time.monotonic() < deadline:
+            recorder.root.update()
+            time.sleep(0.001)
+        if recorder.canvas is not None:
+            marks['figure'] = time.time()
+        recorder.start_recording()
+        deadline = time.monotonic() + first_sample_timeout
+        while not first_sample.is_set() and time.monotonic() < deadline:
+            recorder.root.update()
+            time.sleep(0.001)
+        recorder.on_closing()
+    else:
+        engine.start_recording()
+        first_sample.wait(first_sample_timeout)
+        engine.shutdown()
+
+    print(json.dumps({'start': start, 'marks': marks}))
+
+
+def run_once(mode, first_sample_timeout):
+    """启动一次子进程，返回各指标相对进程启动的秒数"""
+    spawned = time.time()
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', mode,
+         '--first-sample-timeout', str(first_sample_timeout)],
+        capture_output=True, text=True, cwd=HERE
+    )
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(result.stderr.strip() or "benchmark child produced no output")
+    report = json.loads(lines[-1])
+    timings = {'interpreter': report['start'] - spawned}
+    for name, stamp in report['marks'].items():
+        base = report['start'] if name == 'import' else spawned
+        timings[name] = stamp - base
+    return timings
+
+
+def summarize(samples):
+    """按指标汇总多轮结果"""
+    summary = {}
+    for name in sorted({key for sample in samples for key in sample}):
+        values = [sample[name] for sample in samples if name in sample]
+        summary[name] = {
+            'median': statistics.median(values),
+            'min': min(values),
+            'max': max(values),
+            'runs': len(values)
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the audio tool")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--headless', action='store_true', help="benchmark the engine without the Tk window")
+    parser.add_argument('--budget-window', type=float, default=1.5, help="seconds")
+    parser.add_argument('--budget-first-sample', type=float, default=3.0, help="seconds")
+    parser.add_argument('--first-sample-timeout', type=float, default=10.0)
+    parser.add_argument('--json', help="write the summary to this file")
+    parser.add_argument('--child', choices=('gui', 'engine'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child_main(args.child, args.first_sample_timeout)
+        return 0
+
+    mode = 'engine' if args.headless else 'gui'
+    samples = []
+    for i in range(args.runs):
+        try:
+            samples.append(run_once(mode, args.first_sample_timeout))
+        except RuntimeError as e:
+            print(f"Run {i + 1} failed: {e}")
+            return 2
+    summary = summarize(samples)
+
+    print(f"\n=== Startup benchmark ({mode}, {args.runs} runs) ===")
+    for name, stats in summary.items():
+        print(f"{name:>14}: median {stats['median'] * 1000:8.1f} ms  "
+              f"min {stats['min'] * 1000:8.1f} ms  max {stats['max'] * 1000:8.1f} ms")
+
+    budgets = {'window': args.budget_window, 'first_sample': args.budget_first_sample}
+    failed = False
+    for name, budget in budgets.items():
+        if name in summary and summary[name]['median'] > budget:
+            print(f"Budget exceeded: {name} median {summary[name]['median']:.3f}s > {budget:.3f}s")
+            failed = True
+        elif name == 'first_sample' and name not in summary:
+            print("No audio sample arrived before the timeout")
+            failed = True
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'mode': mode, 'budgets': budgets, 'summary': summary, 'samples': samples}, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
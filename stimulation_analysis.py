@@ -0,0 +1,418 @@
+"""批量刺激响应分析
+
+把 data analysis/SFTF 笔记本中逐个会话手工执行的分析做成无界面的批处理：
+对每个刺激事件生成与笔记本相同的一组图片和 CSV，写入
+output_data/<刺激时间>_<频率>Hz/。会话之间用进程池并行处理，
+图片使用非交互的 Agg 后端；输入与参数都没有变化的事件会被跳过。
+
+事件可以来自 JSON 清单：
+    [{"csv": "../data/ads_20250513_223551_199.csv",
+      "stimulations": [{"time": "2025-05-13T22:56:31.317Z", "frequency": 1200, "duration": 10}]}]
+    python stimulation_analysis.py --manifest sessions.json
+也可以直接读取 AudioRecorder 写下的声音日志，自动匹配包含该时刻的 ADS 会话：
+    python stimulation_analysis.py --sound-log logs/sound_log_*.csv --data ../data
+需要 scipy 与 matplotlib。
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from ads_store import read_ads_csv, time_axis, to_epoch_ms
+from epochs import nearest_indices
+from spectral_cache import SpectralCache
+
+ARTIFACTS = (
+    "voltage_overview.png",
+    "voltage_with_annotation.png",
+    "voltage_around_stimulation.png",
+    "stft_spectrogram_overview.png",
+    "stft_spectrogram_around_stimulation.png",
+    "frequency_component_analysis.png",
+    "power_spectral_density_comparison.png",
+    "filtered_df.csv",
+)
+
+DEFAULT_PARAMS = {
+    'window_min': 5,
+    'nperseg': 256,
+    'noverlap': 128,
+    'target_freq': 0.02,
+    'spectrogram_max_freq': 0.07,
+    'psd_max_freq': 0.2,
+    'dpi': 300,
+}
+
+
+def clean_filename(filename):
+    """与笔记本相同：替换 Windows 文件名中不允许的字符"""
+    cleaned = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    return cleaned.replace(':', '')
+
+
+def event_name(event):
+    return clean_filename(f"{event['time']}_{event['frequency']:g}Hz")
+
+
+def event_label(event):
+    waveform = event.get('waveform', 'sine').replace('bl_', '').capitalize()
+    return f"{event['frequency']:g}Hz {waveform} Wave {event.get('duration', 10):g}s"
+
+
+def sampling_rate(duration_ms):
+    """与笔记本相同：1 / 相邻样本时长差的平均值"""
+    return 1 / (np.mean(np.diff(duration_ms)) / 1000)
+
+
+def compute_stft(voltage, fs, nperseg=256, noverlap=128):
+    """scipy.signal.stft，返回 (f, t, Zxx)"""
+    from scipy import signal
+    return signal.stft(voltage, fs=fs, nperseg=nperseg, noverlap=noverlap)
+
+
+def _pyplot():
+    """在工作进程中使用非交互后端"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def is_up_to_date(out_dir, stamp):
+    """输出齐全且记录的输入/参数与本次相同"""
+    try:
+        with open(os.path.join(out_dir, "analysis.json")) as f:
+            if json.load(f) != stamp:
+                return False
+    except (OSError, ValueError):
+        return False
+    return all(os.path.exists(os.path.join(out_dir, name)) for name in ARTIFACTS)
+
+
+def analyze_event(timestamp, voltage, duration, event, out_dir, params, cache=None, time=None):
+    """为一个刺激事件生成全部图片与 CSV；cache 为 SpectralCache 时复用之前的 STFT
+
+    time 为单调的时间轴（见 ads_store.time_axis），省略时由 timestamp 与 duration 计算。
+    """
+    plt = _pyplot()
+    dpi = params['dpi']
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    label = event_label(event)
+    minutes = duration / 60000
+
+    # 最接近刺激时刻的样本：RTC 时间戳局部逆序，在会话开始 + Duration 的单调时间轴上查找；
+    # time_axis 的结果已保证单调，每个事件不必再扫描整个时间轴
+    if time is None:
+        time = time_axis(timestamp, duration)
+    closest = int(nearest_indices(time, [to_epoch_ms(event['time'])], check=False)[0])
+    closest_min = minutes[closest]
+    closest_v = voltage[closest]
+
+    plt.figure(figsize=(12, 6))
+    plt.plot(minutes, voltage, label='Voltage change', color='b')
+    plt.xlabel('Duration (minutes)')
+    plt.ylabel('Voltage (mV)')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(os.path.join(out_dir, "voltage_overview.png"), dpi=dpi, bbox_inches='tight')
+    plt.close()
+
+    plt.figure(figsize=(12, 6))
+    plt.plot(minutes, voltage, label='Voltage change', color='b')
+    plt.scatter(closest_min, closest_v, color='red', s=100, zorder=5)
+    plt.annotate(f'{label}, \n Voltage: {closest_v:.2f}mV', xy=(closest_min, closest_v),
+                 xytext=(closest_min + 0.5, closest_v - 0.3), fontsize=10)
+    plt.xlabel('Time (min)')
+    plt.ylabel('Voltage (mV)')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(os.path.join(out_dir, "voltage_with_annotation.png"), dpi=dpi, bbox_inches='tight')
+    plt.close()
+
+    # 刺激前后 window_min 分钟（按记录时长筛选，与笔记本一致）
+    window = params['window_min']
+    lo = np.searchsorted(minutes, closest_min - window, side='left')
+    hi = np.searchsorted(minutes, closest_min + window, side='right')
+    w_minutes, w_voltage, w_duration = minutes[lo:hi], voltage[lo:hi], duration[lo:hi]
+
+    plt.figure(figsize=(18, 6))
+    plt.plot(w_minutes, w_voltage, label='Voltage Change', color='b')
+    plt.scatter(closest_min, closest_v, color='red', s=100, zorder=5)
+    plt.annotate(f'{label}, \nVoltage: {closest_v:.2f}mV', xy=(closest_min, closest_v),
+                 xytext=(closest_min, closest_v + 0.2), fontsize=10)
+    plt.xlabel('Time (min)')
+    plt.ylabel('Voltage (mV)')
+    plt.title('Voltage Data Around sound situmilation')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(os.path.join(out_dir, "voltage_around_stimulation.png"), dpi=dpi, bbox_inches='tight')
+    plt.close()
+
+    nperseg, noverlap = params['nperseg'], params['noverlap']
+    for data, dur, name, title in (
+            (voltage, duration, "stft_spectrogram_overview.png", 'STFT Spectrogram of Voltage Data Overview'),
+            (w_voltage, w_duration, "stft_spectrogram_around_stimulation.png",
+             'STFT Spectrogram of Voltage Data around sound situmilation')):
+        if cache is not None:
+            f, times, Zxx = cache.stft(data, sampling_rate(dur), nperseg, noverlap)
+        else:
+            f, times, Zxx = compute_stft(data, sampling_rate(dur), nperseg, noverlap)
+        plt.figure(figsize=(18, 6))
+        plt.pcolormesh(times, f, np.abs(Zxx), shading='gouraud')
+        plt.colorbar(label='Magnitude')
+        plt.ylabel('Frequency (Hz)')
+        plt.xlabel('Time (s)')
+        plt.title(title)
+        plt.ylim([0, params['spectrogram_max_freq']])
+        plt.tight_layout()
+        plt.savefig(os.path.join(out_dir, name), dpi=dpi, bbox_inches='tight')
+        plt.close()
+    # 之后的分析使用刺激前后窗口的 STFT
+
+    freq_idx = np.argmin(np.abs(f - params['target_freq']))
+    actual_freq = f[freq_idx]
+    magnitude = np.abs(Zxx[freq_idx, :])
+    time_min = times / 60
+    sound_time = times.mean()
+    before = times < sound_time
+    after = times >= sound_time
+    avg_before = np.mean(magnitude[before])
+    avg_after = np.mean(magnitude[after])
+
+    plt.figure(figsize=(18, 6))
+    plt.plot(time_min, magnitude, 'b-', linewidth=2, label=f'{actual_freq:.4f} Hz Component')
+    plt.axvline(x=sound_time / 60, color='r', linestyle='--', label='Sound Stimulation (estimated)')
+    plt.axhline(y=avg_before, color='g', linestyle=':', label=f'Avg Before: {avg_before:.4f}')
+    plt.axhline(y=avg_after, color='m', linestyle=':', label=f'Avg After: {avg_after:.4f}')
+    plt.annotate(f"Avg: {avg_before:.4f}", xy=(time_min[len(time_min) // 4], avg_before),
+                 xytext=(time_min[len(time_min) // 4], avg_before * 1.1), color='g')
+    plt.annotate(f"Avg: {avg_after:.4f}", xy=(time_min[3 * len(time_min) // 4], avg_after),
+                 xytext=(time_min[3 * len(time_min) // 4], avg_after * 1.1), color='m')
+    plt.xlabel('Time (min)')
+    plt.ylabel('Magnitude')
+    plt.title(f'Magnitude of {actual_freq:.4f} Hz Component Before and After Sound Stimulation')
+    plt.grid(True)
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(os.path.join(out_dir, "frequency_component_analysis.png"), dpi=dpi, bbox_inches='tight')
+    plt.close()
+
+    power = np.abs(Zxx) ** 2
+    stim_time = time_min[len(time_min) // 2]
+    psd_before = np.mean(power[:, time_min < stim_time], axis=1)
+    psd_after = np.mean(power[:, time_min > stim_time], axis=1)
+    total_before = np.sum(psd_before)
+    total_after = np.sum(psd_after)
+    power_change = (total_after - total_before) / total_before * 100
+
+    plt.figure(figsize=(18, 6))
+    plt.plot(f, psd_before, 'g-', label='Before Stimulation')
+    plt.plot(f, psd_after, 'm-', label='After Stimulation')
+    plt.plot(f, psd_after - psd_before, 'b--', label='Difference (After - Before)')
+    plt.xlabel('Frequency (Hz)')
+    plt.xlim(0, params['psd_max_freq'])
+    plt.ylabel('Power Spectral Density')
+    plt.title('Power Spectral Density Comparison Before and After Stimulation')
+    plt.grid(True)
+    plt.legend()
+    stats_text = (f"Total Power Before: {total_before:.2f}\n"
+                  f"Total Power After: {total_after:.2f}\n"
+                  f"Change: {power_change:.2f}%")
+    plt.annotate(stats_text, xy=(0.02, 0.95), xycoords='axes fraction',
+                 bbox=dict(boxstyle="round,pad=0.5", fc="white", alpha=0.8))
+    plt.tight_layout()
+    plt.savefig(os.path.join(out_dir, "power_spectral_density_comparison.png"), dpi=dpi, bbox_inches='tight')
+    plt.close()
+
+    # 窗口内的原始数据与各频率的功率变化
+    stamps = np.datetime_as_string(timestamp[lo:hi].astype('datetime64[ms]'), unit='ms')
+    with open(os.path.join(out_dir, "filtered_df.csv"), 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['timestamp', 'voltage', 'duration'])
+        for row in zip(stamps, w_voltage, w_duration):
+            writer.writerow([row[0], f"{row[1]:.6f}", int(row[2])])
+    percent = (psd_after - psd_before) / (psd_before + 1e-10) * 100
+    with open(os.path.join(out_dir, f"{os.path.basename(out_dir)}.csv"), 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['Frequency', 'Before', 'After', 'Absolute_Change', 'Percent_Change'])
+        for row in zip(f, psd_before, psd_after, psd_after - psd_before, percent):
+            writer.writerow([repr(float(v)) for v in row])
+
+    return {
+        'frequency_component': float(actual_freq),
+        'magnitude_change_percent': float((avg_after - avg_before) / avg_before * 100),
+        'power_change_percent': float(power_change),
+    }
+
+
+def analyze_session(task):
+    """工作进程入口：读取一个会话并处理它的全部事件，返回每个事件的结果"""
+    params = task['params']
+    stat = os.stat(task['csv'])
+    pending = []
+    results = []
+    for event in task['events']:
+        out_dir = os.path.join(task['output_dir'], event_name(event))
+        stamp = {'csv': os.path.abspath(task['csv']), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                 'event': event, 'params': params}
+        if not task['force'] and is_up_to_date(out_dir, stamp):
+            results.append({'event': event, 'output': out_dir, 'status': 'up to date'})
+        else:
+            pending.append((event, out_dir, stamp))
+    if not pending:
+        return results
+
+    timestamp, voltage, duration = read_ads_csv(task['csv'])
+    time = time_axis(timestamp, duration)
+    cache = SpectralCache(task['cache_dir'], task['cache_bytes']) if task.get('cache_dir') else None
+    for event, out_dir, stamp in pending:
+        t = to_epoch_ms(event['time'])
+        if not len(time) or not time[0] <= t <= time[-1]:
+            results.append({'event': event, 'output': out_dir, 'status': 'outside session'})
+            continue
+        try:
+            hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+            summary = analyze_event(timestamp, voltage, duration, event, out_dir, params, cache, time)
+            with open(os.path.join(out_dir, "analysis.json"), 'w') as f:
+                json.dump(stamp, f, indent=2)
+            if cache is not None:
+                summary['cache'] = {'hits': cache.hits - hits, 'misses': cache.misses - misses}
+            results.append({'event': event, 'output': out_dir, 'status': 'done', **summary})
+        except Exception as e:
+            results.append({'event': event, 'output': out_dir, 'status': f"Error: {e}"})
+    return results
+
+
+def load_manifest(path):
+    """读取 JSON 清单，返回 {csv 路径: [事件, ...]}"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        manifest = json.load(f)
+    sessions = {}
+    for entry in manifest:
+        csv_path = entry['csv'] if os.path.isabs(entry['csv']) else os.path.join(base, entry['csv'])
+        events = sessions.setdefault(csv_path, [])
+        for stim in entry.get('stimulations', []):
+            events.append({
+                'time': stim['time'],
+                'frequency': float(stim['frequency']),
+                'waveform': stim.get('waveform', 'sine'),
+                'duration': float(stim.get('duration', 10)),
+            })
+    return sessions
+
+
+def session_span(csv_path):
+    """只读取首尾两行得到会话的时间范围（毫秒）"""
+    first = last = None
+    with open(csv_path, 'rb') as f:
+        for line in f:
+            if line[:1].isdigit():
+                first = line
+                break
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        for line in f.read().splitlines():
+            if line[:1].isdigit():
+                last = line
+    if first is None or last is None:
+        return None
+    return (to_epoch_ms(first.split(b',')[0].decode()), to_epoch_ms(last.split(b',')[0].decode()))
+
+
+def load_sound_log(paths, data_dir, types=('Generation', 'Protocol')):
+    """从声音日志中取出刺激事件，并匹配包含该时刻的 ADS 会话"""
+    spans = {}
+    for csv_path in sorted(glob.glob(os.path.join(data_dir, "ads_*.csv"))):
+        span = session_span(csv_path)
+        if span is not None:
+            spans[csv_path] = span
+    sessions = {}
+    for path in paths:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                if row.get('Type') not in types or row.get('Status') != 'Success':
+                    continue
+                t = to_epoch_ms(row['Start Time'])
+                for csv_path, (start, end) in spans.items():
+                    if start <= t <= end:
+                        sessions.setdefault(csv_path, []).append({
+                            'time': row['Start Time'],
+                            'frequency': float(row['Frequency (Hz)']),
+                            'waveform': row.get('Waveform') or 'sine',
+                            'duration': float(row['Duration (s)']),
+                        })
+                        break
+                else:
+                    print(f"No ADS session contains {row['Start Time']}")
+    return sessions
+
+
+def run(sessions, output_dir, params, jobs=None, force=False, cache_dir=None, cache_bytes=1 << 30):
+    """并行处理所有会话，返回全部事件的结果"""
+    tasks = [{'csv': csv_path, 'events': events, 'output_dir': output_dir, 'params': params, 'force': force,
+              'cache_dir': cache_dir, 'cache_bytes': cache_bytes}
+             for csv_path, events in sessions.items() if events]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(analyze_session, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                session_results = future.result()
+            except Exception as e:
+                print(f"分析失败 {task['csv']}: {e}")
+                continue
+            for result in session_results:
+                print(f"[{result['status']}] {os.path.basename(task['csv'])} -> {result['output']}")
+            results.extend(session_results)
+    if cache_dir:
+        hits = sum(r['cache']['hits'] for r in results if 'cache' in r)
+        misses = sum(r['cache']['misses'] for r in results if 'cache' in r)
+        stats = SpectralCache(cache_dir, cache_bytes).stats()
+        print(f"Spectral cache: {hits} hits, {misses} misses, "
+              f"{stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch stimulation-response analysis of ADS1110 sessions")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help="JSON list of sessions and stimulation times")
+    source.add_argument('--sound-log', nargs='+', help="sound_log_*.csv files written by the recorder")
+    parser.add_argument('--data', default='data', help="directory with ads_*.csv (for --sound-log)")
+    parser.add_argument('--output', default='output_data')
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="regenerate outputs that are up to date")
+    parser.add_argument('--window', type=float, default=DEFAULT_PARAMS['window_min'],
+                        help="minutes before/after the stimulation")
+    parser.add_argument('--dpi', type=int, default=DEFAULT_PARAMS['dpi'])
+    parser.add_argument('--summary', help="write the per-event results to this JSON file")
+    parser.add_argument('--cache', default='.spectral_cache',
+                        help="directory for cached STFT results ('' to disable)")
+    parser.add_argument('--cache-size', type=float, default=1024, help="cache size limit in MB")
+    args = parser.parse_args(argv)
+
+    params = dict(DEFAULT_PARAMS, window_min=args.window, dpi=args.dpi)
+    if args.manifest:
+        sessions = load_manifest(args.manifest)
+    else:
+        sessions = load_sound_log(args.sound_log, args.data)
+    results = run(sessions, args.output, params, args.jobs, args.force,
+                  args.cache or None, int(args.cache_size * 1e6))
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(results, f, indent=2)
+    failed = [r for r in results if r['status'].startswith('Error')]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+from collections import OrderedDict
+from fractions import Fraction
+
+import numpy as np
+
+# 朴素波形与 generate_waveform 的定义逐点一致；bl_ 前缀为带限（PolyBLEP/PolyBLAMP）版本
+WAVEFORMS = ('sine', 'square', 'triangle', 'sawtooth', 'bl_square', 'bl_triangle', 'bl_sawtooth')
+
+# 朴素波形在过零点与跳变点（相位 0 与 0.5）附近的取值由舍入决定（方波的符号、锯齿波跳到 ±1），
+# 离这些点不到 _EDGE 周期的样本按原 generate_waveform 的表达式（绝对时间）重新计算
+_EDGE = 1e-6
+
+
+def _polyblep(t, dt, out, scratch, mask):
+    """PolyBLEP 残差：t 为到不连续点的相位 [0, 1)，结果写入 out（全部原地计算）"""
+    out.fill(0.0)
+    if dt <= 0:
+        return out
+    # 不连续点之后：x = t/dt ∈ [0, 1)，残差 2x - x² - 1 = -(x - 1)²
+    np.divide(t, dt, out=scratch)
+    scratch -= 1.0
+    np.square(scratch, out=scratch)
+    np.negative(scratch, out=scratch)
+    np.less(t, dt, out=mask)
+    np.copyto(out, scratch, where=mask)
+    # 不连续点之前：x = (t-1)/dt ∈ (-1, 0]，残差 x² + 2x + 1 = (x + 1)²
+    np.subtract(t, 1.0, out=scratch)
+    scratch /= dt
+    scratch += 1.0
+    np.square(scratch, out=scratch)
+    np.greater(t, 1 - dt, out=mask)
+    np.copyto(out, scratch, where=mask)
+    return out
+
+
+def _polyblamp(t, dt, out, scratch, mask):
+    """PolyBLAMP 残差（斜率突变的积分修正），结果写入 out（全部原地计算）"""
+    out.fill(0.0)
+    if dt <= 0:
+        return out
+    # x = t/dt 或 (1-t)/dt，残差 (1 - x)³ / 6
+    np.divide(t, dt, out=scratch)
+    np.subtract(1.0, scratch, out=scratch)
+    np.power(scratch, 3, out=scratch)
+    scratch /= 6.0
+    np.less(t, dt, out=mask)
+    np.copyto(out, scratch, where=mask)
+    np.subtract(1.0, t, out=scratch)
+    scratch /= dt
+    np.subtract(1.0, scratch, out=scratch)
+    np.power(scratch, 3, out=scratch)
+    scratch /= 6.0
+    np.greater(t, 1 - dt, out=mask)
+    np.copyto(out, scratch, where=mask)
+    return out
+
+
+class ToneSynth:
+    """相位累加合成器，每次只计算一个块的样本
+
+    相位以周期为单位保存在 [0, 1) 内，跨块连续，因此长时间播放既不占用
+    与时长成正比的内存，也不会因为时间变量增大而损失精度。
+    duration 为 None 时无限播放。
+    """
+
+    def __init__(self, frequency, waveform='sine', amplitude=0.5, sample_rate=44100, duration=None):
+        if waveform not in WAVEFORMS:
+            waveform = 'sine'
+        self.frequency = float(frequency)
+        self.waveform = waveform
+        self.amplitude = float(amplitude)
+        self.sample_rate = sample_rate
+        self.total_frames = None if duration is None else int(sample_rate * duration)
+        # 原 generate_waveform 的时间步长：np.linspace(0, duration, total_frames, False)
+        self._step = duration / self.total_frames if duration and self.total_frames else 1.0 / sample_rate
+        self.position = 0
+        self.phase = 0.0
+        self._phases = np.empty(0)
+        self._mask = np.empty(0, dtype=bool)
+        self._scratch = np.empty(0)
+        self._residual = np.empty(0)
+
+    @property
+    def finished(self):
+        return self.total_frames is not None and self.position >= self.total_frames
+
+    def set_frequency(self, frequency):
+        """修改频率，相位保持连续"""
+        self.frequency = float(frequency)
+        # 之后不再对应原 generate_waveform 的绝对时间
+        self._step = None
+
+    def reset(self, total_frames=None):
+        """从头重新播放 total_frames 个样本（None 为无限），保留已分配的缓冲区"""
+        self.total_frames = total_frames
+        self.position = 0
+        self.phase = 0.0
+
+    def prepare(self, max_frames):
+        """预先分配 max_frames 帧的内部缓冲区；之后不超过该大小的块在 render() 中不再分配内存"""
+        self._buffers(max_frames)
+
+    def _buffers(self, frames):
+        """按需扩大内部缓冲区，之后同样大小的块不再分配内存"""
+        if len(self._phases) < frames:
+            self._ramp = np.arange(frames, dtype=np.float64)
+            self._phases = np.empty(frames, dtype=np.float64)
+            self._scratch = np.empty(frames, dtype=np.float64)
+            self._residual = np.empty(frames, dtype=np.float64)
+            self._shifted = np.empty(frames, dtype=np.float64)
+            self._signal = np.empty(frames, dtype=np.float64)
+            self._mask = np.empty(frames, dtype=bool)
+        return self._phases[:frames], self._scratch[:frames], self._residual[:frames]
+
+    def _time(self, frames, out):
+        """本块各样本在原 generate_waveform 中的时间变量 t，写入 out"""
+        np.add(self._ramp[:frames], self.position, out=out)
+        np.multiply(out, self._step, out=out)
+        return out
+
+    def _match_edges(self, x, p, frames, t, distance):
+        """相位离 0 或 0.5 周期不到 _EDGE 的样本按原 generate_waveform 的表达式重新计算"""
+        mask = self._mask[:frames]
+        np.multiply(p, 2.0, out=distance)
+        distance += 0.5
+        np.mod(distance, 1.0, out=distance)
+        distance -= 0.5
+        np.abs(distance, out=distance)
+        np.less(distance, _EDGE, out=mask)
+        if not mask.any():
+            return
+        self._time(frames, t)
+        if self.waveform == 'sawtooth':
+            np.multiply(t, np.pi * self.frequency, out=t)
+            np.tan(t, out=t)
+            np.arctan(t, out=t)
+            np.multiply(t, 2 / np.pi, out=t)
+        else:
+            np.multiply(t, 2 * np.pi * self.frequency, out=t)
+            np.sin(t, out=t)
+            if self.waveform == 'square':
+                np.sign(t, out=t)
+            elif self.waveform == 'triangle':
+                np.arcsin(t, out=t)
+                np.multiply(t, 2 / np.pi, out=t)
+        np.copyto(x, t, where=mask)
+
+    def render(self, out):
+        """把下一段样本写入 out（一维 float32），返回实际写入的样本数"""
+        frames = len(out)
+        if self.total_frames is not None:
+            frames = max(0, min(frames, self.total_frames - self.position))
+        if frames == 0:
+            return 0
+
+        inc = self.frequency / self.sample_rate
+        p, scratch, residual = self._buffers(frames)
+        np.multiply(self._ramp[:frames], inc, out=p)
+        p += self.phase
+        np.mod(p, 1.0, out=p)
+        dt = abs(inc)
+        # 先在 float64 缓冲区中计算，最后一次转换写入 out；
+        # 输出类型与输入不同的 ufunc 每次调用都会分配内部转换缓冲区
+        mask, q, signal = self._mask[:frames], self._shifted[:frames], self._signal[:frames]
+
+        waveform = self.waveform
+        if waveform == 'sine':
+            np.multiply(p, 2 * np.pi, out=signal)
+            np.sin(signal, out=signal)
+        elif waveform == 'square':
+            np.multiply(p, 2 * np.pi, out=signal)
+            np.sin(signal, out=signal)
+            np.sign(signal, out=signal)
+        elif waveform == 'triangle':
+            # (2/π)·arcsin(sin(2πp)) 的分段线性等价形式
+            np.add(p, 0.25, out=signal)
+            np.mod(signal, 1.0, out=signal)
+            signal -= 0.5
+            np.abs(signal, out=signal)
+            signal *= -4.0
+            signal += 1.0
+        elif waveform == 'sawtooth':
+            # (2/π)·arctan(tan(πp)) 的等价形式，在 p = 0.5 处由 +1 跳到 -1
+            np.add(p, 0.5, out=signal)
+            np.mod(signal, 1.0, out=signal)
+            signal *= 2.0
+            signal -= 1.0
+        elif waveform == 'bl_square':
+            np.less(p, 0.5, out=mask)
+            signal.fill(-1.0)
+            np.copyto(signal, 1.0, where=mask)
+            signal += _polyblep(p, dt, residual, scratch, mask)
+            np.add(p, 0.5, out=q)
+            np.mod(q, 1.0, out=q)
+            signal -= _polyblep(q, dt, residual, scratch, mask)
+        elif waveform == 'bl_sawtooth':
+            np.add(p, 0.5, out=q)
+            np.mod(q, 1.0, out=q)
+            np.multiply(q, 2.0, out=signal)
+            signal -= 1.0
+            signal -= _polyblep(q, dt, residual, scratch, mask)
+        elif waveform == 'bl_triangle':
+            # 在 p = 0.25 处斜率由 +4 变为 -4，p = 0.75 处由 -4 变为 +4（每周期单位）
+            np.add(p, 0.25, out=q)
+            np.mod(q, 1.0, out=q)
+            np.subtract(q, 0.5, out=signal)
+            np.abs(signal, out=signal)
+            signal *= -4.0
+            signal += 1.0
+            np.add(p, 0.75, out=q)
+            np.mod(q, 1.0, out=q)
+            residual = _polyblamp(q, dt, residual, scratch, mask)
+            residual *= 8.0 * dt
+            signal -= residual
+            np.add(p, 0.25, out=q)
+            np.mod(q, 1.0, out=q)
+            residual = _polyblamp(q, dt, residual, scratch, mask)
+            residual *= 8.0 * dt
+            signal += residual
+        if self._step is not None and waveform in ('sine', 'square', 'triangle', 'sawtooth'):
+            self._match_edges(signal, p, frames, scratch, residual)
+
+        signal *= self.amplitude
+        np.copyto(out[:frames], signal, casting='same_kind')
+        self.phase = (self.phase + frames * inc) % 1.0
+        self.position += frames
+        return frames
+
+    def blocks(self, block_frames=4096):
+        """逐块生成直到结束（仅用于有限时长），每次产出的数组会被下一块复用"""
+        buffer = np.empty(block_frames, dtype=np.float32)
+        while not self.finished:
+            n = self.render(buffer)
+            if n == 0:
+                break
+            yield buffer[:n]
+
+    def render_all(self):
+        """一次性生成全部样本（仅用于有限时长）"""
+        signal = np.empty(self.total_frames - self.position, dtype=np.float32)
+        self.render(signal)
+        return signal
+
+
+class Wavetable:
+    """循环播放用的波形表：samples 恰好包含 cycles 个完整周期"""
+
+    def __init__(self, samples, cycles, frequency):
+        self.samples = samples
+        self.cycles = cycles
+        # 实际播放频率（无法精确循环时会有极小的偏差）
+        self.frequency = frequency
+
+    def __len__(self):
+        return len(self.samples)
+
+    def phase_at(self, position):
+        """表内位置对应的相位（周期）"""
+        return (position * self.cycles / len(self.samples)) % 1.0
+
+    def position_at(self, phase):
+        """相位对应的表内位置（落在第一个周期内）"""
+        return int(round(phase * len(self.samples) / self.cycles)) % len(self.samples)
+
+
+class WavetableCache:
+    """按 (频率, 波形, 幅度) 缓存波形表，超出容量时淘汰最久未使用的表
+
+    优先使用能精确首尾相接的最短长度（整数个周期），这样非整数频率
+    循环时也不会在接缝处产生咔嗒声；超过 max_frames 时改用约
+    min_frames 长的表，并把频率微调到恰好整数个周期。
+    """
+
+    def __init__(self, sample_rate, max_entries=32, min_frames=4096, max_frames=None):
+        self.sample_rate = sample_rate
+        self.max_entries = max_entries
+        self.min_frames = min_frames
+        self.max_frames = max_frames if max_frames is not None else sample_rate * 10
+        self._tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, frequency, waveform='sine', amplitude=0.5):
+        """取得（必要时生成）波形表"""
+        key = (round(float(frequency), 6), waveform, round(float(amplitude), 4))
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            self.hits += 1
+            return table
+        self.misses += 1
+        table = self._build(*key)
+        self._tables[key] = table
+        while len(self._tables) > self.max_entries:
+            self._tables.popitem(last=False)
+        return table
+
+    def clear(self):
+        self._tables.clear()
+
+    def _loop_length(self, frequency):
+        """返回 (表长, 周期数)"""
+        sr = self.sample_rate
+        ratio = Fraction(frequency).limit_denominator(1000000) / sr
+        # 周期数 / 表长 = frequency / sr，取最简分数即为最短的精确循环
+        cycles, frames = ratio.numerator, ratio.denominator
+        if 0 < frames <= self.max_frames:
+            return frames, cycles
+        cycles = max(1, int(np.ceil(self.min_frames * frequency / sr)))
+        return max(1, int(round(cycles * sr / frequency))), cycles
+
+    def _build(self, frequency, waveform, amplitude):
+        if frequency <= 0:
+            return Wavetable(np.zeros(1, dtype=np.float32), 1, 0.0)
+        frames, cycles = self._loop_length(frequency)
+        actual = cycles * self.sample_rate / frames
+        samples = np.empty(frames, dtype=np.float32)
+        ToneSynth(actual, waveform, amplitude, self.sample_rate, frames / self.sample_rate).render(samples)
+        return Wavetable(samples, cycles, actual)
+
+
+def fill_looped(out, samples, position):
+    """用循环的 samples 填满 out，返回下一次读取的位置"""
+    length = len(samples)
+    filled = 0
+    frames = len(out)
+    while filled < frames:
+        chunk = min(frames - filled, length - position)
+        out[filled:filled + chunk] = samples[position:position + chunk]
+        filled += chunk
+        position = (position + chunk) % length
+    return position
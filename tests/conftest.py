@@ -0,0 +1,9 @@
+"""测试公共设置：使用仓库根目录的模块，并以模拟后端代替 sounddevice"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sim_sounddevice  # noqa: E402
+
+sim_sounddevice.install()
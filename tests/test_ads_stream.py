@@ -0,0 +1,143 @@
+"""AdsStreamClient 与本地 WebSocket 替身服务器（ads_stream.serve）"""
+import asyncio
+import glob
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('websockets')
+
+from ads_stream import AdsStreamClient, VoltageBuffer, parse_frame, serve  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class StandIn:
+    """在后台线程中运行 serve()，可以停止后在同一端口重新启动"""
+
+    def __init__(self, port, rate=50.0):
+        self.port = port
+        self.rate = rate
+        self._loop = None
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._task = self._loop.create_task(serve('127.0.0.1', self.port, self.rate))
+            self._loop.call_soon(started.set)
+            try:
+                self._loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait(5)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join(5)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_parse_frame():
+    # 实时帧：整秒，换算为毫秒
+    assert parse_frame('{"voltage": 51.5, "timestamp": "12:00:01", "duration": 3}') == (51.5, '12:00:01', 3000)
+    # 连接时的状态帧：SD 卡记录的 ISO 时间与 Duration(ms)，不再换算
+    assert parse_frame('{"voltage": 51.5, "timestamp": "2025-05-13T22:04:08.265Z", "duration": 3265}') \
+        == (51.5, '2025-05-13T22:04:08.265Z', 3265)
+    assert parse_frame('{"voltage": 1}') == (1.0, '', 0)
+    for bad in ('not json', '{"timestamp": "12:00:01"}', '{"voltage": "x"}', '[1, 2]'):
+        assert parse_frame(bad) is None
+
+
+def test_voltage_buffer_wraps_in_order():
+    buffer = VoltageBuffer(capacity=4)
+    for i in range(10):
+        buffer.append(float(i), 100.0 + i, i)
+    times, voltages = buffer.snapshot()
+    assert len(buffer) == 4
+    assert list(times) == [6.0, 7.0, 8.0, 9.0]
+    assert list(voltages) == [106.0, 107.0, 108.0, 109.0]
+    assert buffer.latest() == (9.0, 109.0)
+    times, _ = buffer.snapshot(since=7.0)
+    assert list(times) == [8.0, 9.0]
+
+
+def test_handle_frame_logs_duration_ms(tmp_path):
+    client = AdsStreamClient("ws://127.0.0.1:9", buffer=VoltageBuffer(capacity=4), logs_dir=str(tmp_path))
+    client.handle_frame('{"voltage": 50.0, "timestamp": "2025-05-13T22:04:08.265Z", "duration": 12265}')
+    client.handle_frame('{"voltage": 51.0, "timestamp": "22:04:09", "duration": 13}')
+    client.log.close()
+    assert list(client.buffer.durations[:2]) == pytest.approx([12.265, 13.0])
+    with open(glob.glob(str(tmp_path / "ads_stream_*.csv"))[0]) as f:
+        rows = [line.split(',') for line in f.read().splitlines()[1:]]
+    assert [row[2] for row in rows] == ['12265', '13000']
+
+
+def test_client_receives_logs_and_reconnects(tmp_path):
+    port = free_port()
+    server = StandIn(port)
+    server.start()
+    client = AdsStreamClient(f"ws://127.0.0.1:{port}", buffer=VoltageBuffer(capacity=16),
+                             logs_dir=str(tmp_path), reconnect_delay=0.05, max_reconnect_delay=0.2)
+    events = []
+    client.add_listener(lambda topic, message: events.append((topic, message)))
+    client.start()
+    try:
+        assert wait_until(lambda: client.frames >= 20)
+        assert client.connected and client.bad_frames == 0
+        times, voltages = client.buffer.snapshot()
+        # 容量 16 的缓冲区只保留最新的样本，按本机时间排序
+        assert len(times) == 16
+        assert np.all(np.diff(times) > 0)
+        assert np.all((voltages > 40) & (voltages < 60))
+
+        client.handle_frame('garbage')
+        assert client.bad_frames == 1
+
+        # 服务器断开后客户端自动重连
+        server.stop()
+        assert wait_until(lambda: not client.connected)
+        frames = client.frames
+        server.start()
+        assert wait_until(lambda: client.connected and client.frames > frames + 5)
+    finally:
+        client.stop()
+        server.stop()
+
+    messages = [message for topic, message in events if topic == 'ads']
+    assert sum(message.startswith("Connected") for message in messages) >= 2
+    assert any(message.startswith("Disconnected") for message in messages)
+    assert client._loop.is_closed()
+
+    logs = glob.glob(str(tmp_path / "ads_stream_*.csv"))
+    assert logs
+    with open(logs[0]) as f:
+        rows = f.read().splitlines()
+    assert rows[0].startswith('Timestamp,Voltage(mV)')
+    assert len(rows) - 1 == client.frames
+    # 每次连接的第一帧是状态帧（毫秒），之后的实时帧为整秒换算的毫秒
+    durations = [int(row.split(',')[2]) for row in rows[1:]]
+    assert all(d % 1000 == 0 for d in durations[1:4])
@@ -0,0 +1,66 @@
+""".wavz 压缩命令的 --remove 校验"""
+import wave
+
+import numpy as np
+
+import audio_archive
+from audio_archive import ArchiveWriter, HEADER, BLOCK_HEADER
+
+
+def write_wav(path, frames=50000, rate=8000):
+    samples = (np.sin(np.arange(frames) * 0.05) * 10000).astype('<i2')
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+    return samples
+
+
+def test_remove_deletes_verified_source(tmp_path):
+    source = tmp_path / "rec.wav"
+    write_wav(source)
+    audio_archive.main(['compress', '--remove', '--block-frames', '8192', str(source)])
+    assert not source.exists()
+    assert (tmp_path / "rec.wavz").exists()
+
+
+def test_remove_keeps_source_when_block_is_corrupt(tmp_path, monkeypatch):
+    source = tmp_path / "rec.wav"
+    write_wav(source)
+    compress = audio_archive.compress_wav
+
+    def corrupt(*args, **kwargs):
+        target = compress(*args, **kwargs)
+        with open(target, 'r+b') as f:
+            # 第一个块的压缩数据中间翻转一个字节，索引与帧数保持完整
+            f.seek(HEADER.size)
+            count, length, crc = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+            f.seek(HEADER.size + BLOCK_HEADER.size + length // 2)
+            byte = f.read(1)
+            f.seek(-1, 1)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        return target
+
+    monkeypatch.setattr(audio_archive, 'compress_wav', corrupt)
+    audio_archive.main(['compress', '--remove', '--block-frames', '8192', str(source)])
+    assert source.exists()
+
+
+def test_remove_keeps_source_when_samples_differ(tmp_path, monkeypatch):
+    source = tmp_path / "rec.wav"
+    samples = write_wav(source)
+
+    def wrong(wav_path, archive_path=None, block_frames=65536, level=6, **kwargs):
+        # 帧数相同、块校验和也正确，但其中一个样本不同
+        target = str(tmp_path / "rec.wavz")
+        changed = samples.copy()
+        changed[12345] += 1
+        writer = ArchiveWriter(target, 8000, 1, block_frames, level)
+        writer.write(changed.reshape(-1, 1))
+        writer.close()
+        return target
+
+    monkeypatch.setattr(audio_archive, 'compress_wav', wrong)
+    audio_archive.main(['compress', '--remove', str(source)])
+    assert source.exists()
@@ -0,0 +1,42 @@
+"""AudioEngine 与模拟 sounddevice 后端"""
+import time
+
+import pytest
+
+from audio_engine import AudioEngine
+from protocol import parse_protocol
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = AudioEngine(recordings_dir=str(tmp_path / "recordings"), logs_dir=str(tmp_path / "logs"))
+    messages = []
+    engine.add_listener(lambda topic, message: messages.append((topic, message)))
+    engine.messages = messages
+    yield engine
+    engine.shutdown()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_start_recording_refused_during_duplex(engine):
+    steps = parse_protocol([{"tone": {"frequency": 1000, "duration": 0.5}}])
+    assert engine.start_duplex(steps)
+    # 双工流打开之前与之后都不能再打开一个输入流
+    assert not engine.start_recording()
+    assert wait_until(lambda: engine.recording)
+    assert not engine.start_recording()
+    assert all(source.stream is None for source in engine.inputs)
+    assert ('recording', "Already recording in the duplex protocol stream") in engine.messages
+
+    engine.stop_protocol()
+    assert wait_until(lambda: not engine.protocol_running and not engine.duplex)
+    assert engine.start_recording()
+    assert engine.stop_recording() >= 0
@@ -0,0 +1,147 @@
+"""ControlServer 与本地设备替身（MockDevice）之间的协调"""
+import asyncio
+import base64
+import json
+import os
+import socket
+import struct
+import time
+
+import pytest
+
+from audio_engine import AudioEngine
+from control_server import ControlServer, MockDevice, call
+
+
+@pytest.fixture
+def setup(tmp_path):
+    device = MockDevice()
+    device.start()
+    engine = AudioEngine(recordings_dir=str(tmp_path / "recordings"), logs_dir=str(tmp_path / "logs"))
+    server = ControlServer(engine, port=0, device=device.url, device_poll=0.05)
+    server.start()
+    yield server, device, engine
+    server.stop()
+    device.stop()
+    engine.shutdown()
+
+
+def device_commands(device):
+    return [path for path, _ in device.requests if path != '/api']
+
+
+def raw_request(port, data):
+    """发送原始字节，返回响应的状态码"""
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(data)
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            response += chunk
+    return int(response.split(b' ', 2)[1])
+
+
+def test_record_start_stop_calls_device(setup):
+    server, device, engine = setup
+    started = call(server.url, 'record/start')
+    assert started['ok'] and started['recording']
+    assert started['device'] == "Recording started"
+    assert device.recording and engine.recording
+
+    stopped = call(server.url, 'record/stop')
+    assert stopped['ok'] and not stopped['recording']
+    assert stopped['device'] == "Recording stopped"
+    assert not device.recording and not engine.recording
+    assert device_commands(device) == ['/start', '/stop']
+
+
+def test_record_without_device(setup):
+    server, device, engine = setup
+    assert call(server.url, 'record/start', device=0)['ok']
+    call(server.url, 'record/stop', device=0)
+    assert device_commands(device) == []
+
+
+def test_device_status_is_polled(setup):
+    server, device, engine = setup
+    deadline = time.monotonic() + 2
+    while server.device_status is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    status = call(server.url, 'status')
+    assert status['device']['sdcard'] is True
+    assert status['device']['recording'] is False
+
+
+async def websocket_session(port, command, until, timeout=5.0):
+    """连接 /ws，发送一条命令，收集消息直到 until(message) 为真"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    head = await reader.readuntil(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 101')
+
+    payload = json.dumps(command).encode()
+    mask = os.urandom(4)
+    writer.write(struct.pack('!BB', 0x81, 0x80 | len(payload)) + mask
+                 + bytes(b ^ mask[i & 3] for i, b in enumerate(payload)))
+    await writer.drain()
+
+    messages = []
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            first, second = await asyncio.wait_for(reader.readexactly(2), deadline - time.monotonic())
+            n = second & 0x7f
+            if n == 126:
+                n, = struct.unpack('!H', await reader.readexactly(2))
+            elif n == 127:
+                n, = struct.unpack('!Q', await reader.readexactly(8))
+            message = json.loads(await reader.readexactly(n))
+            messages.append(message)
+            if until(message):
+                break
+    finally:
+        writer.close()
+    return messages
+
+
+def test_stimulus_reports_onset_over_websocket(setup):
+    server, device, engine = setup
+    command = {'command': 'stimulus', 'frequency': 1200, 'duration': 0.1, 'wait': 0}
+    messages = asyncio.run(websocket_session(server.port, command, lambda m: m['type'] == 'onset'))
+
+    replies = [m for m in messages if m['type'] == 'reply']
+    onsets = [m for m in messages if m['type'] == 'onset']
+    assert replies and replies[0]['ok'] and replies[0]['command'] == 'stimulus'
+    assert onsets, messages
+    onset = onsets[0]
+    assert onset['session'] == replies[0]['session']
+    assert 0 <= onset['dispatch_ms'] < 1000
+    assert onset['onset_ms'] == pytest.approx(onset['dispatch_ms'] + onset['output_ms'], abs=0.01)
+    assert call(server.url, 'latency')['summary']['count'] == 1
+
+
+def test_stimulus_http_returns_latency(setup):
+    server, device, engine = setup
+    result = call(server.url, 'stimulus', frequency=440, duration=0.1)
+    assert result['ok']
+    assert result['latency']['onset_ms'] >= result['latency']['dispatch_ms']
+
+
+def test_malformed_requests_return_400(setup):
+    server, device, engine = setup
+    port = server.port
+    json_request = ("POST /stimulus HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                    "Content-Length: {length}\r\nConnection: close\r\n\r\n{body}")
+    for body in ('[1, 2, 3]', '{not json', '"text"'):
+        data = json_request.format(length=len(body), body=body).encode()
+        assert raw_request(port, data) == 400, body
+    assert raw_request(port, b"GARBAGE\r\n\r\n") == 400
+    assert raw_request(port, b"GET /status HTTP/1.1\r\nContent-Length: x\r\n\r\n") == 400
+    assert call(server.url, 'stimulus', waveform='bogus')['ok'] is False
+    assert call(server.url, 'stimulus', frequency='abc')['ok'] is False
+    # 连接错误之后服务器仍然正常工作
+    assert call(server.url, 'status')['ok']
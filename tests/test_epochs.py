@@ -0,0 +1,25 @@
+"""刺激片段截取的时间轴检查"""
+import numpy as np
+import pytest
+
+from ads_store import time_axis
+from epochs import extract_epochs, nearest_indices
+
+
+def test_raw_timestamps_are_rejected_unless_checked_by_caller():
+    # RTC 时间戳在整秒处倒退
+    timestamp = np.array([0, 500, 1900, 1400, 2000, 2500], dtype=np.int64)
+    duration = np.arange(6, dtype=np.int64) * 500
+    with pytest.raises(ValueError):
+        nearest_indices(timestamp, [1500])
+    time = time_axis(timestamp, duration)
+    assert nearest_indices(time, [1500], check=False)[0] == nearest_indices(time, [1500])[0]
+
+
+def test_extract_epochs_on_time_axis():
+    duration = np.arange(0, 600000, 500, dtype=np.int64)
+    time = time_axis(duration + 1000, duration)
+    voltage = np.arange(len(time), dtype=np.float32)
+    data, lags, valid = extract_epochs(time, voltage, [time[600]], 10, 10, check=False)
+    assert valid.all()
+    assert data[0, len(lags) // 2] == 600
@@ -0,0 +1,37 @@
+"""ADS 会话金字塔的时间轴"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from pyramid import build_ads_pyramid, Pyramid
+
+
+def write_sd_csv(path, seconds=300, rate=4):
+    """SD 卡版本的两列 CSV；时间戳为 RTC 整秒加 millis()%1000，在整秒附近会倒退"""
+    start = datetime(2025, 5, 13, 22, 4, 8)
+    with open(path, 'w') as f:
+        f.write("Timestamp,Voltage (mV)\n")
+        for i in range(seconds * rate):
+            elapsed_ms = i * 1000 // rate
+            # RTC 的秒比 millis() 的整秒早 300 毫秒进位
+            rtc = start + timedelta(seconds=(elapsed_ms + 300) // 1000)
+            stamp = rtc + timedelta(milliseconds=elapsed_ms % 1000)
+            f.write(f"{stamp.strftime('%Y-%m-%dT%H:%M:%S')}.{stamp.microsecond // 1000:03d}Z,{i}\n")
+
+
+def test_sd_card_axis_is_monotonic(tmp_path):
+    source = tmp_path / "ads_sd.csv"
+    write_sd_csv(source)
+    pyramid = Pyramid(build_ads_pyramid(str(source)))
+
+    raw_times = np.memmap(tmp_path / "ads_sd.pyramid" / "raw.t64", dtype=np.int64, mode='r')
+    assert np.all(np.diff(raw_times) >= 0)
+    for data, times in pyramid.levels:
+        if times is not None:
+            assert np.all(np.diff(times) >= 0)
+
+    times, values = pyramid.raw(100, 110)
+    assert np.all(np.diff(times) >= 0)
+    assert times[0] >= 100 and times[-1] <= 110
+    # 样本保持采集顺序，电压列就是行号
+    assert np.all(np.diff(values[:, 0]) == 1)
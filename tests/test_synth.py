@@ -0,0 +1,63 @@
+"""ToneSynth 与原 generate_waveform（整段 np.linspace）逐样本比较"""
+import numpy as np
+import pytest
+
+from synth import ToneSynth
+
+
+def baseline_waveform(frequency, duration, waveform='sine', amplitude=0.5, sample_rate=44100):
+    """原 AudioRecorder.generate_waveform"""
+    t = np.linspace(0, duration, int(sample_rate * duration), False)
+    if waveform == 'sine':
+        signal = amplitude * np.sin(2 * np.pi * frequency * t)
+    elif waveform == 'square':
+        signal = amplitude * np.sign(np.sin(2 * np.pi * frequency * t))
+    elif waveform == 'triangle':
+        signal = amplitude * (2/np.pi) * np.arcsin(np.sin(2 * np.pi * frequency * t))
+    elif waveform == 'sawtooth':
+        signal = amplitude * (2/np.pi) * np.arctan(np.tan(np.pi * frequency * t))
+    else:
+        signal = amplitude * np.sin(2 * np.pi * frequency * t)
+    return signal.astype(np.float32)
+
+
+def render_blocks(synth, block_frames):
+    return np.concatenate([block.copy() for block in synth.blocks(block_frames)])
+
+
+@pytest.mark.parametrize('amplitude', [0.5, 0.8])
+@pytest.mark.parametrize('frequency', [50, 250, 440, 997, 1000.3, 1200, 2205, 13.7])
+def test_square_matches_baseline(frequency, amplitude):
+    # 过零点上的符号与原实现一致，不同块大小结果相同
+    expected = baseline_waveform(frequency, 2.0, 'square', amplitude)
+    for block_frames in (441, 512, 1024):
+        synth = ToneSynth(frequency, 'square', amplitude, 44100, 2.0)
+        np.testing.assert_array_equal(render_blocks(synth, block_frames), expected)
+
+
+@pytest.mark.parametrize('waveform', ['sine', 'triangle', 'sawtooth'])
+@pytest.mark.parametrize('frequency', [50, 440, 997, 1000.3, 1200, 13.7])
+def test_waveforms_match_baseline(waveform, frequency):
+    # 锯齿波在跳变点取同一侧；其余样本只可能在 float32 舍入上差一个最低位
+    expected = baseline_waveform(frequency, 1.5, waveform, 0.8)
+    synth = ToneSynth(frequency, waveform, 0.8, 44100, 1.5)
+    np.testing.assert_allclose(render_blocks(synth, 512), expected, rtol=0, atol=1e-7)
+
+
+@pytest.mark.parametrize('waveform', ['sine', 'square', 'triangle', 'sawtooth', 'bl_square', 'bl_triangle', 'bl_sawtooth'])
+def test_prepared_render_allocates_no_sample_buffers(waveform):
+    # prepare() 之后 render() 只会产生少量与块大小无关的 Python 对象（视图、标量）
+    import tracemalloc
+    synth = ToneSynth(1200, waveform, 0.5, 44100)
+    synth.prepare(4096)
+    out = np.zeros(4096, np.float32)
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        for _ in range(20):
+            synth.render(out)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    # 一个 4096 帧的 float64 临时数组就有 32 KB
+    assert peak < 8192
@@ -0,0 +1,164 @@
+"""按电平触发的分段录音
+
+LevelTrigger 在音频回调中逐块计算 RMS 或峰值（所有声道一次完成），
+电平超过阈值时打开一个片段：先送出预触发缓冲区中的历史数据，再送出当前块；
+电平连续低于阈值 hold_seconds 后关闭片段。未触发时数据只进入预触发缓冲区，
+不写盘。回调只做 O(块长) 的计算和入队，文件在 SegmentRecorder 的线程中创建。
+
+送入队列的内容：
+    ('open', 起始帧, 起始时间, 触发电平)    片段开始；起始帧从录音开始计（不含暂停）
+    numpy 数组                               片段中的音频块
+    ('close', 结束帧)                        片段结束
+"""
+import threading
+import time
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+def block_level(block, mode='rms'):
+    """一块 (帧, 声道) 样本中最响声道的 RMS 或峰值"""
+    block = block.reshape(len(block), -1)
+    if mode == 'peak':
+        return float(np.abs(block).max())
+    return float(np.sqrt(np.mean(np.square(block, dtype=np.float32), axis=0)).max())
+
+
+def level_db(level):
+    """线性电平 -> dBFS"""
+    return 20 * np.log10(max(level, 1e-10))
+
+
+class LevelTrigger:
+    """带预触发缓冲区和保持时间的电平触发器（在回调线程中使用）"""
+
+    def __init__(self, sample_rate, channels=1, threshold_db=-40.0, mode='rms',
+                 pre_seconds=2.0, hold_seconds=3.0):
+        if mode not in ('rms', 'peak'):
+            raise ValueError(f"Unknown trigger mode: {mode}")
+        self.sample_rate = sample_rate
+        self.threshold_db = threshold_db
+        self.threshold = 10 ** (threshold_db / 20)
+        self.mode = mode
+        self.hold_frames = int(hold_seconds * sample_rate)
+        self.history = RingBuffer.from_seconds(max(pre_seconds, 1.0 / sample_rate), sample_rate, channels=channels)
+        self.pre_frames = int(pre_seconds * sample_rate)
+        self.active = False
+        self.frames = 0
+        self._quiet = 0
+
+    def process(self, block, out):
+        """处理一块输入，把需要保存的数据和片段标记放入队列 out"""
+        level = block_level(block, self.mode)
+        loud = level >= self.threshold
+        n = len(block)
+        if not self.active:
+            if loud:
+                pre = self.history.snapshot(self.pre_frames) if self.pre_frames else block[:0]
+                started = time.time() - (len(pre) + n) / self.sample_rate
+                self.active = True
+                self._quiet = 0
+                out.put(('open', self.frames - len(pre), started, level))
+                if len(pre):
+                    out.put(pre)
+                out.put(block.copy())
+            else:
+                self.history.write(block)
+        else:
+            out.put(block.copy())
+            self._quiet = 0 if loud else self._quiet + n
+            if self._quiet >= self.hold_frames:
+                self.active = False
+                self.history.clear()
+                out.put(('close', self.frames + n))
+        self.frames += n
+
+    def flush(self, out):
+        """录音停止时关闭尚未结束的片段"""
+        if self.active:
+            self.active = False
+            out.put(('close', self.frames))
+
+
+class SegmentRecorder:
+    """后台线程：按 LevelTrigger 的标记为每个片段创建写入器
+
+    open_writer(index) 返回已启动的写入器（write/close/files 与 StreamingWavWriter 相同）；
+    每个片段结束后调用 on_segment(segment)，segment 为
+    {'index', 'start_frame', 'frames', 'started', 'level', 'writer'}。
+    close/frames_written/duration/error 与 StreamingWavWriter 相同。
+    """
+
+    def __init__(self, source, sample_rate, open_writer, on_segment=None):
+        self.queue = source
+        self.sample_rate = sample_rate
+        self.open_writer = open_writer
+        self.on_segment = on_segment
+        self.segments = []
+        self.frames_written = 0
+        self.error = None
+        self._current = None
+        self._thread = None
+
+    @property
+    def duration(self):
+        """所有片段的总时长（秒）"""
+        return self.frames_written / self.sample_rate
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """处理完队列中剩余的数据，关闭最后一个片段"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._close_segment(None)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                if isinstance(item, tuple):
+                    if item[0] == 'open':
+                        self._open_segment(*item[1:])
+                    else:
+                        self._close_segment(item[1])
+                elif self._current is not None:
+                    self._current['writer'].write(item)
+                    self._current['frames'] += len(item)
+                    self.frames_written += len(item)
+            except Exception as e:
+                print(f"写入触发片段失败: {e}")
+                self.error = e
+
+    def _open_segment(self, start_frame, started, level):
+        self._close_segment(None)
+        index = len(self.segments) + 1
+        self._current = {
+            'index': index,
+            'start_frame': start_frame,
+            'frames': 0,
+            'started': started,
+            'level': level,
+            'writer': self.open_writer(index),
+        }
+
+    def _close_segment(self, end_frame):
+        segment = self._current
+        if segment is None:
+            return
+        self._current = None
+        writer = segment['writer']
+        writer.close()
+        if writer.error is not None and self.error is None:
+            self.error = writer.error
+        self.segments.append(segment)
+        if self.on_segment is not None:
+            self.on_segment(segment)
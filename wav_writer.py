@@ -0,0 +1,245 @@
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from features import FeatureTrack, features_path
+
+# 标准 PCM WAV 文件头长度
+WAV_HEADER_SIZE = 44
+
+
+def quantize_int16(block, out=None):
+    """把 [-1, 1] 的浮点样本量化为 int16，超出范围的样本被截断"""
+    block = np.asarray(block)
+    if out is None:
+        out = np.empty(block.shape, dtype=np.int16)
+    scaled = np.multiply(block, 32767, dtype=np.float32)
+    np.clip(scaled, -32768, 32767, out=scaled)
+    out[...] = scaled
+    return out
+
+
+def write_wav(filepath, data, sample_rate, channels=1, chunk_frames=65536):
+    """分块量化并写入整段信号，避免一次性生成完整的临时数组"""
+    data = np.asarray(data)
+    blocks = (data[start:start + chunk_frames] for start in range(0, len(data), chunk_frames))
+    return write_wav_blocks(filepath, blocks, sample_rate, channels)
+
+
+def write_wav_blocks(filepath, blocks, sample_rate, channels=1):
+    """把逐块产生的信号写入 WAV，写完后回填文件头，返回总帧数"""
+    frames = 0
+    with open(filepath, 'wb') as f:
+        f.write(_wav_header(sample_rate, channels, 0))
+        for block in blocks:
+            f.write(quantize_int16(block).tobytes())
+            frames += len(block)
+        f.seek(0)
+        f.write(_wav_header(sample_rate, channels, frames * channels * 2))
+    return frames
+
+
+def _wav_header(sample_rate, channels, data_bytes):
+    """生成 16-bit PCM WAV 文件头"""
+    block_align = channels * 2
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_bytes, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16,
+        b'data', data_bytes)
+
+
+class StreamingWavWriter:
+    """后台线程从队列取出音频块，逐块量化并追加写入 WAV 文件
+
+    内存占用与录音时长无关；文件头定期回填，进程崩溃时最多丢失
+    flush_interval 秒的数据。达到 max_seconds 或 max_bytes 时切换到新文件。
+    split_channels=True 时每个声道写入单独的单声道文件 <basename>_chN.wav，
+    整块只量化一次，再按声道分别写出。
+    子类可以通过 extension 与 _create/_write/_sync/_finish 写出其他格式。
+    features 为 {'interval', 'bands'} 时，同一线程为每个文件写出特征轨
+    <文件名>.features.csv（见 features.FeatureTrack）。
+    """
+
+    extension = '.wav'
+
+    def __init__(self, directory, basename, sample_rate, channels=1, source=None,
+                 max_seconds=None, max_bytes=1 << 31, flush_interval=2.0, split_channels=False,
+                 features=None):
+        self.directory = directory
+        self.basename = basename
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.split_channels = split_channels and channels > 1
+        # 每个文件中的声道数
+        self.file_channels = 1 if self.split_channels else channels
+        self.queue = source if source is not None else queue.Queue()
+        self.max_frames = int(max_seconds * sample_rate) if max_seconds else None
+        self.max_data_bytes = max_bytes - WAV_HEADER_SIZE if max_bytes else None
+        self.flush_interval = flush_interval
+        self.features = features
+
+        # 已完成和正在写入的文件：{'filename', 'frames', 'opened', 'channel'}
+        # channel 为声道序号，交错写入同一文件时为 None
+        self.files = []
+        self.frames_written = 0
+        self.error = None
+
+        self._handles = []
+        self._track = None
+        self._file_frames = 0
+        self._part = 0
+        self._thread = None
+        self._last_flush = 0.0
+
+    @property
+    def duration(self):
+        """已写入的总时长（秒）"""
+        return self.frames_written / self.sample_rate
+
+    def start(self):
+        """打开第一个文件并启动写入线程"""
+        self._open_next()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, block):
+        """提交一个音频块（调用方需保证 block 之后不再被修改）"""
+        self.queue.put(block)
+
+    def close(self):
+        """写完队列中剩余的数据，回填文件头并关闭文件"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._close_current()
+
+    def _filename(self, index, channel=None):
+        name = self.basename if channel is None else f"{self.basename}_ch{channel + 1}"
+        if index == 0:
+            return f"{name}{self.extension}"
+        return f"{name}_part{index + 1:03d}{self.extension}"
+
+    def _open_next(self):
+        self._close_current()
+        channels = range(self.channels) if self.split_channels else [None]
+        opened = time.time()
+        for channel in channels:
+            filename = self._filename(self._part, channel)
+            self._handles.append(self._create(os.path.join(self.directory, filename)))
+            self.files.append({'filename': filename, 'frames': 0, 'opened': opened, 'channel': channel})
+        if self.features is not None:
+            # 按声道分文件时所有声道共用一个特征文件
+            path = features_path(os.path.join(self.directory, self._filename(self._part)))
+            self._track = FeatureTrack(path, self.sample_rate, self.channels, **self.features)
+        self._part += 1
+        self._file_frames = 0
+        self._last_flush = time.monotonic()
+
+    def _close_current(self):
+        if not self._handles:
+            return
+        try:
+            for handle in self._handles:
+                self._finish(handle)
+        finally:
+            count = len(self._handles)
+            self._handles = []
+            track = self._track
+            self._track = None
+            if track is not None:
+                track.close()
+        # 没有写入任何数据的文件不保留
+        if self._file_frames == 0:
+            if track is not None:
+                os.remove(track.path)
+            for part in self.files[-count:]:
+                os.remove(os.path.join(self.directory, part['filename']))
+            del self.files[-count:]
+            self._part -= 1
+
+    def _patch_header(self):
+        """把所有打开的文件刷新到磁盘"""
+        for handle in self._handles:
+            self._sync(handle)
+        if self._track is not None:
+            self._track.flush()
+        self._last_flush = time.monotonic()
+
+    def _create(self, path):
+        """创建一个输出文件，返回文件句柄"""
+        f = open(path, 'wb')
+        f.write(_wav_header(self.sample_rate, self.file_channels, 0))
+        return f
+
+    def _write(self, handle, samples):
+        """追加 (帧, 声道) 的 int16 样本"""
+        handle.write(samples.tobytes())
+
+    def _sync(self, handle):
+        """回填 RIFF 与 data 块长度并刷新到磁盘"""
+        data_bytes = self._file_frames * self.file_channels * 2
+        handle.seek(4)
+        handle.write(struct.pack('<I', 36 + data_bytes))
+        handle.seek(40)
+        handle.write(struct.pack('<I', data_bytes))
+        handle.seek(0, os.SEEK_END)
+        handle.flush()
+        os.fsync(handle.fileno())
+
+    def _finish(self, handle):
+        """回填文件头并关闭文件"""
+        try:
+            self._sync(handle)
+        finally:
+            handle.close()
+
+    def _run(self):
+        while True:
+            try:
+                block = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                block = ()
+            if block is None:
+                break
+            # 写入出错后继续取出数据，防止队列无限增长
+            if self.error is not None:
+                continue
+            try:
+                if len(block):
+                    self._append(block)
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._patch_header()
+            except Exception as e:
+                print(f"写入录音文件失败: {e}")
+                self.error = e
+
+    def _append(self, block):
+        block = block.reshape(len(block), -1)
+        while len(block):
+            room = len(block)
+            if self.max_frames is not None:
+                room = min(room, self.max_frames - self._file_frames)
+            if self.max_data_bytes is not None:
+                room = min(room, self.max_data_bytes // (self.file_channels * 2) - self._file_frames)
+            if room <= 0:
+                self._open_next()
+                continue
+            samples = quantize_int16(block[:room])
+            if self.split_channels:
+                for channel, handle in enumerate(self._handles):
+                    self._write(handle, np.ascontiguousarray(samples[:, channel:channel + 1]))
+            else:
+                self._write(self._handles[0], samples)
+            if self._track is not None:
+                self._track.feed(block[:room])
+            self._file_frames += room
+            self.frames_written += room
+            for part in self.files[-len(self._handles):]:
+                part['frames'] = self._file_frames
+            block = block[room:]
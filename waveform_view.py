@@ -0,0 +1,145 @@
+import time
+
+import numpy as np
+
+
+def minmax_decimate(data, columns, out=None):
+    """把 data 分成 columns 段，每段取 (最小值, 最大值)，交错写入长度 2*columns 的数组
+
+    按像素列画出每段的最小/最大值，与逐点绘制在屏幕上看起来相同（不会漏掉尖峰），
+    但要画的点数只与窗口宽度有关。多声道数据 (帧, 声道) 沿第 0 维一次处理所有声道。
+    """
+    n = len(data)
+    if out is None:
+        out = np.empty((2 * columns,) + data.shape[1:], dtype=np.float32)
+    if n == 0:
+        out.fill(0)
+        return out
+    if n <= columns:
+        # 样本比像素少：每个样本占一列
+        out[:2 * n:2] = data
+        out[1:2 * n:2] = data
+        out[2 * n:] = data[-1]
+        return out
+    edges = (np.arange(columns) * n) // columns
+    out[0::2] = np.minimum.reduceat(data, edges, axis=0)
+    out[1::2] = np.maximum.reduceat(data, edges, axis=0)
+    return out
+
+
+class WaveformView:
+    """用 blitting 绘制的实时波形
+
+    坐标轴固定（x 为相对当前时刻的秒数，y 为 [-1, 1]），背景（坐标轴、刻度、标签）
+    只在完整重绘时缓存一次，之后每帧只恢复背景并重画一条曲线。
+    曲线按像素列做最小/最大值抽取，数秒的历史（几十万个样本）也只需画几千个点。
+    刷新间隔根据实际绘制耗时自动调整。
+
+    rings 可以是一个或多个（每个输入设备一个）环形缓冲区；多声道时每个声道一条曲线，
+    上下错开排列，抽取对一个设备的所有声道一次完成。
+    """
+
+    def __init__(self, ax, canvas, rings, sample_rate, min_interval=0.02, max_interval=0.25, budget=0.25):
+        self.ax = ax
+        self.canvas = canvas
+        self.rings = list(rings) if isinstance(rings, (list, tuple)) else [rings]
+        self.ring = self.rings[0]
+        self.sample_rate = sample_rate
+        # 绘制耗时最多占用主线程时间的 budget 比例
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget
+        self.interval = min_interval
+        self.frame_cost = 0.0
+        self.frames = 0
+
+        # 每个缓冲区的声道数，以及各声道在所有曲线中的位置
+        self._widths = [ring.channels or 1 for ring in self.rings]
+        self._starts = np.cumsum([0] + self._widths[:-1])
+        count = sum(self._widths)
+        # 第一个声道在最上方，相邻声道相隔 2（每个声道占 [-1, 1]）
+        self._offsets = (2.0 * np.arange(count - 1, -1, -1)).astype(np.float32)
+
+        seconds = self.ring.capacity / sample_rate
+        self.lines = [ax.plot([], [], lw=1, animated=True)[0] for _ in range(count)]
+        self.line = self.lines[0]
+        ax.set_xlim(-seconds, 0)
+        ax.set_ylim(-1, 2 * count - 1)
+        if count > 1:
+            labels = [f"Ch {channel + 1}" for width in self._widths for channel in range(width)]
+            if len(self.rings) > 1:
+                labels = [f"Dev {device + 1} Ch {channel + 1}"
+                          for device, width in enumerate(self._widths) for channel in range(width)]
+            ax.set_yticks(self._offsets)
+            ax.set_yticklabels(labels)
+        ax.set_autoscale_on(False)
+
+        self._samples = [np.empty((ring.capacity,) + ((ring.channels,) if ring.channels else ()), dtype=ring.dtype)
+                         for ring in self.rings]
+        self._columns = 0
+        self._x = None
+        self._y = None
+        self._last_head = None
+        self._background = None
+        canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        """完整重绘（首次显示、窗口缩放）后重新缓存背景"""
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._last_head = None
+        self._resize()
+        for line in self.lines:
+            self.ax.draw_artist(line)
+
+    def _resize(self):
+        """按坐标区的像素宽度准备 x 坐标与抽取缓冲区"""
+        columns = max(1, int(self.ax.bbox.width))
+        if columns == self._columns:
+            return
+        self._columns = columns
+        seconds = self.ring.capacity / self.sample_rate
+        self._x = np.repeat(np.linspace(-seconds, 0, columns, dtype=np.float32), 2)
+        self._y = np.empty((2 * columns, len(self.lines)), dtype=np.float32)
+
+    def clear(self):
+        """清除曲线（开始新的录音时调用）"""
+        for line in self.lines:
+            line.set_data([], [])
+        self._last_head = None
+        self.canvas.draw_idle()
+
+    def update(self):
+        """绘制一帧，返回距离下一帧的建议间隔（毫秒）"""
+        if self._background is None:
+            return int(self.interval * 1000)
+        head = tuple(ring.total_written for ring in self.rings)
+        if head == self._last_head:
+            # 没有新数据（例如暂停）时不重画
+            return int(self.interval * 1000)
+
+        started = time.perf_counter()
+        self._resize()
+        columns = self._columns
+        self.canvas.restore_region(self._background)
+        for ring, samples, start, width in zip(self.rings, self._samples, self._starts, self._widths):
+            data = ring.snapshot(out=samples)
+            if data.ndim == 1:
+                data = data[:, None]
+            # 历史尚未填满时，数据只占右侧的一部分列
+            used = max(1, min(columns, int(round(columns * len(data) / ring.capacity))))
+            y = self._y[-2 * used:, start:start + width]
+            minmax_decimate(data, used, y)
+            y += self._offsets[start:start + width]
+            for k in range(width):
+                line = self.lines[start + k]
+                line.set_data(self._x[-2 * used:], y[:, k])
+                self.ax.draw_artist(line)
+        self.canvas.blit(self.ax.bbox)
+        self._last_head = head
+
+        # 用指数平均的绘制耗时估计负载，绘制变慢时降低帧率
+        cost = time.perf_counter() - started
+        self.frame_cost = cost if self.frames == 0 else 0.8 * self.frame_cost + 0.2 * cost
+        self.frames += 1
+        self.interval = min(self.max_interval, max(self.min_interval, self.frame_cost / self.budget))
+        return int(self.interval * 1000)